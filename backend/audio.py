@@ -0,0 +1,277 @@
+import io
+import math
+import multiprocessing
+import os
+import queue
+import re
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import wave
+from collections import OrderedDict
+from dotenv import load_dotenv
+from .utils import content_hash
+
+# Server-side audio pipeline for chunks.
+#
+# A pluggable TTS engine renders chunk text to audio, which is cached on disk keyed
+# by (chunk content hash, voice) with LRU eviction by total size. A background
+# queue pre-renders the chunks following the one being listened to.
+
+load_dotenv()
+
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", "data/audio")
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+AUDIO_PREFETCH_CHUNKS = int(os.getenv("AUDIO_PREFETCH_CHUNKS", "3"))
+AUDIO_WORKERS = int(os.getenv("AUDIO_WORKERS", "1"))
+TTS_ENGINE = os.getenv("TTS_ENGINE", "stub")
+DEFAULT_VOICE = "default"
+# Chunks whose prefetch was scheduled recently; a player's repeated Range requests
+# for one of them don't list the chapter again
+RECENT_PREFETCHES = 1024
+
+
+class TTSEngine:
+    """Interface for text-to-speech engines"""
+
+    media_type = "audio/wav"
+    extension = "wav"
+
+    def synthesize(self, text, voice):
+        """Render text to audio and return the encoded bytes"""
+        raise NotImplementedError
+
+
+class StubTTSEngine(TTSEngine):
+    """Offline engine producing a short tone per word, for tests and development"""
+
+    sample_rate = 16000
+    seconds_per_word = 0.3
+
+    def synthesize(self, text, voice):
+        words = max(1, len(text.split()))
+        frames_per_word = int(self.sample_rate * self.seconds_per_word)
+        tone = b"".join(
+            struct.pack("<h", int(8000 * math.sin(2 * math.pi * 440 * i / self.sample_rate)))
+            for i in range(frames_per_word // 2)
+        )
+        silence = b"\x00\x00" * (frames_per_word - frames_per_word // 2)
+
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(self.sample_rate)
+            wav.writeframes((tone + silence) * words)
+        return buffer.getvalue()
+
+
+class EspeakTTSEngine(TTSEngine):
+    """Local offline engine using the espeak-ng command line tool"""
+
+    def __init__(self, executable=None):
+        self.executable = executable or shutil.which("espeak-ng") or shutil.which("espeak")
+        if not self.executable:
+            raise ValueError("espeak-ng is not installed")
+
+    def synthesize(self, text, voice):
+        command = [self.executable, "--stdout"]
+        if voice and voice != DEFAULT_VOICE:
+            command += ["-v", voice]
+        result = subprocess.run(command, input=text.encode("utf-8"), capture_output=True, check=True)
+        return result.stdout
+
+
+ENGINES = {
+    "stub": StubTTSEngine,
+    "espeak": EspeakTTSEngine,
+}
+
+
+def get_engine(name=TTS_ENGINE):
+    """Instantiate the configured TTS engine"""
+    if name not in ENGINES:
+        raise ValueError(f"Unknown TTS engine: {name}")
+    return ENGINES[name]()
+
+
+class AudioCache:
+    """On-disk audio cache with LRU eviction by total bytes
+
+    The directory is the only state, so worker processes sharing it see each
+    other's entries and evict against the same limit. Access bumps a file's
+    modification time, which orders eviction.
+    """
+
+    def __init__(self, root, max_bytes, extension="wav"):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(text_hash, voice):
+        return f"{text_hash}-{re.sub(r'[^A-Za-z0-9_.+-]', '_', voice)}"
+
+    def path(self, key):
+        return os.path.join(self.root, f"{key}.{self.extension}")
+
+    def get(self, key):
+        """Return the path of a cached entry and mark it recently used, or None"""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, data):
+        """Store audio bytes atomically and evict least recently used entries"""
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        path = self.path(key)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._evict(keep=path)
+        return path
+
+    def _evict(self, keep):
+        """Delete the least recently used files until the directory fits in max_bytes"""
+        files, total = [], 0
+        suffix = f".{self.extension}"
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if not entry.name.endswith(suffix):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Evicted by another process meanwhile
+                    continue
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+                total += stat.st_size
+        for _, path, size in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class AudioRenderer:
+    """Renders chunk audio on demand and pre-renders upcoming chunks in the background"""
+
+    def __init__(self, engine, cache, workers=1):
+        self.engine = engine
+        self.cache = cache
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._prefetched = OrderedDict()  # (chunk_id, voice) of recent prefetches, oldest first
+        self._lock = threading.Lock()
+        self._threads = []
+        self._shared = False
+
+    def share(self):
+        """Queue renders across forked workers so only the one that started rendering does them; call before forking"""
+        self._queue = multiprocessing.JoinableQueue()
+        self._shared = True
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"audio-render-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def render(self, text, voice=DEFAULT_VOICE):
+        """Return the cached audio path for text, rendering it first if needed"""
+        key = self.cache.key(content_hash(text), voice)
+        path = self.cache.get(key)
+        if path is None:
+            path = self.cache.put(key, self.engine.synthesize(text, voice))
+        return path
+
+    def enqueue(self, chunk_id, voice=DEFAULT_VOICE):
+        """Schedule a chunk for background rendering"""
+        if not self._shared:
+            # A shared queue is drained by another process; rendering skips cached audio there
+            with self._lock:
+                if (chunk_id, voice) in self._pending:
+                    return
+                self._pending.add((chunk_id, voice))
+        self._queue.put((chunk_id, voice))
+
+    def prefetch_after(self, chunk, voice=DEFAULT_VOICE, count=AUDIO_PREFETCH_CHUNKS):
+        """Schedule the next chunks of the chapter after the given one
+
+        Runs after the response is sent, so errors are only logged.
+        """
+        from . import pinecone_crud
+
+        if count <= 0:
+            return
+        key = (chunk["id"], voice)
+        with self._lock:
+            if key in self._prefetched:
+                self._prefetched.move_to_end(key)
+                return
+            self._prefetched[key] = True
+            if len(self._prefetched) > RECENT_PREFETCHES:
+                self._prefetched.popitem(last=False)
+        try:
+            chunks = pinecone_crud.get_chunks(
+                chapter_id=chunk["chapter_id"], book_id=chunk["book_id"], include_text=False
+            )
+            upcoming = [c for c in chunks if c["chunk_index"] > chunk["chunk_index"]][:count]
+            for upcoming_chunk in upcoming:
+                self.enqueue(upcoming_chunk["id"], voice)
+        except Exception as e:
+            # Let the next request for this chunk try again
+            with self._lock:
+                self._prefetched.pop(key, None)
+            print(f"Error scheduling audio prefetch after chunk {chunk['id']}: {e}")
+
+    def _run(self):
+        from . import pinecone_crud
+
+        while True:
+            chunk_id, voice = self._queue.get()
+            try:
+                chunk = pinecone_crud.get_chunk(chunk_id)
+                if chunk and chunk["original_text"]:
+                    self.render(chunk["original_text"], voice)
+            except Exception as e:
+                print(f"Error pre-rendering audio for chunk {chunk_id}: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard((chunk_id, voice))
+                self._queue.task_done()
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer():
+    """The process's audio renderer, created with the configured engine on first use"""
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            engine = get_engine()
+            _renderer = AudioRenderer(
+                engine,
+                AudioCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES, extension=engine.extension),
+                workers=AUDIO_WORKERS
+            )
+        return _renderer
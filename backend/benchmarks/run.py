@@ -0,0 +1,214 @@
+"""Endpoint benchmark suite.
+
+Drives the FastAPI app in-process against the in-memory vector store and a
+local SQL database, seeded with a synthetic library, and reports latency
+percentiles and throughput per route.
+
+Usage:
+    python -m backend.benchmarks.run --books 5 --chapters 10 --chunks 20 --output bench.json
+    python -m backend.benchmarks.run --baseline bench.json --max-regression 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies, errors, elapsed):
+    """Summarize per-request latencies (seconds) into a result row"""
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "throughput_rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def build_scenarios(manifest, rng, headers):
+    """Map route names to callables issuing one request against a TestClient"""
+    books = manifest["books"]
+    chapters = manifest["chapters"]
+    chunks = manifest["chunks"]
+
+    def pick(items):
+        return rng.choice(items)
+
+    return {
+        "GET /books/": lambda c: c.get("/books/"),
+        "GET /books/{book_id}": lambda c: c.get(f"/books/{pick(books)['id']}"),
+        "GET /chapters/?book_id": lambda c: c.get("/chapters/", params={"book_id": pick(books)["id"]}),
+        "GET /chapters/{chapter_id}": lambda c: c.get(f"/chapters/{pick(chapters)['id']}"),
+        "GET /chunks/?book_id": lambda c: c.get("/chunks/", params={"book_id": pick(books)["id"]}),
+        "GET /chunks/?book_id&chapter_number": lambda c: (lambda ch: c.get(
+            "/chunks/", params={"book_id": ch["book_id"], "chapter_number": ch["chapter_number"]}
+        ))(pick(chapters)),
+        "GET /chunks/{chunk_id}": lambda c: c.get(f"/chunks/{pick(chunks)['id']}"),
+        "POST /chunks/search": lambda c: c.post("/chunks/search", json={
+            "query": "river", "book_id": pick(books)["id"], "limit": 10
+        }),
+        "POST /chunks/context": lambda c: c.post("/chunks/context", json={
+            "chunk_ids": [pick(chunks)["id"] for _ in range(5)], "radius": 2
+        }),
+        "GET /users/history": lambda c: c.get("/users/history", headers=headers),
+        "POST /users/history": lambda c: c.post(
+            "/users/history", params={"book_id": pick(books)["id"]}, headers=headers
+        ),
+        "POST /chunks/": lambda c: (lambda ch: c.post("/chunks/", json={
+            "book_id": ch["book_id"], "chapter_number": ch["chapter_number"],
+            "original_text": f"An appended benchmark paragraph {rng.random()}."
+        }))(pick(chapters)),
+    }
+
+
+def run_route(app, call, iterations, concurrency):
+    """Run one scenario and return (latencies, errors, elapsed seconds)"""
+    from fastapi.testclient import TestClient
+
+    per_worker = [iterations // concurrency + (1 if i < iterations % concurrency else 0)
+                  for i in range(concurrency)]
+
+    def worker(count):
+        latencies, errors = [], 0
+        with TestClient(app) as client:
+            for _ in range(count):
+                start = time.perf_counter()
+                response = call(client)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code >= 400:
+                    errors += 1
+        return latencies, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, per_worker))
+    elapsed = time.perf_counter() - start
+
+    latencies = [value for worker_latencies, _ in results for value in worker_latencies]
+    errors = sum(worker_errors for _, worker_errors in results)
+    return latencies, errors, elapsed
+
+
+def compare(results, baseline, max_regression):
+    """Compare p95 latencies with a baseline report; return names of regressed routes"""
+    regressed = []
+    for route, row in results["routes"].items():
+        previous = baseline.get("routes", {}).get(route)
+        if not previous or not previous["p95_ms"]:
+            continue
+        change = (row["p95_ms"] - previous["p95_ms"]) / previous["p95_ms"]
+        marker = ""
+        if change > max_regression:
+            regressed.append(route)
+            marker = "  <-- REGRESSION"
+        print(f"{route:40s} p95 {previous['p95_ms']:9.3f} -> {row['p95_ms']:9.3f} ms ({change:+.1%}){marker}")
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark API endpoints in-process")
+    parser.add_argument("--books", type=int, default=5)
+    parser.add_argument("--chapters", type=int, default=10, help="Chapters per book")
+    parser.add_argument("--chunks", type=int, default=20, help="Chunks per chapter")
+    parser.add_argument("--words", type=int, default=120, help="Words per chunk")
+    parser.add_argument("--iterations", type=int, default=200, help="Requests per route")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests per route")
+    parser.add_argument("--concurrency", type=int, default=1, help="Concurrent client threads")
+    parser.add_argument("--routes", nargs="*", help="Only run routes containing one of these substrings")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database-url", help="SQLAlchemy URL (default: temporary SQLite file)")
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    parser.add_argument("--baseline", help="Compare against a previous JSON report")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Allowed relative p95 increase before failing the comparison")
+    args = parser.parse_args(argv)
+
+    # The app reads its configuration at import time, so set it up first
+    workdir = tempfile.mkdtemp(prefix="enhansa-bench-")
+    os.environ["VECTOR_STORE"] = "memory"
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["BLOB_STORE_DIR"] = os.path.join(workdir, "blobs")
+    os.environ["AUDIO_CACHE_DIR"] = os.path.join(workdir, "audio")
+
+    from fastapi.testclient import TestClient
+    from ..main import app
+    from .seed import seed_library
+
+    seed_start = time.perf_counter()
+    manifest = seed_library(
+        books=args.books, chapters=args.chapters, chunks=args.chunks,
+        words_per_chunk=args.words, seed=args.seed
+    )
+    seed_seconds = time.perf_counter() - seed_start
+    print(f"Seeded {len(manifest['books'])} books, {len(manifest['chapters'])} chapters, "
+          f"{len(manifest['chunks'])} chunks in {seed_seconds:.2f}s")
+
+    # Authenticated routes need a user and a bearer token
+    with TestClient(app) as client:
+        credentials = {"username": "bench", "password": "bench-password"}
+        client.post("/auth/register", json={**credentials, "email": "bench@example.com"})
+        token = client.post("/auth/token", data=credentials).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    rng = random.Random(args.seed)
+    scenarios = build_scenarios(manifest, rng, headers)
+    if args.routes:
+        scenarios = {name: call for name, call in scenarios.items()
+                     if any(part in name for part in args.routes)}
+
+    results = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "books": args.books,
+            "chapters_per_book": args.chapters,
+            "chunks_per_chapter": args.chunks,
+            "words_per_chunk": args.words,
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "seed_seconds": round(seed_seconds, 3),
+        },
+        "routes": {},
+    }
+
+    for name, call in scenarios.items():
+        run_route(app, call, args.warmup, 1)
+        latencies, errors, elapsed = run_route(app, call, args.iterations, args.concurrency)
+        row = summarize(latencies, errors, elapsed)
+        results["routes"][name] = row
+        print(f"{name:40s} p50 {row['p50_ms']:8.3f}  p95 {row['p95_ms']:8.3f}  "
+              f"p99 {row['p99_ms']:8.3f} ms  {row['throughput_rps']:9.1f} req/s  errors {errors}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.max_regression):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,48 @@
+import random
+
+# Synthetic library generator for benchmarks. Text is drawn from a small fixed
+# vocabulary so corpora are reproducible for a given seed.
+
+WORDS = (
+    "the a an and of to in on at by with from as it was were is be had have "
+    "river light house garden window letter morning evening silence voice "
+    "stranger journey promise shadow winter summer harbor forest memory road "
+    "walked whispered remembered opened watched waited followed listened "
+    "quiet old bright distant heavy gentle broken hidden golden narrow"
+).split()
+
+
+def generate_text(rng, words_per_chunk):
+    """Generate a pseudo-prose paragraph with the given number of words"""
+    words = [rng.choice(WORDS) for _ in range(words_per_chunk)]
+    words[0] = words[0].capitalize()
+    return " ".join(words) + "."
+
+
+def seed_library(books=5, chapters=10, chunks=20, words_per_chunk=120, seed=42):
+    """Create a synthetic library of books x chapters x chunks through pinecone_crud
+
+    Returns a manifest with the created IDs so benchmarks can address real records.
+    """
+    from .. import pinecone_crud
+
+    rng = random.Random(seed)
+    manifest = {"books": [], "chapters": [], "chunks": []}
+
+    for book_number in range(1, books + 1):
+        book = pinecone_crud.create_book(f"Synthetic Book {book_number}")
+        manifest["books"].append(book)
+
+        manifest["chapters"] += pinecone_crud.create_chapters(
+            book_id=book["id"],
+            chapters=[(chapter_number, f"Chapter {chapter_number}") for chapter_number in range(1, chapters + 1)]
+        )
+
+        for chapter_number in range(1, chapters + 1):
+            manifest["chunks"] += pinecone_crud.create_chunks(
+                book_id=book["id"],
+                chapter_number=chapter_number,
+                texts=[generate_text(rng, words_per_chunk) for _ in range(chunks)]
+            )
+
+    return manifest
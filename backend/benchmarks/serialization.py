@@ -0,0 +1,106 @@
+"""Serialization and compression benchmark for book-sized chunk payloads.
+
+Compares the default response path (response_model validation, jsonable
+encoding, stdlib json) with the fast path (orjson on prebuilt dicts), and the
+wire size of each available compression encoding.
+
+Usage:
+    python -m backend.benchmarks.serialization --chunks 5000 --output serialization.json
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from typing import List
+
+
+def cpu_time(func, repeat):
+    """Best-of-N process CPU time of a callable, in milliseconds"""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.process_time()
+        result = func()
+        best = min(best, time.process_time() - start)
+    return round(best * 1000, 3), result
+
+
+def build_payload(chunks, words_per_chunk, seed):
+    """Chunk dicts shaped like pinecone_crud.get_chunks output"""
+    from .seed import generate_text
+
+    rng = random.Random(seed)
+    return [
+        {
+            "id": f"{i:08d}-0000-0000-0000-000000000000",
+            "book_id": "book-0000",
+            "chapter_id": f"chapter-{i // 100:04d}",
+            "chunk_index": i % 100,
+            "original_text": generate_text(rng, words_per_chunk),
+        }
+        for i in range(chunks)
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark chunk payload serialization and compression")
+    parser.add_argument("--chunks", type=int, default=5000, help="Chunks in the payload")
+    parser.add_argument("--words", type=int, default=120, help="Words per chunk")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    args = parser.parse_args(argv)
+
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+    from .. import schemas
+    from ..compression import ENCODERS
+    from ..responses import FastJSONResponse
+
+    payload = build_payload(args.chunks, args.words, args.seed)
+    adapter = TypeAdapter(List[schemas.ChunkResponse])
+
+    def default_path():
+        validated = adapter.validate_python(payload)
+        return json.dumps(jsonable_encoder(validated), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def fast_path():
+        return FastJSONResponse(content=payload).body
+
+    default_ms, default_body = cpu_time(default_path, args.repeat)
+    fast_ms, fast_body = cpu_time(fast_path, args.repeat)
+
+    report = {
+        "chunks": args.chunks,
+        "words_per_chunk": args.words,
+        "serialization": {
+            "default_cpu_ms": default_ms,
+            "fast_cpu_ms": fast_ms,
+            "speedup": round(default_ms / fast_ms, 2) if fast_ms else None,
+        },
+        "compression": {"identity": {"bytes": len(fast_body), "cpu_ms": 0.0}},
+    }
+    print(f"Serialization of {args.chunks} chunks: default {default_ms} ms, fast {fast_ms} ms CPU")
+
+    for name, encoder in ENCODERS:
+        if encoder is None:
+            continue
+        encode_ms, compressed = cpu_time(lambda: encoder(fast_body), args.repeat)
+        report["compression"][name.decode()] = {
+            "bytes": len(compressed),
+            "ratio": round(len(fast_body) / len(compressed), 2),
+            "cpu_ms": encode_ms,
+        }
+    for name, row in report["compression"].items():
+        print(f"{name:9s} {row['bytes']:>12,d} bytes  {row['cpu_ms']:8.3f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
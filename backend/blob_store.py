@@ -0,0 +1,263 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import re
+import threading
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+# Content-addressed store for chunk text, kept outside of vector metadata.
+#
+# Each book has an append-only pack file of zlib-compressed records plus a small
+# index file mapping content hashes to (offset, length, dictionary) entries. Once a
+# book has enough chunks, a preset compression dictionary is trained from them so
+# that short chunks compress well. Reads go through a memory map of the pack.
+
+load_dotenv()
+
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", "data/blobs")
+# Number of blobs a book needs before a compression dictionary is trained
+DICT_TRAIN_SAMPLES = int(os.getenv("BLOB_DICT_TRAIN_SAMPLES", "64"))
+DICT_MAX_BYTES = 32 * 1024  # zlib only uses the last 32KB of a preset dictionary
+COMPRESSION_LEVEL = 6
+
+
+def content_ref(text):
+    """Content hash used as the key of a text blob"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def dictionary_id_of(dictionary):
+    """Short content hash naming a compression dictionary"""
+    return hashlib.sha256(dictionary).hexdigest()[:16]
+
+
+def _entry_dictionary(field):
+    """Dictionary ID of an index entry; None when it was compressed without one"""
+    return None if field == "-" else field
+
+
+def train_dictionary(samples, max_bytes=DICT_MAX_BYTES):
+    """Build a zlib preset dictionary from the most valuable repeated phrases
+
+    Phrases are scored by frequency times length; zlib favours matches near the
+    end of the dictionary, so the best phrases are placed last.
+    """
+    counts = Counter()
+    for text in samples:
+        words = re.findall(r"\S+\s*", text)
+        for n in (1, 2, 3, 4):
+            for i in range(len(words) - n + 1):
+                counts["".join(words[i:i + n])] += 1
+
+    scored = sorted(
+        ((count * len(phrase), phrase) for phrase, count in counts.items() if count > 1),
+        reverse=True
+    )
+    chosen, size = [], 0
+    for _, phrase in scored:
+        encoded = phrase.encode("utf-8")
+        if size + len(encoded) > max_bytes:
+            continue
+        chosen.append(encoded)
+        size += len(encoded)
+    return b"".join(reversed(chosen))
+
+
+class _BookPack:
+    """Pack file, index and optional dictionary of a single book
+
+    Several processes may write the same book (pre-forked workers, the job pool),
+    so appends hold an exclusive lock on the pack file from reading the index tail
+    to writing the index entry, and reads of the index take a shared lock. The
+    dictionary is created once and never replaced; index entries name the
+    dictionary they were compressed with. Within a process, the pack's own lock
+    guards its entries and memory map, so books are read independently.
+    """
+
+    def __init__(self, root, book_id):
+        self.pack_path = os.path.join(root, f"{book_id}.pack")
+        self.index_path = os.path.join(root, f"{book_id}.idx")
+        self.dict_path = os.path.join(root, f"{book_id}.dict")
+        self.entries = {}  # ref -> (offset, length, dictionary id or None)
+        self.pending_samples = []
+        self.dictionary = None
+        self.dictionary_id = None
+        self._mmap = None
+        self._index_position = 0
+        self.lock = threading.RLock()
+        self.refresh()
+
+    @contextmanager
+    def _locked(self, operation):
+        if operation == fcntl.LOCK_EX:
+            fd = os.open(self.pack_path, os.O_RDWR | os.O_CREAT, 0o644)
+        else:
+            try:
+                fd = os.open(self.pack_path, os.O_RDONLY)
+            except FileNotFoundError:
+                # Nothing written yet; no index to read either
+                yield
+                return
+        try:
+            fcntl.flock(fd, operation)
+            yield
+        finally:
+            os.close(fd)  # Releases the lock
+
+    def refresh(self):
+        """Pick up index entries appended since the last read, e.g. by another process"""
+        with self._locked(fcntl.LOCK_SH):
+            self._refresh()
+
+    def _refresh(self):
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                f.seek(self._index_position)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # Partial entry of an interrupted append; never completed
+                        break
+                    self._index_position += len(line)
+                    fields = line.split()
+                    if len(fields) != 4:
+                        continue
+                    ref, offset, length, dictionary_id = (field.decode() for field in fields)
+                    self.entries[ref] = (int(offset), int(length), _entry_dictionary(dictionary_id))
+        if self.dictionary is None and os.path.exists(self.dict_path):
+            with open(self.dict_path, "rb") as f:
+                self.dictionary = f.read()
+            self.dictionary_id = dictionary_id_of(self.dictionary)
+
+    def _compressor(self):
+        if self.dictionary is not None:
+            return zlib.compressobj(COMPRESSION_LEVEL, zdict=self.dictionary)
+        return zlib.compressobj(COMPRESSION_LEVEL)
+
+    def append(self, ref, text):
+        with self._locked(fcntl.LOCK_EX):
+            # Entries and the dictionary written by other processes
+            self._refresh()
+            if ref in self.entries:
+                return
+
+            compressor = self._compressor()
+            data = compressor.compress(text.encode("utf-8")) + compressor.flush()
+            with open(self.pack_path, "ab") as f:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(data)
+
+            line = f"{ref} {offset} {len(data)} {self.dictionary_id or '-'}\n".encode()
+            with open(self.index_path, "ab") as f:
+                if f.seek(0, os.SEEK_END) > self._index_position:
+                    # Terminate a partial entry left by an interrupted append
+                    line = b"\n" + line
+                f.write(line)
+                self._index_position = f.tell()
+            self.entries[ref] = (offset, len(data), self.dictionary_id)
+
+            if self.dictionary is None:
+                self.pending_samples.append(text)
+                if len(self.pending_samples) >= DICT_TRAIN_SAMPLES:
+                    self._create_dictionary(train_dictionary(self.pending_samples))
+                    self.pending_samples = []
+
+    def _create_dictionary(self, dictionary):
+        """Store the book's dictionary unless one exists; called with the exclusive lock held"""
+        try:
+            fd = os.open(self.dict_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            self._refresh()
+            return
+        with os.fdopen(fd, "wb") as f:
+            f.write(dictionary)
+        self.dictionary = dictionary
+        self.dictionary_id = dictionary_id_of(dictionary)
+
+    def read(self, ref):
+        offset, length, dictionary_id = self.entries[ref]
+        # Remap when the pack has grown past the current mapping
+        if self._mmap is None or offset + length > len(self._mmap):
+            if self._mmap is not None:
+                self._mmap.close()
+            with open(self.pack_path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = self._mmap[offset:offset + length]
+        if dictionary_id is None:
+            decompressor = zlib.decompressobj()
+        else:
+            if self.dictionary is None:
+                self.refresh()
+            if dictionary_id != self.dictionary_id:
+                raise ValueError(f"Blob {ref} was compressed with unknown dictionary {dictionary_id}")
+            decompressor = zlib.decompressobj(zdict=self.dictionary)
+        return (decompressor.decompress(data) + decompressor.flush()).decode("utf-8")
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+class BlobStore:
+    """Compressed, content-addressed text storage partitioned by book"""
+
+    def __init__(self, root):
+        self.root = root
+        self._packs = {}
+        self._lock = threading.Lock()  # Guards _packs; each pack has a lock of its own
+
+    def _pack(self, book_id):
+        if os.path.basename(book_id) != book_id or not book_id:
+            raise ValueError(f"Invalid book ID for blob storage: {book_id!r}")
+        with self._lock:
+            pack = self._packs.get(book_id)
+            if pack is None:
+                os.makedirs(self.root, exist_ok=True)
+                pack = self._packs[book_id] = _BookPack(self.root, book_id)
+        return pack
+
+    def put(self, book_id, text):
+        """Store text for a book and return its content reference"""
+        ref = content_ref(text)
+        pack = self._pack(book_id)
+        with pack.lock:
+            if ref not in pack.entries:
+                pack.refresh()
+            if ref not in pack.entries:
+                pack.append(ref, text)
+        return ref
+
+    def get(self, book_id, ref):
+        """Load the text for a reference, or None if it is unknown"""
+        pack = self._pack(book_id)
+        with pack.lock:
+            if ref not in pack.entries:
+                pack.refresh()
+            if ref not in pack.entries:
+                return None
+            return pack.read(ref)
+
+    def get_many(self, book_id, refs):
+        """Load several texts of one book, returning a dict keyed by reference"""
+        pack = self._pack(book_id)
+        with pack.lock:
+            if any(ref not in pack.entries for ref in refs):
+                pack.refresh()
+            return {ref: pack.read(ref) for ref in refs if ref in pack.entries}
+
+    def drop(self, book_id):
+        """Delete all stored text of a book"""
+        with self._lock:
+            pack = self._packs.pop(book_id, None) or _BookPack(self.root, book_id)
+        with pack.lock:
+            pack.close()
+            for path in (pack.pack_path, pack.index_path, pack.dict_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+blob_store = BlobStore(BLOB_STORE_DIR)
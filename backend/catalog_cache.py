@@ -0,0 +1,228 @@
+import fcntl
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from dotenv import load_dotenv
+
+# In-memory catalog of books and chapters for pre-fork serving.
+#
+# The serving master loads the catalog once before forking, so every worker starts
+# from the same copy-on-write pages instead of querying the vector store for book
+# and chapter lookups. Catalog writes are appended to a journal file shared by the
+# workers and a generation counter in shared memory is bumped; each worker applies
+# the new journal entries on its next read. The written records come from the
+# journal rather than from re-reading the vector store, which may not list them
+# yet. A full reload after CATALOG_CACHE_TTL_SECONDS picks up writes made outside
+# the server (the snapshot CLI, other hosts). Only enabled by backend.serve.
+
+load_dotenv()
+
+CATALOG_CACHE_TTL_SECONDS = float(os.getenv("CATALOG_CACHE_TTL_SECONDS", "60"))
+# Journal entries this recent are re-applied on top of a full reload, whose
+# listing may not show them yet
+RECENT_WRITE_SECONDS = 60
+
+
+class CatalogCache:
+    """Books and chapters served from memory, kept in step across forked workers"""
+
+    def __init__(self, ttl=CATALOG_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self.enabled = False
+        self._generation = None
+        self._seen_generation = 0
+        self._journal_path = None
+        self._journal_position = 0
+        self._recent = []  # (written at, change) applied from the journal
+        self._deleted_books = set()
+        self._books = {}
+        self._chapters = {}  # book_id -> {chapter_id: chapter}
+        self._chapter_books = {}  # chapter_id -> book_id
+        self._loaded_at = 0.0
+        self._reloading = False
+        self._lock = threading.Lock()
+
+    def enable(self):
+        """Load the catalog and serve it from memory from now on; call before forking workers"""
+        # Anonymous shared memory and a journal file, both inherited by forked workers
+        self._generation = multiprocessing.Value("q", 0)
+        fd, self._journal_path = tempfile.mkstemp(prefix="catalog-", suffix=".journal")
+        os.close(fd)
+        self._reload()
+        self.enabled = True
+
+    # Writes
+    def put_books(self, books):
+        self._publish([{"op": "book", "record": book} for book in books])
+
+    def put_chapters(self, chapters):
+        self._publish([{"op": "chapter", "record": chapter} for chapter in chapters])
+
+    def put_records(self, ids, metadatas):
+        """Publish catalog records given as vector store IDs and metadata"""
+        changes = []
+        for record_id, metadata in zip(ids, metadatas):
+            record = _record(record_id, metadata)
+            if record is not None:
+                changes.append({"op": metadata["type"], "record": record})
+        self._publish(changes)
+
+    def delete_book(self, book_id):
+        self._publish([{"op": "delete_book", "id": book_id}])
+
+    def _publish(self, changes):
+        """Append changes to the journal so every worker applies them"""
+        if not self.enabled or not changes:
+            return
+        now = time.time()
+        data = "".join(json.dumps({**change, "at": now}) + "\n" for change in changes).encode("utf-8")
+        with open(self._journal_path, "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(data)
+            f.flush()
+            with self._generation.get_lock():
+                self._generation.value += 1
+
+    def remember_book(self, book):
+        """Keep a book fetched from the vector store after a cache miss"""
+        with self._lock:
+            if book["id"] not in self._deleted_books:
+                self._books[book["id"]] = book
+
+    def remember_chapter(self, chapter):
+        """Keep a chapter fetched from the vector store after a cache miss"""
+        with self._lock:
+            if chapter["book_id"] not in self._deleted_books:
+                self._put_chapter(chapter)
+
+    # Applying changes
+    def _apply(self, change):
+        if change["op"] == "book":
+            book = change["record"]
+            self._books[book["id"]] = book
+            self._deleted_books.discard(book["id"])
+        elif change["op"] == "chapter":
+            self._put_chapter(change["record"])
+        elif change["op"] == "delete_book":
+            book_id = change["id"]
+            self._books.pop(book_id, None)
+            for chapter_id in self._chapters.pop(book_id, {}):
+                self._chapter_books.pop(chapter_id, None)
+            self._deleted_books.add(book_id)
+
+    def _put_chapter(self, chapter):
+        self._chapters.setdefault(chapter["book_id"], {})[chapter["id"]] = chapter
+        self._chapter_books[chapter["id"]] = chapter["book_id"]
+
+    def _catch_up(self):
+        """Apply journal entries written since the last read; called with the lock held"""
+        generation = self._generation.value
+        if generation == self._seen_generation:
+            return
+        with open(self._journal_path, "rb") as f:
+            f.seek(self._journal_position)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self._journal_position += len(line)
+                change = json.loads(line)
+                self._apply(change)
+                self._recent.append((change["at"], change))
+        self._seen_generation = generation
+
+    def _scan(self):
+        """Books and chapters listed by the vector store"""
+        from . import pinecone_crud
+
+        books, chapters, chapter_books = {}, {}, {}
+        for page in pinecone_crud.iter_catalog_records():
+            for record_id, metadata in page:
+                record = _record(record_id, metadata)
+                if metadata["type"] == "book":
+                    books[record_id] = record
+                else:
+                    chapters.setdefault(record["book_id"], {})[record_id] = record
+                    chapter_books[record_id] = record["book_id"]
+        return books, chapters, chapter_books
+
+    def _reload(self):
+        """Replace the copy with a full listing, keeping recent writes it may not show yet"""
+        started = time.time()
+        books, chapters, chapter_books = self._scan()
+        with self._lock:
+            self._books, self._chapters, self._chapter_books = books, chapters, chapter_books
+            self._deleted_books = set()
+            self._catch_up()
+            self._recent = [(at, change) for at, change in self._recent if at >= started - RECENT_WRITE_SECONDS]
+            for _, change in self._recent:
+                self._apply(change)
+            self._loaded_at = time.monotonic()
+
+    def _fresh(self):
+        with self._lock:
+            self._catch_up()
+            due = not self._reloading and time.monotonic() - self._loaded_at > self.ttl
+            if due:
+                self._reloading = True
+        if not due:
+            return
+        # Reads keep being served from the current copy while one thread reloads
+        try:
+            self._reload()
+        except Exception as e:
+            print(f"Error reloading catalog cache: {e}")
+            with self._lock:
+                self._loaded_at = time.monotonic()
+        finally:
+            self._reloading = False
+
+    # Reads; None means the cache doesn't know and the vector store must be asked
+    def books(self):
+        self._fresh()
+        with self._lock:
+            return [dict(book) for book in self._books.values()]
+
+    def book(self, book_id):
+        self._fresh()
+        with self._lock:
+            book = self._books.get(book_id)
+        return dict(book) if book else None
+
+    def chapters(self, book_id=None):
+        self._fresh()
+        with self._lock:
+            if book_id is None:
+                chapters = [dict(chapter) for book in self._chapters.values() for chapter in book.values()]
+            elif book_id in self._books or book_id in self._deleted_books:
+                chapters = [dict(chapter) for chapter in self._chapters.get(book_id, {}).values()]
+            else:
+                return None
+        chapters.sort(key=lambda x: x["chapter_number"])
+        return chapters
+
+    def chapter(self, chapter_id):
+        self._fresh()
+        with self._lock:
+            book_id = self._chapter_books.get(chapter_id)
+            chapter = self._chapters[book_id][chapter_id] if book_id else None
+        return dict(chapter) if chapter else None
+
+
+def _record(record_id, metadata):
+    """Book or chapter as returned by the API, from its vector store metadata"""
+    if metadata.get("type") == "book":
+        return {"id": record_id, "title": metadata.get("title")}
+    if metadata.get("type") == "chapter":
+        return {
+            "id": record_id,
+            "book_id": metadata.get("book_id"),
+            "chapter_number": metadata.get("chapter_number"),
+            "title": metadata.get("title")
+        }
+    return None
+
+
+catalog_cache = CatalogCache()
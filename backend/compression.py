@@ -0,0 +1,135 @@
+import gzip
+import os
+from dotenv import load_dotenv
+
+try:
+    import brotli
+except ImportError:  # Optional: br is only offered when installed
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # Optional: zstd is only offered when installed
+    zstandard = None
+
+# Negotiated response compression (zstd, br, gzip) for complete responses above a
+# size threshold. Streaming responses such as audio are passed through untouched.
+
+load_dotenv()
+
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+
+COMPRESSIBLE_TYPES = (b"application/json", b"text/", b"application/javascript")
+
+
+def _gzip(body):
+    return gzip.compress(body, compresslevel=5)
+
+
+def _brotli(body):
+    return brotli.compress(body, quality=4)
+
+
+def _zstd(body):
+    return zstandard.ZstdCompressor(level=3).compress(body)
+
+
+# In server preference order
+ENCODERS = [
+    (b"zstd", _zstd if zstandard else None),
+    (b"br", _brotli if brotli else None),
+    (b"gzip", _gzip),
+]
+
+
+def choose_encoding(accept_encoding):
+    """Pick the preferred available encoding accepted by the client (q > 0)"""
+    accepted = {}
+    for item in accept_encoding.lower().split(b","):
+        name, _, params = item.strip().partition(b";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith(b"q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+
+    for name, encoder in ENCODERS:
+        if encoder is None:
+            continue
+        quality = accepted.get(name, accepted.get(b"*", 0.0))
+        if quality > 0:
+            return name, encoder
+    return None, None
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing complete responses with the negotiated encoding"""
+
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = dict(scope["headers"]).get(b"accept-encoding", b"")
+        encoding, encoder = choose_encoding(accept_encoding) if accept_encoding else (None, None)
+        if encoder is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_wrapper(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            headers = start.get("headers", [])
+            header_names = {name.lower() for name, _ in headers}
+            content_type = next((value for name, value in headers if name.lower() == b"content-type"), b"")
+
+            if (
+                message.get("more_body", False)
+                or len(body) < self.minimum_size
+                or b"content-encoding" in header_names
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+            ):
+                await send(start)
+                await send(message)
+                return
+
+            compressed = encoder(body)
+            new_headers = []
+            vary = b"Accept-Encoding"
+            for name, value in headers:
+                lowered = name.lower()
+                if lowered == b"content-length":
+                    continue
+                if lowered == b"vary":
+                    vary = value + b", " + vary
+                    continue
+                if lowered == b"etag" and not value.startswith(b"W/"):
+                    # The encoded representation differs byte-wise, so the validator becomes weak
+                    value = b"W/" + value
+                new_headers.append((name, value))
+            new_headers += [
+                (b"content-encoding", encoding),
+                (b"content-length", str(len(compressed)).encode()),
+                (b"vary", vary),
+            ]
+            await send({**start, "headers": new_headers})
+            await send({**message, "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,158 @@
+import contextlib
+import functools
+import math
+import multiprocessing
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from .metrics import SINGLE_FLIGHT_CALLS, ADMISSION_SHED, ADMISSION_WAIT
+
+# Load shaping in front of the vector store.
+#
+# Concurrent identical reads are coalesced: the first caller runs the operation and
+# the others wait for its result instead of issuing their own. Every call that does
+# reach the backend takes a token from a token bucket (see InstrumentedIndex), so an
+# operation making several calls takes several tokens; when tokens run out callers
+# queue for a bounded time, and beyond that they are shed with a 503 and a
+# Retry-After header instead of piling up against the vector store's rate limits.
+
+load_dotenv()
+
+# Sustained vector store calls per second; 0 disables admission control
+VECTOR_STORE_RATE_LIMIT = float(os.getenv("VECTOR_STORE_RATE_LIMIT", "0"))
+VECTOR_STORE_BURST = int(os.getenv("VECTOR_STORE_BURST", "50"))
+# Callers allowed to wait for a token at once, and for how long
+VECTOR_STORE_MAX_QUEUE = int(os.getenv("VECTOR_STORE_MAX_QUEUE", "100"))
+VECTOR_STORE_MAX_WAIT_MS = int(os.getenv("VECTOR_STORE_MAX_WAIT_MS", "500"))
+
+
+class Overloaded(HTTPException):
+    """The vector store is saturated; answered as 503 with Retry-After"""
+
+    def __init__(self, retry_after):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry later",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+
+class TokenBucket:
+    """Token bucket admission control with a bounded wait queue"""
+
+    def __init__(self, rate, burst, max_queue, max_wait):
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        # Tokens left, time of the last refill and callers waiting
+        self._state = [float(burst), time.monotonic(), 0.0]
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def share(self):
+        """Keep the bucket in shared memory so forked workers draw from one budget; call before forking"""
+        self._state = multiprocessing.Array("d", self._state)
+        self._lock = self._state.get_lock()
+
+    @contextlib.contextmanager
+    def patient(self):
+        """Within this block callers wait for their token however long it takes, e.g. background jobs"""
+        self._local.patient = True
+        try:
+            yield
+        finally:
+            self._local.patient = False
+
+    def acquire(self, operation):
+        """Take a token, waiting for one if the queue has room; raises Overloaded otherwise"""
+        if self.rate <= 0:
+            return
+        state = self._state
+        with self._lock:
+            now = time.monotonic()
+            tokens = min(self.burst, state[0] + (now - state[1]) * self.rate)
+            state[1] = now
+            # Tokens may go negative: each waiter reserves the token it will get
+            wait = max(0.0, (1.0 - tokens) / self.rate)
+            patient = getattr(self._local, "patient", False)
+            if wait > 0 and not patient and (state[2] >= self.max_queue or wait > self.max_wait):
+                state[0] = tokens
+                ADMISSION_SHED.labels(operation=operation).inc()
+                raise Overloaded(retry_after=wait)
+            state[0] = tokens - 1.0
+            if wait > 0:
+                state[2] += 1
+
+        ADMISSION_WAIT.observe(wait)
+        if wait > 0:
+            try:
+                time.sleep(wait)
+            finally:
+                with self._lock:
+                    state[2] -= 1
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Lets concurrent callers with the same key share one execution"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, operation, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            SINGLE_FLIGHT_CALLS.labels(operation=operation, outcome="coalesced").inc()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            # Followers get their own list so callers can't affect each other's results
+            return list(call.result) if isinstance(call.result, list) else call.result
+
+        SINGLE_FLIGHT_CALLS.labels(operation=operation, outcome="executed").inc()
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+admission = TokenBucket(
+    rate=VECTOR_STORE_RATE_LIMIT,
+    burst=VECTOR_STORE_BURST,
+    max_queue=VECTOR_STORE_MAX_QUEUE,
+    max_wait=VECTOR_STORE_MAX_WAIT_MS / 1000
+)
+single_flight = SingleFlight()
+
+
+def coalesced(operation):
+    """Decorator letting concurrent calls of a vector store read with the same arguments share one execution"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (operation, args, tuple(sorted(kwargs.items())))
+            return single_flight.do(key, operation, lambda: func(*args, **kwargs))
+
+        return wrapper
+    return decorator
@@ -1,6 +1,8 @@
+from sqlalchemy import and_, func, or_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from . import models, schemas
-from datetime import datetime
+from datetime import date, datetime, timedelta
 import uuid
 from typing import List, Optional
 
@@ -19,17 +21,51 @@ def get_users(db: Session, skip: int = 0, limit: int = 100):
 
 # Reading history operations
 def create_reading_history(db: Session, user_id: uuid.UUID, book_id: str, chapter_id: Optional[str] = None, chunk_id: Optional[str] = None):
-    db_history = models.ReadingHistory(
-        user_id=user_id,
-        book_id=book_id,
-        chapter_id=chapter_id,
-        chunk_id=chunk_id
-    )
-    db.add(db_history)
-    db.commit()
+    for attempt in range(2):
+        db_history = models.ReadingHistory(
+            user_id=user_id,
+            book_id=book_id,
+            chapter_id=chapter_id,
+            chunk_id=chunk_id,
+            read_at=datetime.utcnow()
+        )
+        db.add(db_history)
+        roll_up_reading_event(db, db_history)
+        try:
+            db.commit()
+            break
+        except IntegrityError:
+            # A concurrent first event for the same book or day created the rollup row
+            db.rollback()
+            if attempt:
+                raise
     db.refresh(db_history)
     return db_history
 
+def create_reading_history_batch(db: Session, user_id: uuid.UUID, book_id: str, events: List[tuple]):
+    """Record (chapter_id, chunk_id, read_at) events of one book in a single transaction"""
+    for attempt in range(2):
+        db_events = []
+        for chapter_id, chunk_id, read_at in events:
+            db_history = models.ReadingHistory(
+                user_id=user_id,
+                book_id=book_id,
+                chapter_id=chapter_id,
+                chunk_id=chunk_id,
+                read_at=read_at
+            )
+            db.add(db_history)
+            roll_up_reading_event(db, db_history)
+            db_events.append(db_history)
+        try:
+            db.commit()
+            return db_events
+        except IntegrityError:
+            # A concurrent first event for the same book or day created the rollup row
+            db.rollback()
+            if attempt:
+                raise
+
 def get_user_reading_history(db: Session, user_id: uuid.UUID, skip: int = 0, limit: int = 100):
     return db.query(models.ReadingHistory)\
         .filter(models.ReadingHistory.user_id == user_id)\
@@ -46,6 +82,138 @@ def get_last_read(db: Session, user_id: uuid.UUID, book_id: str):
         .order_by(models.ReadingHistory.read_at.desc())\
         .first()
 
+# Reading stats rollups
+# Time between consecutive events counts as reading unless the gap is longer than this
+READING_SESSION_GAP = timedelta(minutes=10)
+
+def roll_up_reading_event(db: Session, event: models.ReadingHistory):
+    """Fold a reading history event into the per book, per day and per chapter rollups; the caller commits"""
+    book_stat = db.query(models.ReadingBookStat)\
+        .filter(
+            models.ReadingBookStat.user_id == event.user_id,
+            models.ReadingBookStat.book_id == event.book_id
+        ).with_for_update().first()
+    seconds = 0
+    if book_stat is None:
+        book_stat = models.ReadingBookStat(
+            user_id=event.user_id,
+            book_id=event.book_id,
+            events=0,
+            chapters_read=0,
+            seconds_read=0,
+            first_read_at=event.read_at,
+            last_read_at=event.read_at
+        )
+        db.add(book_stat)
+    elif event.read_at >= book_stat.last_read_at:
+        gap = event.read_at - book_stat.last_read_at
+        if gap <= READING_SESSION_GAP:
+            seconds = int(gap.total_seconds())
+
+    day_stat = db.query(models.ReadingDailyStat)\
+        .filter(
+            models.ReadingDailyStat.user_id == event.user_id,
+            models.ReadingDailyStat.book_id == event.book_id,
+            models.ReadingDailyStat.day == event.read_at.date()
+        ).with_for_update().first()
+    if day_stat is None:
+        day_stat = models.ReadingDailyStat(
+            user_id=event.user_id,
+            book_id=event.book_id,
+            day=event.read_at.date(),
+            events=0,
+            chapters_started=0,
+            seconds_read=0
+        )
+        db.add(day_stat)
+
+    if event.chapter_id:
+        chapter_seen = db.query(models.ReadingChapterStat.id)\
+            .filter(
+                models.ReadingChapterStat.user_id == event.user_id,
+                models.ReadingChapterStat.chapter_id == event.chapter_id
+            ).first()
+        if chapter_seen is None:
+            db.add(models.ReadingChapterStat(
+                user_id=event.user_id,
+                book_id=event.book_id,
+                chapter_id=event.chapter_id,
+                first_read_at=event.read_at
+            ))
+            book_stat.chapters_read += 1
+            day_stat.chapters_started += 1
+
+    book_stat.events += 1
+    book_stat.seconds_read += seconds
+    day_stat.events += 1
+    day_stat.seconds_read += seconds
+    book_stat.first_read_at = min(book_stat.first_read_at, event.read_at)
+    # Older events folded in by compaction don't move the last read position
+    if event.read_at >= book_stat.last_read_at:
+        book_stat.last_read_at = event.read_at
+        book_stat.last_chapter_id = event.chapter_id
+        book_stat.last_chunk_id = event.chunk_id
+    event.rolled_up = True
+    # Sessions don't autoflush; later events in the same batch must see these rows
+    db.flush()
+
+def get_reading_book_stats(db: Session, user_id: uuid.UUID):
+    return db.query(models.ReadingBookStat)\
+        .filter(models.ReadingBookStat.user_id == user_id)\
+        .order_by(models.ReadingBookStat.last_read_at.desc())\
+        .all()
+
+def get_reading_book_stat(db: Session, user_id: uuid.UUID, book_id: str):
+    return db.query(models.ReadingBookStat)\
+        .filter(
+            models.ReadingBookStat.user_id == user_id,
+            models.ReadingBookStat.book_id == book_id
+        ).first()
+
+def get_reading_daily_stats(db: Session, user_id: uuid.UUID, since: date, book_id: Optional[str] = None):
+    """Per-day totals from the daily rollups, across books unless book_id is given"""
+    query = db.query(
+        models.ReadingDailyStat.day,
+        func.sum(models.ReadingDailyStat.events).label("events"),
+        func.sum(models.ReadingDailyStat.chapters_started).label("chapters_started"),
+        func.sum(models.ReadingDailyStat.seconds_read).label("seconds_read")
+    ).filter(
+        models.ReadingDailyStat.user_id == user_id,
+        models.ReadingDailyStat.day >= since
+    )
+    if book_id:
+        query = query.filter(models.ReadingDailyStat.book_id == book_id)
+    return query.group_by(models.ReadingDailyStat.day).order_by(models.ReadingDailyStat.day).all()
+
+def get_unrolled_reading_history(db: Session, limit: int = 1000):
+    """Oldest events not yet counted in the rollups, e.g. recorded before rollups existed"""
+    return db.query(models.ReadingHistory)\
+        .filter(models.ReadingHistory.rolled_up.is_(False))\
+        .order_by(models.ReadingHistory.read_at)\
+        .limit(limit).all()
+
+def roll_up_reading_history(db: Session, events: List[models.ReadingHistory]):
+    for event in events:
+        roll_up_reading_event(db, event)
+    db.commit()
+
+def delete_compacted_reading_history(db: Session, before: datetime):
+    """Delete rolled-up events older than the cutoff, keeping each user's last event per book"""
+    newer_event = db.query(models.ReadingBookStat.id)\
+        .filter(
+            models.ReadingBookStat.user_id == models.ReadingHistory.user_id,
+            models.ReadingBookStat.book_id == models.ReadingHistory.book_id,
+            models.ReadingBookStat.last_read_at > models.ReadingHistory.read_at
+        ).exists()
+    count = db.query(models.ReadingHistory)\
+        .filter(
+            models.ReadingHistory.rolled_up.is_(True),
+            models.ReadingHistory.read_at < before,
+            newer_event
+        ).delete(synchronize_session=False)
+    db.commit()
+    return count
+
 # User favorites operations
 def add_favorite(db: Session, user_id: uuid.UUID, book_id: str):
     # Check if already favorited
@@ -85,3 +253,334 @@ def get_user_favorites(db: Session, user_id: uuid.UUID):
         .filter(models.UserFavorite.user_id == user_id)\
         .order_by(models.UserFavorite.added_at.desc())\
         .all()
+
+# Interaction feeds for the recommender; rows at or after `since` (all rows when None)
+def get_book_reads_since(db: Session, since: Optional[datetime] = None):
+    query = db.query(models.ReadingBookStat.user_id, models.ReadingBookStat.book_id, models.ReadingBookStat.last_read_at)
+    if since is not None:
+        query = query.filter(models.ReadingBookStat.last_read_at >= since)
+    return query.order_by(models.ReadingBookStat.last_read_at).all()
+
+def get_favorites_since(db: Session, since: Optional[datetime] = None):
+    query = db.query(models.UserFavorite.user_id, models.UserFavorite.book_id, models.UserFavorite.added_at)
+    if since is not None:
+        query = query.filter(models.UserFavorite.added_at >= since)
+    return query.order_by(models.UserFavorite.added_at).all()
+
+# Job operations
+def create_job(db: Session, job_type: str, payload: dict, total: int = 0):
+    db_job = models.Job(job_type=job_type, payload=payload, total=total)
+    db.add(db_job)
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+def get_job(db: Session, job_id: uuid.UUID):
+    return db.query(models.Job).filter(models.Job.id == job_id).first()
+
+def get_jobs(db: Session, status: Optional[str] = None, skip: int = 0, limit: int = 100):
+    query = db.query(models.Job)
+    if status:
+        query = query.filter(models.Job.status == status)
+    return query.order_by(models.Job.created_at.desc()).offset(skip).limit(limit).all()
+
+def requeue_stale_jobs(db: Session, stale_after: timedelta, max_attempts: Optional[int] = None):
+    """Put running jobs whose worker stopped sending heartbeats back in the queue
+
+    Jobs already started max_attempts times are marked failed instead.
+    """
+    now = datetime.utcnow()
+    stale = db.query(models.Job)\
+        .filter(models.Job.status == "running", models.Job.heartbeat_at < now - stale_after)
+    if max_attempts is not None:
+        stale.filter(models.Job.attempts >= max_attempts).update({
+            "status": "failed",
+            "error": f"Worker stopped responding on each of {max_attempts} attempts",
+            "finished_at": now
+        }, synchronize_session=False)
+    count = stale.update({"status": "queued"}, synchronize_session=False)
+    db.commit()
+    return count
+
+def claim_next_job(db: Session, job_types: List[str]):
+    """Atomically move the oldest queued job to running; returns None if there is none"""
+    candidates = db.query(models.Job.id)\
+        .filter(models.Job.status == "queued", models.Job.job_type.in_(job_types))\
+        .order_by(models.Job.created_at)\
+        .limit(5).all()
+    for (job_id,) in candidates:
+        now = datetime.utcnow()
+        # The status condition makes the claim safe across concurrent workers
+        claimed = db.query(models.Job)\
+            .filter(models.Job.id == job_id, models.Job.status == "queued")\
+            .update({
+                "status": "running",
+                "started_at": now,
+                "heartbeat_at": now,
+                "attempts": models.Job.attempts + 1
+            }, synchronize_session=False)
+        db.commit()
+        if claimed:
+            return get_job(db, job_id)
+    return None
+
+def requeue_job(db: Session, job_id: uuid.UUID):
+    db.query(models.Job).filter(models.Job.id == job_id).update({"status": "queued"}, synchronize_session=False)
+    db.commit()
+
+def update_job_progress(db: Session, job_id: uuid.UUID, progress: int, total: Optional[int] = None):
+    values = {"progress": progress, "heartbeat_at": datetime.utcnow()}
+    if total is not None:
+        values["total"] = total
+    db.query(models.Job).filter(models.Job.id == job_id).update(values, synchronize_session=False)
+    db.commit()
+
+def finish_job(db: Session, job_id: uuid.UUID, status: str, result: Optional[dict] = None, error: Optional[str] = None):
+    db.query(models.Job).filter(models.Job.id == job_id).update({
+        "status": status,
+        "result": result,
+        "error": error,
+        "finished_at": datetime.utcnow()
+    }, synchronize_session=False)
+    db.commit()
+
+
+# Chapter number operations
+def count_chapter_numbers(db: Session, book_id: str):
+    return db.query(func.count(models.ChapterNumber.id)).filter(models.ChapterNumber.book_id == book_id).scalar()
+
+def reserve_chapter_numbers(db: Session, book_id: str, chapters: List[tuple]):
+    """Reserve (chapter_number, chapter_id) pairs of a book in one transaction
+
+    Raises ValueError naming the numbers already taken; nothing is reserved then.
+    """
+    db.add_all([
+        models.ChapterNumber(book_id=book_id, chapter_number=chapter_number, chapter_id=chapter_id)
+        for chapter_number, chapter_id in chapters
+    ])
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        taken = db.query(models.ChapterNumber.chapter_number)\
+            .filter(
+                models.ChapterNumber.book_id == book_id,
+                models.ChapterNumber.chapter_number.in_([number for number, _ in chapters])
+            )\
+            .order_by(models.ChapterNumber.chapter_number).all()
+        numbers = ", ".join(str(number) for (number,) in taken) or "?"
+        raise ValueError(f"Chapter {numbers} already exists for book {book_id}")
+
+def register_chapter_numbers(db: Session, book_id: str, chapters: List[tuple]):
+    """Record (chapter_number, chapter_id) pairs of existing chapters, skipping numbers already recorded"""
+    for attempt in range(2):
+        recorded = {
+            number for (number,) in db.query(models.ChapterNumber.chapter_number)
+            .filter(models.ChapterNumber.book_id == book_id).all()
+        }
+        db.add_all([
+            models.ChapterNumber(book_id=book_id, chapter_number=chapter_number, chapter_id=chapter_id)
+            for chapter_number, chapter_id in chapters
+            if chapter_number not in recorded
+        ])
+        try:
+            db.commit()
+            return
+        except IntegrityError:
+            # Recorded concurrently; skip those and try again
+            db.rollback()
+            if attempt:
+                raise
+
+def get_chapter_number_reservations(db: Session, book_id: str, chapter_numbers: List[int]):
+    return db.query(models.ChapterNumber)\
+        .filter(models.ChapterNumber.book_id == book_id, models.ChapterNumber.chapter_number.in_(chapter_numbers))\
+        .all()
+
+def release_chapter_numbers(db: Session, book_id: str, chapter_ids: Optional[List[str]] = None):
+    """Free the chapter numbers of the given chapters, or of the whole book"""
+    query = db.query(models.ChapterNumber).filter(models.ChapterNumber.book_id == book_id)
+    if chapter_ids is not None:
+        query = query.filter(models.ChapterNumber.chapter_id.in_(chapter_ids))
+    count = query.delete(synchronize_session=False)
+    db.commit()
+    return count
+
+# Chunk position operations
+def count_chunk_positions(db: Session, chapter_id: str):
+    return db.query(func.count(models.ChunkPosition.id)).filter(models.ChunkPosition.chapter_id == chapter_id).scalar()
+
+def next_chunk_index(db: Session, chapter_id: str):
+    last = db.query(func.max(models.ChunkPosition.chunk_index)).filter(models.ChunkPosition.chapter_id == chapter_id).scalar()
+    return 0 if last is None else last + 1
+
+def reserve_chunk_positions(db: Session, book_id: str, chapter_id: str, chunk_ids: List[str], start: int,
+                            content_hashes: Optional[List[str]] = None, attempts: int = 5):
+    """Give chunks consecutive indexes in a chapter from `start`, or after the last taken index
+
+    Content hashes, if given, are recorded in the chunk content index in the same
+    transaction. Returns the first index assigned.
+    """
+    for attempt in range(attempts):
+        db.add_all([
+            models.ChunkPosition(book_id=book_id, chapter_id=chapter_id, chunk_index=start + offset, chunk_id=chunk_id)
+            for offset, chunk_id in enumerate(chunk_ids)
+        ])
+        if content_hashes:
+            db.add_all([
+                models.ChunkContent(book_id=book_id, chunk_id=chunk_id, content_hash=text_hash)
+                for chunk_id, text_hash in zip(chunk_ids, content_hashes)
+            ])
+        try:
+            db.commit()
+            return start
+        except IntegrityError:
+            # Taken by a concurrent insert into the same chapter
+            db.rollback()
+            start = max(start, next_chunk_index(db, chapter_id))
+    raise ValueError(f"Could not assign chunk positions in chapter {chapter_id}")
+
+def register_chunk_positions(db: Session, book_id: str, positions: List[tuple]):
+    """Record (chapter_id, chunk_index, chunk_id) of existing chunks, skipping positions already recorded"""
+    for attempt in range(2):
+        chapter_ids = {chapter_id for chapter_id, _, _ in positions}
+        recorded = set(
+            db.query(models.ChunkPosition.chapter_id, models.ChunkPosition.chunk_index)
+            .filter(models.ChunkPosition.chapter_id.in_(chapter_ids)).all()
+        )
+        for chapter_id, chunk_index, chunk_id in positions:
+            if (chapter_id, chunk_index) not in recorded:
+                recorded.add((chapter_id, chunk_index))
+                db.add(models.ChunkPosition(book_id=book_id, chapter_id=chapter_id, chunk_index=chunk_index, chunk_id=chunk_id))
+        try:
+            db.commit()
+            return
+        except IntegrityError:
+            # Recorded concurrently; skip those and try again
+            db.rollback()
+            if attempt:
+                raise
+
+def get_next_chunk_positions(db: Session, chapter_id: str, after_index: int, limit: int):
+    """Positions following `after_index` in a chapter, in reading order"""
+    return db.query(models.ChunkPosition)\
+        .filter(models.ChunkPosition.chapter_id == chapter_id, models.ChunkPosition.chunk_index > after_index)\
+        .order_by(models.ChunkPosition.chunk_index)\
+        .limit(limit).all()
+
+def get_chunk_positions(db: Session, chunk_ids: List[str]):
+    return db.query(models.ChunkPosition).filter(models.ChunkPosition.chunk_id.in_(chunk_ids)).all()
+
+def get_chunk_windows(db: Session, centers: List[tuple], radius: int):
+    """Positions within `radius` of each (chapter_id, chunk_index) center, in one ordered range query"""
+    if not centers:
+        return []
+    return db.query(models.ChunkPosition)\
+        .filter(or_(*[
+            and_(
+                models.ChunkPosition.chapter_id == chapter_id,
+                models.ChunkPosition.chunk_index.between(chunk_index - radius, chunk_index + radius)
+            )
+            for chapter_id, chunk_index in set(centers)
+        ]))\
+        .order_by(models.ChunkPosition.chapter_id, models.ChunkPosition.chunk_index).all()
+
+def release_chunk_positions(db: Session, book_id: str, chunk_ids: Optional[List[str]] = None):
+    """Free the positions of the given chunks, or of the whole book"""
+    query = db.query(models.ChunkPosition).filter(models.ChunkPosition.book_id == book_id)
+    if chunk_ids is not None:
+        query = query.filter(models.ChunkPosition.chunk_id.in_(chunk_ids))
+    count = query.delete(synchronize_session=False)
+    db.commit()
+    return count
+
+# Chunk content operations
+def register_chunk_contents(db: Session, book_id: str, contents: List[tuple]):
+    """Record (chunk_id, content_hash) of chunks, skipping chunks already recorded"""
+    for attempt in range(2):
+        recorded = {
+            chunk_id for (chunk_id,) in db.query(models.ChunkContent.chunk_id)
+            .filter(models.ChunkContent.chunk_id.in_([chunk_id for chunk_id, _ in contents])).all()
+        }
+        db.add_all([
+            models.ChunkContent(book_id=book_id, chunk_id=chunk_id, content_hash=text_hash)
+            for chunk_id, text_hash in contents
+            if chunk_id not in recorded
+        ])
+        try:
+            db.commit()
+            return
+        except IntegrityError:
+            # Recorded concurrently; skip those and try again
+            db.rollback()
+            if attempt:
+                raise
+
+def find_chunk_contents(db: Session, content_hashes: List[str], per_hash: int = 3):
+    """Up to `per_hash` (book_id, chunk_id) pairs holding each content hash"""
+    found = {}
+    rows = db.query(models.ChunkContent)\
+        .filter(models.ChunkContent.content_hash.in_(content_hashes))\
+        .yield_per(1000)
+    for row in rows:
+        chunks = found.setdefault(row.content_hash, [])
+        if len(chunks) < per_hash:
+            chunks.append((row.book_id, row.chunk_id))
+    return found
+
+def release_chunk_contents(db: Session, book_id: str, chunk_ids: Optional[List[str]] = None):
+    """Forget the content of the given chunks, or of the whole book"""
+    query = db.query(models.ChunkContent).filter(models.ChunkContent.book_id == book_id)
+    if chunk_ids is not None:
+        query = query.filter(models.ChunkContent.chunk_id.in_(chunk_ids))
+    count = query.delete(synchronize_session=False)
+    db.commit()
+    return count
+
+# Embedding version operations
+def get_embedding_versions(db: Session, statuses: Optional[List[str]] = None):
+    query = db.query(models.EmbeddingVersion)
+    if statuses:
+        query = query.filter(models.EmbeddingVersion.status.in_(statuses))
+    return query.order_by(models.EmbeddingVersion.created_at).all()
+
+def get_embedding_version(db: Session, name: str):
+    return db.query(models.EmbeddingVersion).filter(models.EmbeddingVersion.name == name).first()
+
+def create_embedding_version(db: Session, name: str, model: str, dimension: int, namespace_suffix: str, status: str = "building"):
+    db_version = models.EmbeddingVersion(
+        name=name,
+        model=model,
+        dimension=dimension,
+        namespace_suffix=namespace_suffix,
+        status=status,
+        activated_at=datetime.utcnow() if status == "active" else None
+    )
+    db.add(db_version)
+    db.commit()
+    db.refresh(db_version)
+    return db_version
+
+def activate_embedding_version(db: Session, name: str):
+    """Make a building version the active one and retire the previous one, in one transaction"""
+    now = datetime.utcnow()
+    db.query(models.EmbeddingVersion)\
+        .filter(models.EmbeddingVersion.status == "active")\
+        .update({"status": "retired", "retired_at": now}, synchronize_session=False)
+    activated = db.query(models.EmbeddingVersion)\
+        .filter(models.EmbeddingVersion.name == name, models.EmbeddingVersion.status == "building")\
+        .update({"status": "active", "activated_at": now}, synchronize_session=False)
+    if not activated:
+        db.rollback()
+        return False
+    db.commit()
+    return True
+
+def set_embedding_version_status(db: Session, name: str, status: str):
+    values = {"status": status}
+    if status == "retired":
+        values["retired_at"] = datetime.utcnow()
+    db.query(models.EmbeddingVersion)\
+        .filter(models.EmbeddingVersion.name == name)\
+        .update(values, synchronize_session=False)
+    db.commit()
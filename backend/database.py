@@ -1,19 +1,38 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 from dotenv import load_dotenv
 import os
+from .metrics import instrument_engine
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 engine = create_engine(DATABASE_URL)
+instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
 
+def add_missing_columns(metadata):
+    """Add columns that existing tables predate; create_all only creates missing tables
+
+    New columns need a server default or must be nullable so existing rows stay valid.
+    """
+    inspector = inspect(engine)
+    compiler = engine.dialect.ddl_compiler(engine.dialect, None)
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {compiler.get_column_specification(column)}"))
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -0,0 +1,116 @@
+import os
+import re
+import threading
+import time
+from dotenv import load_dotenv
+from sqlalchemy.exc import IntegrityError
+from . import crud
+from .database import SessionLocal
+from .vectors import VECTOR_DIM, EMBEDDING_MODEL, embed_texts, placeholder_matrix, to_wire
+
+# Embedding versions.
+#
+# Every stored chunk vector belongs to an embedding version: the model and dimension
+# that produced it. A version keeps its chunks in book namespaces carrying its own
+# suffix, in the index for its dimension, so a new version can be built next to the
+# one serving searches. The registry lives in the database; each process caches it
+# briefly, so a switch reaches every worker within EMBEDDING_VERSION_CACHE_SECONDS.
+
+load_dotenv()
+
+EMBEDDING_VERSION_CACHE_SECONDS = float(os.getenv("EMBEDDING_VERSION_CACHE_SECONDS", "5"))
+# Version of the vectors stored before versioning; its namespaces have no suffix
+INITIAL_VERSION = "v1"
+VERSION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+# Versions whose vectors are still in the index
+STORED_STATUSES = ["active", "building", "retired"]
+
+
+class Version:
+    """Model, dimension and storage location of one embedding version"""
+
+    def __init__(self, name, model, dimension, namespace_suffix="", status="active"):
+        self.name = name
+        self.model = model
+        self.dimension = dimension
+        self.namespace_suffix = namespace_suffix
+        self.status = status
+        # Listings use metadata filters only; a placeholder of the right dimension
+        self.query_vector = to_wire(placeholder_matrix(1, dimension)[0])
+
+    @property
+    def index(self):
+        from .pinecone_db import get_index
+        return get_index(self.dimension)
+
+    def namespace(self, book_id):
+        """Namespace holding this version's chunks of a book"""
+        return f"book-{book_id}{self.namespace_suffix}"
+
+    def embed(self, texts):
+        """Embed texts in this process with the version's model"""
+        return embed_texts(texts, model=self.model, dimension=self.dimension)
+
+
+def namespace_suffix(name):
+    """Namespace suffix of a new version"""
+    return f"@{name}"
+
+
+class VersionRegistry:
+    """Process-wide cache of the embedding versions stored in the database"""
+
+    def __init__(self, ttl=EMBEDDING_VERSION_CACHE_SECONDS):
+        self.ttl = ttl
+        self._versions = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        db = SessionLocal()
+        try:
+            rows = crud.get_embedding_versions(db, statuses=STORED_STATUSES)
+            if not any(row.status == "active" for row in rows):
+                # First start: the vectors already stored become the initial version
+                try:
+                    crud.create_embedding_version(db, INITIAL_VERSION, EMBEDDING_MODEL, VECTOR_DIM, "", status="active")
+                except IntegrityError:
+                    # Another process got there first
+                    db.rollback()
+                rows = crud.get_embedding_versions(db, statuses=STORED_STATUSES)
+            return [
+                Version(row.name, row.model, row.dimension, row.namespace_suffix, row.status)
+                for row in rows
+            ]
+        finally:
+            db.close()
+
+    def versions(self):
+        """Versions with vectors in the index, oldest first"""
+        with self._lock:
+            if self._versions is None or time.monotonic() - self._loaded_at > self.ttl:
+                self._versions = self._load()
+                self._loaded_at = time.monotonic()
+            return self._versions
+
+    def active(self):
+        """The version searches and listings are served from"""
+        for version in self.versions():
+            if version.status == "active":
+                return version
+        raise RuntimeError("No active embedding version")
+
+    def building(self):
+        """The version being built in the background, if any; new chunks are written to it too"""
+        return next((version for version in self.versions() if version.status == "building"), None)
+
+    def get(self, name):
+        return next((version for version in self.versions() if version.name == name), None)
+
+    def invalidate(self):
+        """Reload on next use, e.g. right after a switch made by this process"""
+        with self._lock:
+            self._versions = None
+
+
+registry = VersionRegistry()
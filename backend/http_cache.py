@@ -0,0 +1,62 @@
+import hashlib
+from fastapi import Request, Response, status
+
+# HTTP caching helpers: ETags, conditional GET and Cache-Control policies.
+#
+# Chunks and chapters are never edited after creation, so their ETag can be derived
+# from the ID alone and a matching If-None-Match is answered without touching the
+# vector store. Listings change as content is added, so their ETag is computed from
+# the listed records and clients are asked to revalidate.
+
+# Bump to invalidate every ETag handed out so far, e.g. when the response format changes
+CONTENT_VERSION = "1"
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+LONG_LIVED = "public, max-age=86400"
+REVALIDATE = "no-cache"
+
+
+def resource_etag(kind, resource_id):
+    """Strong ETag for an immutable resource, derived from its ID"""
+    return f'"{kind}-{resource_id}-v{CONTENT_VERSION}"'
+
+
+def content_etag(*parts):
+    """Strong ETag derived from a hash of the given values"""
+    digest = hashlib.sha256(CONTENT_VERSION.encode())
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def listing_etag(items, *extra):
+    """ETag for a listing of records, from their IDs and positions"""
+    return content_etag(*extra, *(f"{item['id']}:{item.get('chunk_index', item.get('chapter_number'))}" for item in items))
+
+
+def etag_matches(request: Request, etag):
+    """Whether the request's If-None-Match header matches the ETag
+
+    "*" is treated as a miss: ETags of immutable resources are checked before
+    looking the resource up, so it would answer 304 for IDs that don't exist.
+    """
+    header = request.headers.get("if-none-match")
+    if not header or header.strip() == "*":
+        return False
+    # If-None-Match uses weak comparison, so ignore W/ prefixes
+    candidates = {value.strip().removeprefix("W/") for value in header.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+def not_modified(etag, cache_control):
+    """304 response carrying the validators of the cached representation"""
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={"ETag": etag, "Cache-Control": cache_control}
+    )
+
+
+def set_cache_headers(response: Response, etag, cache_control):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
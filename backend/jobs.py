@@ -0,0 +1,438 @@
+import functools
+import multiprocessing
+import numpy as np
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from . import crud
+from .concurrency import admission
+from .database import SessionLocal
+from .embedding_versions import registry
+from .utils import generate_embeddings
+
+# Background job subsystem.
+#
+# Jobs are rows in the jobs table, so they survive restarts. A dispatcher thread
+# claims queued jobs and runs their handler; CPU-bound work such as embedding is
+# fanned out to a process pool sized to the available cores, so request handlers
+# and the event loop are never blocked by it. Handlers record progress after each
+# batch and resume from it when a job is picked up again after a crash.
+
+load_dotenv()
+
+JOB_WORKER_PROCESSES = int(os.getenv("JOB_WORKER_PROCESSES", str(os.cpu_count() or 1)))
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "64"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+# Running jobs without a heartbeat for this long are assumed dead and requeued
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "300"))
+# A stale job that has been started this many times is failed instead of requeued,
+# so a job that keeps crashing its worker doesn't run forever
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Raw reading history older than this is deleted once folded into the rollups
+READING_HISTORY_RETENTION_DAYS = int(os.getenv("READING_HISTORY_RETENTION_DAYS", "90"))
+# Chunks per second re-embedded when building a new embedding version; 0 is unthrottled
+EMBEDDING_REINDEX_RATE = float(os.getenv("EMBEDDING_REINDEX_RATE", "50"))
+# Retired embedding versions are deleted this long after the switch, once no
+# process can still be serving them from its cached registry
+EMBEDDING_GC_GRACE_SECONDS = float(os.getenv("EMBEDDING_GC_GRACE_SECONDS", "60"))
+
+HANDLERS = {}
+
+
+class JobInterrupted(Exception):
+    """Raised by handlers that stop early on shutdown; the job is requeued"""
+
+
+def job_handler(job_type):
+    """Register a function handling jobs of the given type"""
+    def decorator(func):
+        HANDLERS[job_type] = func
+        return func
+    return decorator
+
+
+class JobContext:
+    """What a handler sees of its job: payload, resumable progress and the process pool"""
+
+    def __init__(self, runner, job):
+        self.runner = runner
+        self.job_id = job.id
+        self.payload = job.payload
+        self.progress = job.progress
+        self.total = job.total
+
+    def report(self, progress, total=None):
+        """Persist progress; doubles as the job heartbeat"""
+        self.progress = progress
+        if total is not None:
+            self.total = total
+        db = SessionLocal()
+        try:
+            crud.update_job_progress(db, self.job_id, progress, total)
+        finally:
+            db.close()
+
+    def heartbeat(self):
+        """Show the job is alive without changing its progress, e.g. within a long step"""
+        self.report(self.progress)
+
+    def embed(self, texts, version=None):
+        """Embed texts in the process pool, split across the available workers
+
+        Uses the model of the given embedding version (the active one by default).
+        Returns a (len(texts), dim) float32 matrix; workers send their slices back as arrays.
+        """
+        version = version or registry.active()
+        embed = functools.partial(generate_embeddings, model=version.model, dimension=version.dimension)
+        if not texts:
+            return embed([])
+        workers = self.runner.processes
+        size = max(1, -(-len(texts) // workers))
+        batches = [texts[i:i + size] for i in range(0, len(texts), size)]
+        return np.concatenate(list(self.runner.pool.map(embed, batches)))
+
+    @property
+    def stopping(self):
+        return self.runner.stop_event.is_set()
+
+
+class JobRunner:
+    """Dispatcher thread claiming jobs from the database and running their handlers"""
+
+    def __init__(self, processes=JOB_WORKER_PROCESSES):
+        self.processes = max(1, processes)
+        self.stop_event = threading.Event()
+        self._pool = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                # Spawned workers only import the embedding function, not the app
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pool
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="job-runner", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+            pool, self._pool = self._pool, None
+        if thread is not None:
+            thread.join(timeout=10)
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            db = SessionLocal()
+            try:
+                crud.requeue_stale_jobs(db, timedelta(seconds=JOB_STALE_SECONDS), max_attempts=JOB_MAX_ATTEMPTS)
+                job = crud.claim_next_job(db, list(HANDLERS))
+            except Exception as e:
+                print(f"Error claiming job: {e}")
+                job = None
+            finally:
+                db.close()
+
+            if job is None:
+                self.stop_event.wait(JOB_POLL_SECONDS)
+                continue
+            self._execute(job)
+
+    def _execute(self, job):
+        context = JobContext(self, job)
+        try:
+            # Jobs wait for vector store capacity instead of being shed
+            with admission.patient():
+                result = HANDLERS[job.job_type](context)
+            status, error = "completed", None
+        except JobInterrupted:
+            result, status, error = None, "interrupted", None
+        except Exception as e:
+            print(f"Job {job.id} ({job.job_type}) failed: {e}")
+            traceback.print_exc()
+            result, status, error = None, "failed", str(e)
+
+        db = SessionLocal()
+        try:
+            if status == "interrupted" or (
+                self.stop_event.is_set() and status == "completed" and context.progress < context.total
+            ):
+                # Interrupted by shutdown: hand the job back to the queue to resume later
+                crud.requeue_job(db, job.id)
+            else:
+                crud.finish_job(db, job.id, status, result=result, error=error)
+        finally:
+            db.close()
+
+
+def submit_job(db, job_type, payload, total=0):
+    """Queue a job for the background runner"""
+    if job_type not in HANDLERS:
+        raise ValueError(f"Unknown job type: {job_type}")
+    return crud.create_job(db, job_type, payload, total=total)
+
+
+@job_handler("ingest_chapter")
+def ingest_chapter(context):
+    """Create chunks for a chapter from a list of texts, embedding them in the process pool"""
+    from . import pinecone_crud
+
+    book_id = context.payload["book_id"]
+    chapter_number = context.payload["chapter_number"]
+    texts = context.payload["texts"]
+
+    # Resume after the last completed batch; re-running a batch is harmless
+    # because each text is stored under an idempotency key of its job position
+    position = context.progress
+    context.report(position, total=len(texts))
+    while position < len(texts) and not context.stopping:
+        batch = texts[position:position + JOB_BATCH_SIZE]
+        version = registry.active()
+        pinecone_crud.create_chunks(
+            book_id, chapter_number, batch,
+            embeddings=context.embed(batch, version), embedding_version=version.name,
+            idempotency_keys=[f"job-{context.job_id}:{i}" for i in range(position, position + len(batch))]
+        )
+        position += len(batch)
+        context.report(position)
+
+    return {"processed": position}
+
+
+@job_handler("reembed_book")
+def reembed_book(context):
+    """Recompute the embeddings of every chunk in a book"""
+    from . import pinecone_crud
+
+    book_id = context.payload["book_id"]
+    version = registry.active()
+    # Every chunk ID, in a stable order so progress can be resumed
+    chunk_ids = sorted(pinecone_crud.list_chunk_ids(book_id, version))
+
+    position = context.progress
+    context.report(position, total=len(chunk_ids))
+    while position < len(chunk_ids) and not context.stopping:
+        batch = chunk_ids[position:position + JOB_BATCH_SIZE]
+        ids, _, _, texts = pinecone_crud.fetch_chunk_records(book_id, batch, version)
+        if ids:
+            embeddings = context.embed([text or "" for text in texts], version)
+            pinecone_crud.update_chunk_embeddings(book_id, ids, embeddings, version)
+        position += len(batch)
+        context.report(position)
+
+    return {"processed": position}
+
+
+@job_handler("reindex_embeddings")
+def reindex_embeddings(context):
+    """Build a new embedding version next to the active one, switch to it and delete the old one
+
+    Progress counts finished books; within a book, chunks already present in the new
+    version are skipped, so the job resumes wherever it stopped.
+    """
+    from . import pinecone_crud
+
+    name = context.payload["version"]
+    db = SessionLocal()
+    try:
+        row = crud.get_embedding_version(db, name)
+    finally:
+        db.close()
+    if row is None or row.status not in ("building", "active"):
+        raise ValueError(f"Embedding version {name} is not being built")
+
+    copied = 0
+    if row.status == "building":
+        registry.invalidate()
+        source, target = registry.active(), registry.get(name)
+        book_ids = sorted(pinecone_crud.iter_book_ids(batch_size=JOB_BATCH_SIZE))
+        context.report(context.progress, total=len(book_ids))
+        started = time.monotonic()
+
+        def copy_book(book_id):
+            nonlocal copied
+            missing = pinecone_crud.missing_chunk_ids(book_id, source, target)
+            for offset in range(0, len(missing), JOB_BATCH_SIZE):
+                if context.stopping:
+                    raise JobInterrupted()
+                ids, _, metadatas, texts = pinecone_crud.fetch_chunk_records(
+                    book_id, missing[offset:offset + JOB_BATCH_SIZE], source
+                )
+                if ids:
+                    embeddings = context.embed([text or "" for text in texts], target)
+                    pinecone_crud.load_chunk_records(book_id, ids, embeddings, metadatas, texts, version=target)
+                copied += len(ids)
+                # Progress counts books; a large book must not look stalled meanwhile
+                context.heartbeat()
+                if EMBEDDING_REINDEX_RATE > 0:
+                    # Throttle to the configured rate; woken early on shutdown
+                    ahead = copied / EMBEDDING_REINDEX_RATE - (time.monotonic() - started)
+                    if ahead > 0:
+                        context.runner.stop_event.wait(ahead)
+
+        for position in range(context.progress, len(book_ids)):
+            if getattr(registry.get(name), "status", None) != "building":
+                raise ValueError(f"Embedding version {name} was abandoned")
+            copy_book(book_ids[position])
+            context.report(position + 1)
+
+        # Chunks created while the pass ran were dual-written; catch up on any that failed
+        for book_id in book_ids:
+            copy_book(book_id)
+
+        db = SessionLocal()
+        try:
+            if not crud.activate_embedding_version(db, name):
+                raise ValueError(f"Embedding version {name} was abandoned")
+        finally:
+            db.close()
+        registry.invalidate()
+
+    collected = collect_embedding_versions(context)
+    return {"version": name, "copied": copied, "collected": collected}
+
+
+def collect_embedding_versions(context):
+    """Delete the vectors of retired embedding versions once their grace period is over"""
+    from . import pinecone_crud
+
+    db = SessionLocal()
+    try:
+        retired = crud.get_embedding_versions(db, statuses=["retired"])
+    finally:
+        db.close()
+    if not retired:
+        return []
+
+    wait = max(row.retired_at for row in retired) + timedelta(seconds=EMBEDDING_GC_GRACE_SECONDS) - datetime.utcnow()
+    if context.runner.stop_event.wait(max(0.0, wait.total_seconds())):
+        raise JobInterrupted()
+
+    registry.invalidate()
+    book_ids = list(pinecone_crud.iter_book_ids(batch_size=JOB_BATCH_SIZE))
+    collected = []
+    for row in retired:
+        version = registry.get(row.name)
+        if version is not None:
+            pinecone_crud.drop_embedding_version(version, book_ids)
+        db = SessionLocal()
+        try:
+            crud.set_embedding_version_status(db, row.name, "deleted")
+        finally:
+            db.close()
+        collected.append(row.name)
+    registry.invalidate()
+    return collected
+
+
+@job_handler("collect_embedding_versions")
+def collect_embedding_versions_job(context):
+    """Delete the vectors of retired or abandoned embedding versions"""
+    return {"collected": collect_embedding_versions(context)}
+
+
+@job_handler("partition_index")
+def partition_index(context):
+    """Move vectors stored before namespace partitioning into the catalog and per-book namespaces"""
+    from . import pinecone_crud
+
+    # Moved vectors leave the default namespace, so the job resumes where it stopped
+    moved = context.progress
+    while not context.stopping:
+        count = pinecone_crud.partition_legacy_vectors(limit=JOB_BATCH_SIZE)
+        if not count:
+            break
+        moved += count
+        context.report(moved)
+
+    return {"moved": moved}
+
+
+@job_handler("compact_reading_history")
+def compact_reading_history(context):
+    """Fold unrolled reading history into the rollups and delete raw events past retention"""
+    retention_days = context.payload.get("retention_days", READING_HISTORY_RETENTION_DAYS)
+    db = SessionLocal()
+    try:
+        # Rolled-up rows drop out of the query, so progress is just a count
+        rolled_up = context.progress
+        while not context.stopping:
+            events = crud.get_unrolled_reading_history(db, limit=JOB_BATCH_SIZE * 16)
+            if not events:
+                break
+            crud.roll_up_reading_history(db, events)
+            rolled_up += len(events)
+            context.report(rolled_up)
+
+        deleted = 0
+        if not context.stopping:
+            cutoff = datetime.utcnow() - timedelta(days=retention_days)
+            deleted = crud.delete_compacted_reading_history(db, before=cutoff)
+        return {"rolled_up": rolled_up, "deleted": deleted}
+    finally:
+        db.close()
+
+
+
+@job_handler("export_snapshot")
+def export_snapshot(context):
+    """Write a library snapshot to SNAPSHOT_DIR"""
+    from . import snapshot
+
+    path = snapshot.snapshot_path(context.payload["name"])
+    try:
+        # Exports are rewritten from the start when resumed
+        context.report(0)
+        manifest = snapshot.export_snapshot(
+            path,
+            book_ids=context.payload.get("book_ids"),
+            progress=context.report,
+            should_stop=lambda: context.stopping
+        )
+    except snapshot.SnapshotInterrupted:
+        raise JobInterrupted()
+    return manifest
+
+
+@job_handler("import_snapshot")
+def import_snapshot(context):
+    """Bulk-load a snapshot from SNAPSHOT_DIR, resuming after the last imported batch"""
+    from . import snapshot
+
+    path = snapshot.snapshot_path(context.payload["name"])
+    manifest = snapshot.read_manifest(path)
+    if manifest is None:
+        raise ValueError(f"Snapshot {context.payload['name']} is incomplete or missing")
+    context.report(context.progress, total=manifest["chunks"])
+    try:
+        imported = snapshot.import_snapshot(
+            path,
+            book_ids=context.payload.get("book_ids"),
+            start=context.progress,
+            progress=context.report,
+            should_stop=lambda: context.stopping
+        )
+    except snapshot.SnapshotInterrupted:
+        raise JobInterrupted()
+    return {"imported": imported}
+
+
+runner = JobRunner()
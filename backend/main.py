@@ -1,9 +1,30 @@
-from fastapi import FastAPI, Depends
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
-from . import models, database
+from . import models, database, audio, jobs, recommendations
+from .metrics import MetricsMiddleware, render_metrics
+from .profiling import ProfilingMiddleware, ProfiledRoute
+from .compression import CompressionMiddleware
 from .auth import get_current_active_user
 
 models.Base.metadata.create_all(bind=database.engine)
+database.add_missing_columns(models.Base.metadata)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Under the pre-fork server (backend.serve) only the first worker runs background
+    # jobs, refreshes recommendations and renders queued audio for all workers
+    run_jobs = os.getenv("SERVE_WORKER_ID", "0") == "0"
+    # Start background workers
+    if run_jobs:
+        audio.get_renderer().start()
+        jobs.runner.start()
+        recommendations.refresher.start()
+    yield
+    if run_jobs:
+        recommendations.refresher.stop()
+        jobs.runner.stop()
 
 app = FastAPI(
     title="Book App API",
@@ -11,8 +32,11 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
-    openapi_url="/openapi.json"
+    openapi_url="/openapi.json",
+    lifespan=lifespan
 )
+# Lets profiles of sync endpoints follow the threadpool thread serving the request
+app.router.route_class = ProfiledRoute
 
 # Enable CORS
 app.add_middleware(
@@ -23,14 +47,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Negotiated zstd/br/gzip compression of large responses
+app.add_middleware(CompressionMiddleware)
+
+# Opt-in per-request profiling
+app.add_middleware(ProfilingMiddleware)
+
+# Per-route latency histograms
+app.add_middleware(MetricsMiddleware)
+
 # Root endpoint
 @app.get("/", tags=["root"], summary="API Root", 
          description="Welcome endpoint for the Book App API")
 def read_root():
     return {"message": "Welcome to the Book App API"}
 
+# Prometheus metrics endpoint
+@app.get("/metrics", tags=["root"], summary="Prometheus metrics",
+         description="Request, vector store and database metrics in Prometheus text format",
+         include_in_schema=False)
+def metrics():
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
 # Include routers
-from .routes import books, chapters, chunks, auth, users
+from .routes import books, chapters, chunks, auth, users, profiles, snapshots, embeddings, reading, jobs as job_routes
 
 # Auth routes
 app.include_router(auth.router)
@@ -42,6 +83,15 @@ app.include_router(users.router)
 app.include_router(books.router)
 app.include_router(chapters.router)
 app.include_router(chunks.router)
+app.include_router(reading.router)
+
+# Background job routes
+app.include_router(job_routes.router)
+
+# Operational routes
+app.include_router(profiles.router)
+app.include_router(snapshots.router)
+app.include_router(embeddings.router)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,173 @@
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+
+# In-process stand-in for a Pinecone index. It implements the subset of the
+# Pinecone Index API that pinecone_crud relies on (upsert/query/fetch/delete/list)
+# so the app can run without network access, e.g. for benchmarks and local dev.
+
+
+def _matches_condition(value, condition):
+    """Evaluate a single Pinecone metadata filter condition against a value"""
+    if not isinstance(condition, dict):
+        return value == condition
+
+    for op, expected in condition.items():
+        if op == "$eq":
+            if value != expected:
+                return False
+        elif op == "$ne":
+            if value == expected:
+                return False
+        elif op == "$in":
+            if value not in expected:
+                return False
+        elif op == "$nin":
+            if value in expected:
+                return False
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            if value is None:
+                return False
+            if op == "$gt" and not value > expected:
+                return False
+            if op == "$gte" and not value >= expected:
+                return False
+            if op == "$lt" and not value < expected:
+                return False
+            if op == "$lte" and not value <= expected:
+                return False
+        else:
+            raise ValueError(f"Unsupported filter operator: {op}")
+    return True
+
+
+def matches_filter(metadata, filter_dict):
+    """Check whether a metadata dict satisfies a Pinecone-style filter"""
+    if not filter_dict:
+        return True
+
+    for key, condition in filter_dict.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif not _matches_condition(metadata.get(key), condition):
+            return False
+    return True
+
+
+class InMemoryIndex:
+    """Thread-safe in-memory vector index with a Pinecone-compatible interface"""
+
+    # Upserts may pass float32 NumPy rows instead of Python lists
+    accepts_ndarray = True
+
+    def __init__(self, dimension=768):
+        self.dimension = dimension
+        self._namespaces = {}
+        self._lock = threading.RLock()
+
+    def _namespace(self, namespace):
+        return self._namespaces.setdefault(namespace or "", {})
+
+    def upsert(self, vectors, namespace=""):
+        """Insert or overwrite vectors given as dicts with id, values and metadata"""
+        with self._lock:
+            records = self._namespace(namespace)
+            for vector in vectors:
+                # Own copy, read-only so it can be handed out without copying again
+                values = np.array(vector["values"], dtype=np.float32)
+                values.setflags(write=False)
+                if values.shape != (self.dimension,):
+                    raise ValueError(
+                        f"Vector dimension {values.shape[-1]} does not match the dimension of the index {self.dimension}"
+                    )
+                records[vector["id"]] = (values, dict(vector.get("metadata") or {}))
+        return {"upserted_count": len(vectors)}
+
+    def query(self, vector, top_k=10, filter=None, namespace="", include_metadata=False, include_values=False):
+        """Return the top_k vectors by cosine similarity that match the filter"""
+        with self._lock:
+            candidates = [
+                (vector_id, values, metadata)
+                for vector_id, (values, metadata) in self._namespace(namespace).items()
+                if matches_filter(metadata, filter)
+            ]
+
+        if not candidates:
+            return SimpleNamespace(matches=[], namespace=namespace)
+
+        query_vector = np.asarray(vector, dtype=np.float32)
+        matrix = np.stack([values for _, values, _ in candidates])
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query_vector) or 1.0)
+        scores = matrix @ query_vector / np.where(norms == 0, 1.0, norms)
+
+        # Stable sort keeps insertion order for equal scores, like placeholder vectors
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        matches = []
+        for i in order:
+            vector_id, values, metadata = candidates[i]
+            matches.append(SimpleNamespace(
+                id=vector_id,
+                score=float(scores[i]),
+                values=values if include_values else [],
+                metadata=dict(metadata) if include_metadata else None
+            ))
+        return SimpleNamespace(matches=matches, namespace=namespace)
+
+    def fetch(self, ids, namespace=""):
+        """Fetch vectors by ID; missing IDs are omitted from the result"""
+        with self._lock:
+            records = self._namespace(namespace)
+            vectors = {
+                vector_id: SimpleNamespace(
+                    id=vector_id,
+                    values=records[vector_id][0],
+                    metadata=dict(records[vector_id][1])
+                )
+                for vector_id in ids
+                if vector_id in records
+            }
+        return SimpleNamespace(vectors=vectors, namespace=namespace)
+
+    def delete(self, ids=None, delete_all=False, namespace="", filter=None):
+        """Delete vectors by ID, by metadata filter or the whole namespace"""
+        with self._lock:
+            if delete_all:
+                self._namespaces.pop(namespace or "", None)
+                return {}
+
+            records = self._namespace(namespace)
+            if ids:
+                for vector_id in ids:
+                    records.pop(vector_id, None)
+            if filter:
+                for vector_id in [k for k, (_, md) in records.items() if matches_filter(md, filter)]:
+                    del records[vector_id]
+        return {}
+
+    def list(self, prefix=None, namespace="", limit=100):
+        """Yield pages of vector IDs, optionally restricted to an ID prefix"""
+        with self._lock:
+            ids = [
+                vector_id for vector_id in self._namespace(namespace)
+                if prefix is None or vector_id.startswith(prefix)
+            ]
+        for start in range(0, len(ids), limit):
+            yield ids[start:start + limit]
+
+    def describe_index_stats(self):
+        """Return vector counts per namespace"""
+        with self._lock:
+            namespaces = {
+                name: {"vector_count": len(records)}
+                for name, records in self._namespaces.items()
+            }
+        return {
+            "dimension": self.dimension,
+            "namespaces": namespaces,
+            "total_vector_count": sum(ns["vector_count"] for ns in namespaces.values())
+        }
@@ -0,0 +1,178 @@
+import os
+import time
+from prometheus_client import Counter, Histogram, CollectorRegistry, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+from sqlalchemy import event
+
+# Prometheus instrumentation for HTTP requests, vector store operations and SQL queries.
+# All collectors are process-global and cheap enough to stay enabled permanently.
+# Under the pre-fork server (backend.serve) PROMETHEUS_MULTIPROC_DIR is set and every
+# worker writes its values to files there, which /metrics aggregates.
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+)
+
+VECTOR_STORE_LATENCY = Histogram(
+    "vector_store_operation_duration_seconds",
+    "Latency of vector store operations",
+    ["operation"],
+)
+VECTOR_STORE_ERRORS = Counter(
+    "vector_store_operation_errors_total",
+    "Vector store operations that raised an exception",
+    ["operation"],
+)
+VECTOR_STORE_TOP_K = Histogram(
+    "vector_store_query_top_k",
+    "Requested top_k of vector store queries",
+    buckets=(1, 5, 10, 50, 100, 500, 1000, 5000, 10000),
+)
+VECTOR_STORE_RESULT_SIZE = Histogram(
+    "vector_store_result_size",
+    "Number of vectors returned or written per operation",
+    ["operation"],
+    buckets=(0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000),
+)
+
+SINGLE_FLIGHT_CALLS = Counter(
+    "vector_store_single_flight_calls_total",
+    "Vector store reads by whether they ran the backend call or shared an in-flight one",
+    ["operation", "outcome"],
+)
+ADMISSION_SHED = Counter(
+    "vector_store_admission_shed_total",
+    "Vector store calls rejected with 503 because the rate limit queue was full",
+    ["operation"],
+)
+ADMISSION_WAIT = Histogram(
+    "vector_store_admission_wait_seconds",
+    "Time vector store calls waited for an admission token",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+DB_QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds",
+    "Latency of SQL statements by statement type",
+    ["statement"],
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording a latency histogram per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the scope; use its template
+            # rather than the raw path to keep label cardinality bounded
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status_code),
+            ).observe(time.perf_counter() - start)
+
+
+class InstrumentedIndex:
+    """Wraps a vector index and records timings, errors, top_k and result sizes
+
+    With an admission controller, every backend call first takes one of its tokens.
+    """
+
+    def __init__(self, index, admission=None):
+        self._index = index
+        self._admission = admission
+
+    def __getattr__(self, name):
+        return getattr(self._index, name)
+
+    def _call(self, operation, method, *args, **kwargs):
+        if self._admission is not None:
+            self._admission.acquire(operation)
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except Exception:
+            VECTOR_STORE_ERRORS.labels(operation=operation).inc()
+            raise
+        finally:
+            VECTOR_STORE_LATENCY.labels(operation=operation).observe(time.perf_counter() - start)
+
+    def query(self, *args, **kwargs):
+        if "top_k" in kwargs:
+            VECTOR_STORE_TOP_K.observe(kwargs["top_k"])
+        response = self._call("query", self._index.query, *args, **kwargs)
+        VECTOR_STORE_RESULT_SIZE.labels(operation="query").observe(len(response.matches))
+        return response
+
+    def fetch(self, *args, **kwargs):
+        response = self._call("fetch", self._index.fetch, *args, **kwargs)
+        VECTOR_STORE_RESULT_SIZE.labels(operation="fetch").observe(len(response.vectors))
+        return response
+
+    def upsert(self, *args, **kwargs):
+        vectors = kwargs.get("vectors", args[0] if args else [])
+        VECTOR_STORE_RESULT_SIZE.labels(operation="upsert").observe(len(vectors))
+        return self._call("upsert", self._index.upsert, *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._call("delete", self._index.delete, *args, **kwargs)
+
+    def list(self, *args, **kwargs):
+        # Each page of IDs is a call of its own
+        pages = iter(self._index.list(*args, **kwargs))
+        while True:
+            page = self._call("list", next, pages, None)
+            if page is None:
+                return
+            yield page
+
+
+def instrument_engine(engine):
+    """Attach SQLAlchemy event listeners timing every statement on the engine"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["query_start_time"].pop()
+        statement_type = statement.lstrip().split(None, 1)[0].upper() if statement else "UNKNOWN"
+        DB_QUERY_LATENCY.labels(statement=statement_type).observe(time.perf_counter() - start)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        # Keep the start-time stack balanced when a statement fails
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start_time"):
+            conn.info["query_start_time"].pop()
+
+
+def render_metrics():
+    """Render all collectors in the Prometheus text exposition format"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Sum of all workers, not only the one serving this request
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, ForeignKey, Text, Boolean, DateTime
+from sqlalchemy import Column, String, Integer, ForeignKey, Text, Boolean, DateTime, Date, JSON, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from .database import Base
@@ -37,7 +37,108 @@ class ReadingHistory(Base):
     chapter_id = Column(String, nullable=True)  # Pinecone chapter ID
     chunk_id = Column(String, nullable=True)  # Pinecone chunk ID
     read_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # Whether the event is counted in the reading stats rollups
+    rolled_up = Column(Boolean, default=False, server_default="0", nullable=False)
     
     user = relationship("User", back_populates="reading_history")
 
+# Reading stats rollups, maintained incrementally as history is recorded
+class ReadingBookStat(Base):
+    __tablename__ = "reading_book_stats"
+    __table_args__ = (UniqueConstraint("user_id", "book_id"),)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    book_id = Column(String, nullable=False)  # Pinecone book ID
+    events = Column(Integer, default=0, nullable=False)
+    chapters_read = Column(Integer, default=0, nullable=False)  # Distinct chapters with reading events
+    seconds_read = Column(Integer, default=0, nullable=False)  # Estimated from gaps between events
+    first_read_at = Column(DateTime, nullable=False)
+    last_read_at = Column(DateTime, nullable=False, index=True)
+    last_chapter_id = Column(String, nullable=True)
+    last_chunk_id = Column(String, nullable=True)
+
+class ReadingDailyStat(Base):
+    __tablename__ = "reading_daily_stats"
+    __table_args__ = (UniqueConstraint("user_id", "book_id", "day"),)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    book_id = Column(String, nullable=False)  # Pinecone book ID
+    day = Column(Date, nullable=False)
+    events = Column(Integer, default=0, nullable=False)
+    chapters_started = Column(Integer, default=0, nullable=False)  # Chapters read for the first time that day
+    seconds_read = Column(Integer, default=0, nullable=False)
+
+class ReadingChapterStat(Base):
+    __tablename__ = "reading_chapter_stats"
+    __table_args__ = (UniqueConstraint("user_id", "chapter_id"),)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    book_id = Column(String, nullable=False)  # Pinecone book ID
+    chapter_id = Column(String, nullable=False)  # Pinecone chapter ID
+    first_read_at = Column(DateTime, nullable=False)
+
+# Background jobs (bulk ingestion, re-embedding); rows survive restarts so work can resume
+class Job(Base):
+    __tablename__ = "jobs"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    job_type = Column(String, nullable=False, index=True)
+    status = Column(String, default="queued", nullable=False, index=True)  # queued, running, completed, failed
+    payload = Column(JSON, nullable=False)
+    progress = Column(Integer, default=0, nullable=False)  # Items completed, used to resume
+    total = Column(Integer, default=0, nullable=False)
+    result = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)  # Stale heartbeats mark jobs of dead workers
+    finished_at = Column(DateTime, nullable=True)
+
+# Unique index over the chapter numbers of each book. Chapters themselves live in
+# the vector store catalog, which can't enforce uniqueness; a chapter number is
+# reserved here before its chapter is written.
+class ChapterNumber(Base):
+    __tablename__ = "chapter_numbers"
+    __table_args__ = (UniqueConstraint("book_id", "chapter_number"),)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    book_id = Column(String, nullable=False)  # Pinecone book ID
+    chapter_number = Column(Integer, nullable=False)
+    chapter_id = Column(String, nullable=False)  # Pinecone chapter ID
+    reserved_at = Column(DateTime, default=datetime.utcnow, nullable=True)
+
+# Ordered index of chunk positions: (chapter_id, chunk_index) -> chunk. Serves
+# neighbour lookups as range scans and hands out chunk indexes without races.
+class ChunkPosition(Base):
+    __tablename__ = "chunk_positions"
+    __table_args__ = (UniqueConstraint("chapter_id", "chunk_index"),)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    book_id = Column(String, nullable=False, index=True)  # Pinecone book ID
+    chapter_id = Column(String, nullable=False)  # Pinecone chapter ID
+    chunk_index = Column(Integer, nullable=False)
+    chunk_id = Column(String, nullable=False, index=True)  # Pinecone chunk ID
+
+# Library-wide index of chunk content: content hash -> chunks holding that text.
+# Ingestion reuses the embedding of identical text from any book through it.
+class ChunkContent(Base):
+    __tablename__ = "chunk_contents"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    content_hash = Column(String, nullable=False, index=True)
+    book_id = Column(String, nullable=False, index=True)  # Pinecone book ID
+    chunk_id = Column(String, nullable=False, unique=True)  # Pinecone chunk ID
+
+# Embedding versions: which model and dimension produced the stored chunk vectors.
+# Searches use the single active version; a building version is filled in the
+# background and switched to atomically; retired versions await garbage collection.
+class EmbeddingVersion(Base):
+    __tablename__ = "embedding_versions"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    name = Column(String, unique=True, nullable=False)
+    model = Column(String, nullable=False)
+    dimension = Column(Integer, nullable=False)
+    namespace_suffix = Column(String, default="", nullable=False)  # Appended to book namespaces
+    status = Column(String, default="building", nullable=False, index=True)  # building, active, retired, deleted
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    activated_at = Column(DateTime, nullable=True)
+    retired_at = Column(DateTime, nullable=True)
+
 # Note: Book, Chapter, and Chunk are now stored in Pinecone, not PostgreSQL
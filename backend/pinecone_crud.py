@@ -1,9 +1,169 @@
+import time
 import uuid
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from . import crud
+from .database import SessionLocal
 from .pinecone_db import index
-from .utils import generate_id
+from .blob_store import blob_store
+from .utils import generate_id, generate_embeddings, content_hash
+from .vectors import PLACEHOLDER_VECTOR, as_matrix, to_wire
+from .concurrency import coalesced, Overloaded
+from .embedding_versions import registry
+from .catalog_cache import catalog_cache
 
 # Constants
-VECTOR_DIM = 768
+UPSERT_BATCH_SIZE = 100
+# Listings use metadata filters only; converted to a list once instead of per call
+QUERY_VECTOR = to_wire(PLACEHOLDER_VECTOR)
+
+# The index is partitioned into namespaces: books and chapters live in the catalog
+# namespace, the chunks of each book in a namespace of their own. Book-scoped
+# queries only touch that book's vectors and a book is dropped as a whole namespace.
+# Chunk IDs are prefixed with their book ID so a chunk can be located from its ID.
+# Chunk namespaces belong to an embedding version (see embedding_versions): reads
+# use the active version, writes also go to a version being built.
+CATALOG_NAMESPACE = "catalog"
+CHUNK_ID_SEPARATOR = ":"
+# Chapter listings return up to this many chapters per book
+MAX_CHAPTERS_PER_BOOK = 1000
+# A chapter number reserved longer ago than this without its chapter in the
+# catalog was left behind by a failed write and can be reclaimed
+CHAPTER_RESERVATION_GRACE_SECONDS = 60
+# Vectors stored before partitioning stay in the default namespace until the
+# partition_index job has moved them; reads also look there while any remain
+LEGACY_NAMESPACE = ""
+LEGACY_CHECK_SECONDS = 60
+# Book partitions queried at once by a library-wide search
+SEARCH_PARALLELISM = 8
+
+_legacy = {"remaining": None, "checked_at": 0.0}
+_search_pool = ThreadPoolExecutor(max_workers=SEARCH_PARALLELISM, thread_name_prefix="search")
+
+def book_namespace(book_id, version=None):
+    """Namespace holding the chunks of a book in an embedding version (the active one by default)"""
+    return (version or registry.active()).namespace(book_id)
+
+def _new_chunk_id(book_id):
+    return f"{book_id}{CHUNK_ID_SEPARATOR}{generate_id()}"
+
+def _chunk_book_id(chunk_id):
+    """Book of a chunk, from its ID or, for chunks created before partitioning, its catalog reference"""
+    if CHUNK_ID_SEPARATOR in chunk_id:
+        return chunk_id.split(CHUNK_ID_SEPARATOR, 1)[0]
+    fetch_response = index.fetch(ids=[chunk_id], namespace=CATALOG_NAMESPACE)
+    reference = fetch_response.vectors.get(chunk_id) or _legacy_fetch(chunk_id)
+    return reference.metadata.get("book_id") if reference else None
+
+def _legacy_vectors_remain():
+    """Whether vectors from before partitioning are still in the default namespace"""
+    if _legacy["remaining"] is False:
+        # Nothing is ever written there again
+        return False
+    now = time.monotonic()
+    if _legacy["remaining"] is None or now - _legacy["checked_at"] > LEGACY_CHECK_SECONDS:
+        _legacy["remaining"] = bool(next(iter(index.list(namespace=LEGACY_NAMESPACE, limit=1)), []))
+        _legacy["checked_at"] = now
+    return _legacy["remaining"]
+
+def _legacy_query(filter_dict, top_k=1000):
+    """Matches among the vectors not partitioned yet"""
+    if not _legacy_vectors_remain():
+        return []
+    return index.query(
+        vector=QUERY_VECTOR,
+        filter=filter_dict,
+        top_k=top_k,
+        include_metadata=True,
+        namespace=LEGACY_NAMESPACE
+    ).matches
+
+def _legacy_fetch(record_id):
+    """A record not partitioned yet, or None"""
+    if not _legacy_vectors_remain():
+        return None
+    return index.fetch(ids=[record_id], namespace=LEGACY_NAMESPACE).vectors.get(record_id)
+
+def _all_book_ids():
+    """IDs of every book in the library"""
+    if catalog_cache.enabled:
+        return [book["id"] for book in catalog_cache.books()]
+    return list(iter_book_ids())
+
+def _upsert_vectors(ids, values, metadatas, namespace="", target_index=index):
+    """Upsert records whose vectors are given as an (n, dim) float32 matrix
+
+    Rows are converted to Python lists one batch at a time, right at the client
+    boundary; backends that accept NumPy arrays get the rows as they are.
+    """
+    accepts_arrays = getattr(target_index, "accepts_ndarray", False)
+    for start in range(0, len(ids), UPSERT_BATCH_SIZE):
+        end = start + UPSERT_BATCH_SIZE
+        rows = values[start:end] if accepts_arrays else to_wire(values[start:end])
+        target_index.upsert(
+            vectors=[
+                {"id": record_id, "values": row, "metadata": metadata}
+                for record_id, row, metadata in zip(ids[start:end], rows, metadatas[start:end])
+            ],
+            namespace=namespace
+        )
+
+def _chunk_from_metadata(chunk_id, metadata, include_text=True):
+    """Build a chunk dict from vector metadata, loading its text from the blob store"""
+    chunk = {
+        "id": chunk_id,
+        "book_id": metadata.get("book_id"),
+        "chapter_id": metadata.get("chapter_id"),
+        "chunk_index": metadata.get("chunk_index"),
+        "original_text": None
+    }
+    if include_text:
+        # Chunks created before the blob store keep their text in metadata
+        chunk["original_text"] = metadata.get("original_text")
+        if chunk["original_text"] is None and metadata.get("text_ref"):
+            chunk["original_text"] = blob_store.get(chunk["book_id"], metadata["text_ref"])
+    return chunk
+
+def _find_embeddings_by_hash(book_id, text_hashes, version):
+    """Stored embeddings of chunks with the same text anywhere in the library, keyed by content hash"""
+    db = SessionLocal()
+    try:
+        candidates = crud.find_chunk_contents(db, list(text_hashes))
+    finally:
+        db.close()
+    hashes_by_book = {}
+    for text_hash, chunks in candidates.items():
+        for candidate_book_id, chunk_id in chunks:
+            hashes_by_book.setdefault(candidate_book_id, {})[chunk_id] = text_hash
+    
+    embeddings = {}
+    for candidate_book_id, hashes in hashes_by_book.items():
+        chunk_ids = [chunk_id for chunk_id, text_hash in hashes.items() if text_hash not in embeddings]
+        for start in range(0, len(chunk_ids), UPSERT_BATCH_SIZE):
+            fetch_response = version.index.fetch(
+                ids=chunk_ids[start:start + UPSERT_BATCH_SIZE], namespace=version.namespace(candidate_book_id)
+            )
+            for chunk_id, record in fetch_response.vectors.items():
+                if hashes[chunk_id] not in embeddings and len(record.values):
+                    embeddings[hashes[chunk_id]] = record.values
+    
+    # Chunks from before the content index are only found within their own book
+    missing = [text_hash for text_hash in text_hashes if text_hash not in embeddings]
+    if missing:
+        query_response = version.index.query(
+            vector=version.query_vector,
+            filter={"content_hash": {"$in": missing}},
+            top_k=min(10000, 4 * len(missing)),
+            include_metadata=True,
+            include_values=True,
+            namespace=version.namespace(book_id)
+        )
+        for match in query_response.matches:
+            text_hash = match.metadata.get("content_hash")
+            if text_hash not in embeddings and len(match.values):
+                embeddings[text_hash] = match.values
+    return embeddings
 
 # Book operations
 def create_book(title):
@@ -17,242 +177,513 @@ def create_book(title):
     }
     
     # Books don't need embeddings, but Pinecone requires at least one non-zero value
-    # Create a placeholder vector with a single non-zero value
-    placeholder_vector = [0.0] * 768
-    placeholder_vector[0] = 1.0  # Set first element to 1.0
+    _upsert_vectors([book_id], PLACEHOLDER_VECTOR[np.newaxis], [metadata], namespace=CATALOG_NAMESPACE)
     
-    index.upsert(
-        vectors=[{
-            "id": book_id,
-            "values": placeholder_vector,
-            "metadata": metadata
-        }]
-    )
-    
-    return {"id": book_id, "title": title}
+    book = {"id": book_id, "title": title}
+    catalog_cache.put_books([book])
+    return book
 
+@coalesced("get_books")
 def get_books():
     """Get all books from Pinecone"""
+    if catalog_cache.enabled:
+        return catalog_cache.books()[:100]
     try:
         # Fetch all vectors with type=book using the new Pinecone API format
         query_response = index.query(
-            vector=[1.0] + [0.0] * 767,  # Dummy vector with one non-zero value
+            vector=QUERY_VECTOR,  # Dummy vector with one non-zero value
             filter={"type": "book"},
             top_k=100,  # Adjust as needed
-            include_metadata=True
+            include_metadata=True,
+            namespace=CATALOG_NAMESPACE
         )
         
         books = []
         # Access matches attribute in the new API response
-        for match in query_response.matches:
+        matches = query_response.matches
+        if len(matches) < 100:
+            ids = {match.id for match in matches}
+            matches = matches + [match for match in _legacy_query({"type": "book"}, top_k=100) if match.id not in ids]
+        for match in matches[:100]:
             books.append({
                 "id": match.id,
                 "title": match.metadata.get("title")
             })
         
         return books
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"Error fetching books: {e}")
         return []
 
+@coalesced("get_book")
 def get_book(book_id):
     """Get a specific book by ID"""
+    if catalog_cache.enabled:
+        book = catalog_cache.book(book_id)
+        if book is not None:
+            return book
     try:
         # Fetch the specific book by ID with new Pinecone API format
-        fetch_response = index.fetch(ids=[book_id])
+        fetch_response = index.fetch(ids=[book_id], namespace=CATALOG_NAMESPACE)
         
         # The new API returns an object with vectors as an attribute
-        vectors = fetch_response.vectors
+        vector_data = fetch_response.vectors.get(book_id) or _legacy_fetch(book_id)
         
-        if book_id in vectors:
-            vector_data = vectors[book_id]
-            return {
+        if vector_data is not None:
+            book = {
                 "id": book_id,
                 "title": vector_data.metadata.get("title")
             }
+            if catalog_cache.enabled:
+                catalog_cache.remember_book(book)
+            return book
         return None
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"Error fetching book: {e}")
         return None
 
 # Chapter operations
-def create_chapter(book_id, chapter_number, title):
-    """Create a new chapter in Pinecone"""
+# Books whose chapters from before the chapter number index are known to be recorded in it
+_indexed_books = set()
+
+def _index_chapter_numbers(db, book_id):
+    """Record a book's existing chapters in the chapter number index, once per process"""
+    if book_id in _indexed_books:
+        return
+    if not crud.count_chapter_numbers(db, book_id):
+        # A failed listing raises, so the book is retried instead of marked as indexed
+        existing = _query_chapters(book_id)
+        if existing:
+            crud.register_chapter_numbers(db, book_id, [(c["chapter_number"], c["id"]) for c in existing])
+    _indexed_books.add(book_id)
+
+def _reclaim_chapter_numbers(db, book_id, numbers):
+    """Free numbers whose reserving write never stored its chapter, e.g. after a crash; True if any was freed"""
+    cutoff = datetime.utcnow() - timedelta(seconds=CHAPTER_RESERVATION_GRACE_SECONDS)
+    # Newer reservations may belong to writes still in progress
+    chapter_ids = [
+        reservation.chapter_id
+        for reservation in crud.get_chapter_number_reservations(db, book_id, numbers)
+        if reservation.reserved_at is None or reservation.reserved_at < cutoff
+    ]
+    if not chapter_ids:
+        return False
+    stored = set(index.fetch(ids=chapter_ids, namespace=CATALOG_NAMESPACE).vectors)
+    orphaned = [chapter_id for chapter_id in chapter_ids if chapter_id not in stored and not _legacy_fetch(chapter_id)]
+    if not orphaned:
+        return False
+    crud.release_chapter_numbers(db, book_id, orphaned)
+    return True
+
+def _create_chapters(book_id, chapters):
+    numbers = [chapter_number for chapter_number, _ in chapters]
+    if len(set(numbers)) != len(numbers):
+        raise ValueError("Chapter numbers must be unique within the book")
+    if len(numbers) > MAX_CHAPTERS_PER_BOOK:
+        raise ValueError(f"A book can have at most {MAX_CHAPTERS_PER_BOOK} chapters")
+    
     # First check if the book exists
     book = get_book(book_id)
     if not book:
         raise ValueError(f"Book with ID {book_id} does not exist")
     
-    # Check if chapter with the same number already exists for this book
-    existing_chapters = get_chapters(book_id=book_id)
-    for chapter in existing_chapters:
-        if chapter["chapter_number"] == chapter_number:
-            raise ValueError(f"Chapter {chapter_number} already exists for book {book_id}")
-    
-    # Generate new chapter ID
-    chapter_id = generate_id()
-    
-    # Store chapter metadata
-    metadata = {
-        "type": "chapter",
-        "book_id": book_id,
-        "chapter_number": chapter_number,
-        "title": title
-    }
-    
-    # Chapters also use placeholder vectors with at least one non-zero value
-    placeholder_vector = [0.0] * 768
-    placeholder_vector[0] = 1.0  # Set first element to 1.0
-    
-    index.upsert(
-        vectors=[{
-            "id": chapter_id,
-            "values": placeholder_vector,
-            "metadata": metadata
-        }]
-    )
-    
-    return {
-        "id": chapter_id,
-        "book_id": book_id,
-        "chapter_number": chapter_number,
-        "title": title
-    }
+    chapter_ids = [generate_id() for _ in chapters]
+    db = SessionLocal()
+    try:
+        # The unique index rejects numbers already taken, including by concurrent requests
+        _index_chapter_numbers(db, book_id)
+        try:
+            crud.reserve_chapter_numbers(db, book_id, list(zip(numbers, chapter_ids)))
+        except ValueError:
+            if not _reclaim_chapter_numbers(db, book_id, numbers):
+                raise
+            crud.reserve_chapter_numbers(db, book_id, list(zip(numbers, chapter_ids)))
+        
+        results = [
+            {
+                "id": chapter_id,
+                "book_id": book_id,
+                "chapter_number": chapter_number,
+                "title": title
+            }
+            for chapter_id, (chapter_number, title) in zip(chapter_ids, chapters)
+        ]
+        try:
+            # Chapters also use placeholder vectors with at least one non-zero value
+            _upsert_vectors(
+                chapter_ids,
+                np.tile(PLACEHOLDER_VECTOR, (len(chapter_ids), 1)),
+                [{"type": "chapter", **{k: v for k, v in result.items() if k != "id"}} for result in results],
+                namespace=CATALOG_NAMESPACE
+            )
+        except Exception:
+            # Free the numbers so the request can be retried
+            crud.release_chapter_numbers(db, book_id, chapter_ids)
+            raise
+    finally:
+        db.close()
+    catalog_cache.put_chapters(results)
+    return results
 
+def create_chapter(book_id, chapter_number, title):
+    """Create a new chapter in Pinecone"""
+    return _create_chapters(book_id, [(chapter_number, title)])[0]
+
+def create_chapters(book_id, chapters):
+    """Create the chapters of a table of contents with one batched write
+
+    `chapters` is a list of (chapter_number, title) pairs. Either all chapters are
+    created or, if any number is already taken in the book, none.
+    """
+    return _create_chapters(book_id, chapters)
+
+@coalesced("get_chapters")
 def get_chapters(book_id=None):
     """Get all chapters, optionally filtered by book_id"""
+    chapters = catalog_cache.chapters(book_id) if catalog_cache.enabled else None
+    if chapters is not None:
+        return chapters[:MAX_CHAPTERS_PER_BOOK]
     try:
-        # Prepare filter
-        filter_dict = {"type": "chapter"}
-        if book_id:
-            filter_dict["book_id"] = book_id
-        
-        # Query for chapters using the new Pinecone API format
-        query_response = index.query(
-            vector=[1.0] + [0.0] * 767,  # Dummy vector with one non-zero value
-            filter=filter_dict,
-            top_k=1000,  # Adjust as needed
-            include_metadata=True
-        )
-        
-        chapters = []
-        # Access matches attribute in the new API response
-        for match in query_response.matches:
-            chapters.append({
-                "id": match.id,
-                "book_id": match.metadata.get("book_id"),
-                "chapter_number": match.metadata.get("chapter_number"),
-                "title": match.metadata.get("title")
-            })
-        
-        # Sort by chapter number
-        chapters.sort(key=lambda x: x["chapter_number"])
-        
-        return chapters
+        return _query_chapters(book_id)
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"Error fetching chapters: {e}")
         return []
 
+def _query_chapters(book_id=None):
+    """Chapters listed by the vector store, sorted by number; errors are raised"""
+    # Prepare filter
+    filter_dict = {"type": "chapter"}
+    if book_id:
+        filter_dict["book_id"] = book_id
+    
+    # Query for chapters using the new Pinecone API format
+    query_response = index.query(
+        vector=QUERY_VECTOR,  # Dummy vector with one non-zero value
+        filter=filter_dict,
+        top_k=1000,  # Adjust as needed
+        include_metadata=True,
+        namespace=CATALOG_NAMESPACE
+    )
+    
+    chapters = []
+    # Access matches attribute in the new API response
+    ids = {match.id for match in query_response.matches}
+    legacy = [match for match in _legacy_query(filter_dict) if match.id not in ids]
+    for match in query_response.matches + legacy:
+        chapters.append({
+            "id": match.id,
+            "book_id": match.metadata.get("book_id"),
+            "chapter_number": match.metadata.get("chapter_number"),
+            "title": match.metadata.get("title")
+        })
+    
+    # Sort by chapter number
+    chapters.sort(key=lambda x: x["chapter_number"])
+    
+    return chapters
+
+@coalesced("get_chapter")
 def get_chapter(chapter_id):
     """Get a specific chapter by ID"""
+    if catalog_cache.enabled:
+        chapter = catalog_cache.chapter(chapter_id)
+        if chapter is not None:
+            return chapter
     try:
         # Fetch the specific chapter by ID using the new Pinecone API format
-        fetch_response = index.fetch(ids=[chapter_id])
+        fetch_response = index.fetch(ids=[chapter_id], namespace=CATALOG_NAMESPACE)
         
         # Access vectors attribute in the new API response
-        vectors = fetch_response.vectors
+        vector_data = fetch_response.vectors.get(chapter_id) or _legacy_fetch(chapter_id)
         
-        if chapter_id in vectors:
-            vector_data = vectors[chapter_id]
-            return {
+        if vector_data is not None:
+            chapter = {
                 "id": chapter_id,
                 "book_id": vector_data.metadata.get("book_id"),
                 "chapter_number": vector_data.metadata.get("chapter_number"),
                 "title": vector_data.metadata.get("title")
             }
+            if catalog_cache.enabled:
+                catalog_cache.remember_chapter(chapter)
+            return chapter
         return None
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"Error fetching chapter: {e}")
         return None
 
 # Chunk operations
-def create_chunk(book_id, chapter_number, original_text):
-    """Create a new chunk with automatic index assignment"""
+# Chapters whose chunks from before the chunk position index are known to be recorded in it
+_indexed_chapters = set()
+
+def _record_chunk_positions(db, book_id, matches):
+    """Record the positions and content of listed chunks in the chunk position and content indexes"""
+    positions = [
+        (match.metadata["chapter_id"], match.metadata["chunk_index"], match.id)
+        for match in matches
+        if match.metadata.get("chapter_id") and match.metadata.get("chunk_index") is not None
+    ]
+    if positions:
+        crud.register_chunk_positions(db, book_id, positions)
+    contents = [(match.id, match.metadata["content_hash"]) for match in matches if match.metadata.get("content_hash")]
+    if contents:
+        crud.register_chunk_contents(db, book_id, contents)
+
+def _chapter_chunk_matches(version, book_id, chapter_id):
+    """Matches with metadata for every chunk of a chapter, including those not partitioned yet"""
+    query_response = version.index.query(
+        vector=version.query_vector,
+        filter={"chapter_id": chapter_id},
+        top_k=1000,
+        include_metadata=True,
+        namespace=version.namespace(book_id)
+    )
+    ids = {match.id for match in query_response.matches}
+    legacy = [match for match in _legacy_query({"type": "chunk", "chapter_id": chapter_id}) if match.id not in ids]
+    return query_response.matches + legacy
+
+def create_chunk(book_id, chapter_number, original_text, embedding=None, chunk_index=None, idempotency_key=None):
+    """Create a new chunk with automatic index assignment
+
+    A precomputed embedding can be passed in, e.g. by the bulk ingestion job. A
+    retry, recognised by its idempotency key or by the same text at the intended
+    `chunk_index`, returns the chunk created the first time.
+    """
+    embeddings = None if embedding is None else as_matrix(embedding, registry.active().dimension)
+    return create_chunks(
+        book_id, chapter_number, [original_text], embeddings=embeddings, start_index=chunk_index,
+        idempotency_keys=None if idempotency_key is None else [idempotency_key]
+    )[0]
+
+def create_chunks(book_id, chapter_number, texts, embeddings=None, embedding_version=None,
+                  start_index=None, idempotency_keys=None):
+    """Create chunks for a chapter in order, with one batched embedding pass and upsert
+
+    `embeddings` is an optional precomputed (len(texts), dim) matrix made with the
+    `embedding_version` model (the active version by default); it is ignored if that
+    version is no longer active. Returns one chunk per text.
+
+    Only a retry returns an existing chunk instead of creating one: a text already
+    stored under the same idempotency key (one per text in `idempotency_keys`), or
+    already stored at its intended index when the caller passes the chapter index
+    of the first text as `start_index`. Any other text repeated in the chapter gets
+    a new chunk linked to the stored text and embedding.
+    """
+    version = registry.active()
+    if embedding_version and embedding_version != version.name:
+        embeddings = None
+    if idempotency_keys is not None and len(idempotency_keys) != len(texts):
+        raise ValueError("One idempotency key is needed per text")
     try:
         # The validation for book existence and chapter existence is now done at the API route level
-        # Here we focus on finding the chapter and creating the chunk
-        
-        # Find the chapter ID using book_id and chapter_number
+        # Here we focus on finding the chapter and creating the chunks
         chapters = get_chapters(book_id=book_id)
-            
-        # Find the matching chapter by number
         chapter = next((c for c in chapters if c["chapter_number"] == chapter_number), None)
         
         # If somehow we reach here without a chapter (should be caught by route handler), raise error
         if not chapter:
             raise ValueError(f"Chapter {chapter_number} not found for book {book_id}")
         
-        # Extract chapter ID
         chapter_id = chapter["id"]
         
-        # Find existing chunks for this chapter to determine the next index
-        existing_chunks = get_chunks(chapter_id=chapter_id)
-        
-        # Determine next chunk index - start at 0 or increment from highest
+        # One listing of the chapter gives the next chunk index, the chunks of an
+        # earlier attempt and the text already stored
+        namespace = version.namespace(book_id)
+        matches = _chapter_chunk_matches(version, book_id, chapter_id)
         chunk_index = 0
-        if existing_chunks:
-            # Find the highest index
-            chunk_index = max(chunk["chunk_index"] for chunk in existing_chunks) + 1
+        by_index, by_key, text_refs = {}, {}, {}
+        for match in matches:
+            chunk_index = max(chunk_index, match.metadata.get("chunk_index", -1) + 1)
+            by_index[match.metadata.get("chunk_index")] = match
+            if match.metadata.get("idempotency_key"):
+                by_key[match.metadata["idempotency_key"]] = match
+            if match.metadata.get("content_hash") and match.metadata.get("text_ref"):
+                text_refs[match.metadata["content_hash"]] = match.metadata["text_ref"]
         
-        # Generate a unique ID for the new chunk
-        chunk_id = generate_id()
-        
-        # Prepare metadata for the chunk
-        metadata = {
-            "type": "chunk",
-            "book_id": book_id,
-            "chapter_id": chapter_id,
-            "chunk_index": chunk_index,
-            "original_text": original_text
-        }
+        hashes = [content_hash(text) for text in texts]
+        results = [None] * len(texts)
+        positions = []
+        for position, text_hash in enumerate(hashes):
+            key = idempotency_keys[position] if idempotency_keys is not None else None
+            if key is not None and key in by_key:
+                match = by_key[key]
+            elif start_index is not None:
+                match = by_index.get(start_index + position)
+            else:
+                match = None
+            if match is not None and match.metadata.get("content_hash") == text_hash:
+                results[position] = _chunk_from_metadata(match.id, match.metadata)
+            elif key is not None and key in by_key:
+                raise ValueError(f"Idempotency key {key} was already used for a different text")
+            else:
+                positions.append(position)
+    except Overloaded:
+        # Shed by admission control in a nested call; surface the 503
+        raise
     except Exception as e:
         # Catch any unexpected errors during preparation
         print(f"Error preparing chunk data: {e}")
         raise ValueError(f"Failed to prepare chunk data: {str(e)}")
     
-    # Use Pinecone's sparse embedding capability
-    # Store the chunk in Pinecone with a placeholder vector since our index doesn't support text embedding
     try:
-        # Create a placeholder vector (768 dimensions with one non-zero value)
-        placeholder_vector = [1.0] + [0.0] * 767  # 768-dimensional vector with one non-zero value
+        if embeddings is not None:
+            values = as_matrix(embeddings, version.dimension)[positions]
+        else:
+            values = np.empty((len(positions), version.dimension), dtype=np.float32)
+            # Identical text in the chapter or elsewhere in the library already has
+            # an embedding we can reuse; repeated new text is embedded once
+            unique = list(dict.fromkeys(hashes[p] for p in positions))
+            reusable = _find_embeddings_by_hash(book_id, unique, version) if unique else {}
+            missing = [text_hash for text_hash in unique if text_hash not in reusable]
+            if missing:
+                first = {}
+                for position in positions:
+                    first.setdefault(hashes[position], position)
+                generated = generate_embeddings(
+                    [texts[first[text_hash]] for text_hash in missing], model=version.model, dimension=version.dimension
+                )
+                reusable.update(zip(missing, generated))
+            for row, position in enumerate(positions):
+                values[row] = reusable[hashes[position]]
+        
+        # The chunk position index hands out the indexes, so concurrent writers to
+        # the chapter can't both take the listing's next index
+        chunk_ids = [_new_chunk_id(book_id) for _ in positions]
+        if chunk_ids:
+            db = SessionLocal()
+            try:
+                if chapter_id not in _indexed_chapters:
+                    _record_chunk_positions(db, book_id, matches)
+                    _indexed_chapters.add(chapter_id)
+                chunk_index = crud.reserve_chunk_positions(
+                    db, book_id, chapter_id, chunk_ids, chunk_index, content_hashes=[hashes[p] for p in positions]
+                )
+            finally:
+                db.close()
         
-        index.upsert(
-            vectors=[{
+        metadatas = []
+        for chunk_id, position in zip(chunk_ids, positions):
+            # Store the text in the blob store; the vector only carries a reference.
+            # Text already in the chapter links to its stored copy
+            text_hash = hashes[position]
+            if text_hash not in text_refs:
+                text_refs[text_hash] = blob_store.put(book_id, texts[position])
+            metadata = {
+                "type": "chunk",
+                "book_id": book_id,
+                "chapter_id": chapter_id,
+                "chunk_index": chunk_index,
+                "text_ref": text_refs[text_hash],
+                "text_length": len(texts[position]),
+                "content_hash": text_hash,
+                "embedding_version": version.name
+            }
+            if idempotency_keys is not None and idempotency_keys[position] is not None:
+                metadata["idempotency_key"] = idempotency_keys[position]
+            metadatas.append(metadata)
+            results[position] = {
                 "id": chunk_id,
-                "metadata": metadata,
-                "values": placeholder_vector  # Use placeholder vector instead of None
-                # Removed 'text' field as the error shows it's not supported in current index
-            }]
-        )
+                "book_id": book_id,
+                "chapter_id": chapter_id,
+                "chunk_index": chunk_index,
+                "original_text": texts[position]
+            }
+            chunk_index += 1
         
-        # Return the newly created chunk information
-        return {
-            "id": chunk_id,
-            "book_id": book_id,
-            "chapter_id": chapter_id,
-            "chunk_index": chunk_index,
-            "original_text": original_text
-        }
+        try:
+            _upsert_vectors(chunk_ids, values, metadatas, namespace=namespace, target_index=version.index)
+        except Exception:
+            # Free the positions so the indexes are not left with gaps
+            db = SessionLocal()
+            try:
+                crud.release_chunk_positions(db, book_id, chunk_ids)
+                crud.release_chunk_contents(db, book_id, chunk_ids)
+            finally:
+                db.close()
+            raise
+        _write_to_building_version(book_id, chunk_ids, [texts[p] for p in positions], metadatas)
+        return results
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"Error storing chunk in Pinecone: {e}")
         raise ValueError(f"Failed to store chunk in database: {str(e)}")
 
-def get_chunks_by_book_and_chapter(book_id=None, chapter_number=None):
+def _write_to_building_version(book_id, chunk_ids, texts, metadatas):
+    """Also store new chunks in the version being built, so the switch doesn't lose them
+
+    Failures are only logged: the re-indexing job copies missing chunks before switching.
+    """
+    building = registry.building()
+    if building is None or not chunk_ids:
+        return
+    try:
+        _upsert_vectors(
+            chunk_ids,
+            building.embed(texts),
+            [{**metadata, "embedding_version": building.name} for metadata in metadatas],
+            namespace=building.namespace(book_id),
+            target_index=building.index
+        )
+    except Exception as e:
+        print(f"Error writing chunks to embedding version {building.name}: {e}")
+
+def update_chunk_embeddings(book_id, chunk_ids, embeddings, version=None):
+    """Replace the vectors of existing chunks of a book, keeping their metadata
+
+    `embeddings` is a (len(chunk_ids), dim) matrix in the order of `chunk_ids`, made
+    with the model of `version` (the active version by default).
+    """
+    if not chunk_ids:
+        return 0
+    version = version or registry.active()
+    embeddings = as_matrix(embeddings, version.dimension)
+    namespace = version.namespace(book_id)
+    fetch_response = version.index.fetch(ids=list(chunk_ids), namespace=namespace)
+    rows = [row for row, chunk_id in enumerate(chunk_ids) if chunk_id in fetch_response.vectors]
+    if rows:
+        _upsert_vectors(
+            [chunk_ids[row] for row in rows],
+            embeddings[rows],
+            [fetch_response.vectors[chunk_ids[row]].metadata for row in rows],
+            namespace=namespace,
+            target_index=version.index
+        )
+    return len(rows)
+
+@coalesced("get_book_vector")
+def get_book_vector(book_id):
+    """Mean of a book's normalized chunk embeddings, or None if it has no chunks
+
+    Errors are raised rather than returned as None, which callers may keep.
+    """
+    version = registry.active()
+    query_response = version.index.query(
+        vector=version.query_vector,
+        top_k=1000,
+        include_values=True,
+        namespace=version.namespace(book_id)
+    )
+    rows = [match.values for match in query_response.matches if len(match.values)]
+    if not rows:
+        return None
+    vector = as_matrix(rows, version.dimension).mean(axis=0)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else None
+
+def get_chunks_by_book_and_chapter(book_id=None, chapter_number=None, include_text=True):
     """Get chunks filtered by book_id and chapter_number"""
     try:
         # If only book_id is provided, use the original function
         if book_id and not chapter_number:
-            return get_chunks(book_id=book_id)
+            return get_chunks(book_id=book_id, include_text=include_text)
         
         # If both book_id and chapter_number are provided, find the chapter_id first
         if book_id and chapter_number:
@@ -266,117 +697,521 @@ def get_chunks_by_book_and_chapter(book_id=None, chapter_number=None):
                 
             # Use the chapter_id to get chunks
             chapter_id = chapter["id"]
-            return get_chunks(chapter_id=chapter_id)
+            return get_chunks(chapter_id=chapter_id, book_id=book_id, include_text=include_text)
             
         # If neither is provided, return all chunks
-        return get_chunks()
+        return get_chunks(include_text=include_text)
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"Error fetching chunks by book and chapter: {e}")
         return []
 
-def get_chunks(chapter_id=None, book_id=None):
+@coalesced("get_chunks")
+def get_chunks(chapter_id=None, book_id=None, include_text=True):
     """Get chunks, optionally filtered by chapter_id or book_id"""
     try:
-        # Prepare filter
-        filter_dict = {"type": "chunk"}
-        if chapter_id:
-            filter_dict["chapter_id"] = chapter_id
-        elif book_id:
-            filter_dict["book_id"] = book_id
+        if chapter_id and not book_id:
+            chapter = get_chapter(chapter_id)
+            if not chapter:
+                return []
+            book_id = chapter["book_id"]
         
-        # Query for chunks using the new Pinecone API format
-        query_response = index.query(
-            vector=[1.0] + [0.0] * 767,  # Dummy vector with one non-zero value
-            filter=filter_dict,
+        if not book_id:
+            # Library-wide listing: one query per book partition
+            chunks = [
+                chunk
+                for chunks in _search_pool.map(
+                    lambda library_book_id: get_chunks(book_id=library_book_id, include_text=include_text),
+                    _all_book_ids()
+                )
+                for chunk in chunks
+            ]
+            chunks.sort(key=lambda x: x["chunk_index"])
+            return chunks
+        
+        # Query the book's partition using the new Pinecone API format
+        version = registry.active()
+        query_response = version.index.query(
+            vector=version.query_vector,  # Dummy vector with one non-zero value
+            filter={"chapter_id": chapter_id} if chapter_id else None,
             top_k=1000,  # Adjust as needed
-            include_metadata=True
+            include_metadata=True,
+            namespace=version.namespace(book_id)
         )
         
         chunks = []
         # Access matches attribute in the new API response
-        for match in query_response.matches:
-            chunks.append({
-                "id": match.id,
-                "book_id": match.metadata.get("book_id"),
-                "chapter_id": match.metadata.get("chapter_id"),
-                "chunk_index": match.metadata.get("chunk_index"),
-                "original_text": match.metadata.get("original_text")
-            })
+        legacy_filter = {"type": "chunk", "book_id": book_id}
+        if chapter_id:
+            legacy_filter["chapter_id"] = chapter_id
+        ids = {match.id for match in query_response.matches}
+        legacy = [match for match in _legacy_query(legacy_filter) if match.id not in ids]
+        for match in query_response.matches + legacy:
+            chunks.append(_chunk_from_metadata(match.id, match.metadata, include_text=include_text))
         
         # Sort by chunk index
         chunks.sort(key=lambda x: x["chunk_index"])
         
         return chunks
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"Error fetching chunks: {e}")
         return []
 
+@coalesced("get_chunk")
 def get_chunk(chunk_id):
     """Get a specific chunk by ID"""
     try:
-        # Fetch the specific chunk by ID using the new Pinecone API format
-        fetch_response = index.fetch(ids=[chunk_id])
+        book_id = _chunk_book_id(chunk_id)
+        if not book_id:
+            return None
+        
+        # Fetch the specific chunk from its book's partition
+        version = registry.active()
+        fetch_response = version.index.fetch(ids=[chunk_id], namespace=version.namespace(book_id))
         
         # Access vectors attribute in the new API response
-        vectors = fetch_response.vectors
+        vector_data = fetch_response.vectors.get(chunk_id) or _legacy_fetch(chunk_id)
         
-        if chunk_id in vectors:
-            vector_data = vectors[chunk_id]
-            return {
-                "id": chunk_id,
-                "book_id": vector_data.metadata.get("book_id"),
-                "chapter_id": vector_data.metadata.get("chapter_id"),
-                "chunk_index": vector_data.metadata.get("chunk_index"),
-                "original_text": vector_data.metadata.get("original_text")
-            }
+        if vector_data is not None:
+            return _chunk_from_metadata(chunk_id, vector_data.metadata)
         return None
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"Error fetching chunk: {e}")
         return None
 
+def _matching_chunks(matches, query_text, top_k):
+    """Chunks among the matches containing the query text, loading text only until top_k are found"""
+    hits = []
+    for match in matches:
+        chunk = _chunk_from_metadata(match.id, match.metadata)
+        original_text = chunk["original_text"] or ""
+        
+        # Simple text matching - check if query text appears in the chunk
+        # This is a basic fallback since we can't do proper semantic search
+        if query_text.lower() in original_text.lower():
+            chunk["score"] = 1.0  # Default score since we're not doing actual similarity
+            hits.append(chunk)
+            if len(hits) >= top_k:
+                break
+    return hits
+
+def _search_book(version, book_id, query_text, top_k):
+    # Query Pinecone using the placeholder vector
+    query_response = version.index.query(
+        vector=version.query_vector,  # Use placeholder instead of None
+        top_k=100,  # Increase to get more candidates for filtering
+        include_metadata=True,
+        namespace=version.namespace(book_id)
+    )
+    return _matching_chunks(query_response.matches, query_text, top_k)
+
+@coalesced("search_chunks")
 def search_chunks(query_text, book_id=None, top_k=5):
     """Search for chunks by text match since our index doesn't support text embeddings"""
     try:
-        # Prepare filter
-        filter_dict = {"type": "chunk"}
-        if book_id:
-            filter_dict["book_id"] = book_id
-        
-        # Since we can't use semantic search with the current index config, we'll filter by book_id
-        # and return chunks based on metadata
-        
-        # Create a placeholder vector for the query
-        placeholder_vector = [1.0] + [0.0] * 767
-        
-        # Query Pinecone using the placeholder vector
-        query_response = index.query(
-            vector=placeholder_vector,  # Use placeholder instead of None
-            # Removed text parameter as it's not supported
-            filter=filter_dict,
-            top_k=100,  # Increase to get more candidates for filtering
-            include_metadata=True
-        )
+        # A book-scoped search only touches that book's partition; a library-wide
+        # one covers every book, SEARCH_PARALLELISM partitions at a time
+        book_ids = [book_id] if book_id else _all_book_ids()
         
         # Since we can't do semantic search, we'll do basic text matching on the results
         # This isn't as good but will work until you can enable text embeddings in Pinecone
+        # The whole search is served by one version even if a switch happens meanwhile
+        version = registry.active()
         results = []
-        for match in query_response.matches:
-            original_text = match.metadata.get("original_text", "")
-            
-            # Simple text matching - check if query text appears in the chunk
-            # This is a basic fallback since we can't do proper semantic search
-            if query_text.lower() in original_text.lower():
-                results.append({
-                    "id": match.id,
-                    "book_id": match.metadata.get("book_id"),
-                    "chapter_id": match.metadata.get("chapter_id"),
-                    "chunk_index": match.metadata.get("chunk_index"),
-                    "original_text": original_text,
-                    "score": 1.0  # Default score since we're not doing actual similarity
-                })
+        for start in range(0, len(book_ids), SEARCH_PARALLELISM):
+            batch = book_ids[start:start + SEARCH_PARALLELISM]
+            for hits in _search_pool.map(lambda search_book_id: _search_book(version, search_book_id, query_text, top_k), batch):
+                results.extend(hits)
+            # Stop loading text once we have enough results
+            if len(results) >= top_k:
+                return results[:top_k]
         
-        # Limit results to requested top_k
-        return results[:top_k]
+        legacy_filter = {"type": "chunk", "book_id": book_id} if book_id else {"type": "chunk"}
+        results.extend(_matching_chunks(_legacy_query(legacy_filter, top_k=100), query_text, top_k - len(results)))
+        return results
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"Error searching chunks: {e}")
         return []
+
+# Context windows
+MAX_CONTEXT_RADIUS = 10
+CHUNK_FIELDS = ("id", "book_id", "chapter_id", "chunk_index", "original_text")
+
+def _index_chapter_positions(db, book_id, chapter_ids, version):
+    """Record the chunks of chapters from before the chunk position index, once per process"""
+    for chapter_id in chapter_ids:
+        if chapter_id in _indexed_chapters:
+            continue
+        if not crud.count_chunk_positions(db, chapter_id):
+            _record_chunk_positions(db, book_id, _chapter_chunk_matches(version, book_id, chapter_id))
+        _indexed_chapters.add(chapter_id)
+
+def _fetch_chunks(version, chunk_ids_by_book):
+    """Chunks with text by ID, with one fetch and one blob read per book"""
+    chunks = {}
+    for book_id, chunk_ids in chunk_ids_by_book.items():
+        fetch_response = version.index.fetch(ids=chunk_ids, namespace=version.namespace(book_id))
+        metadatas = {chunk_id: record.metadata for chunk_id, record in fetch_response.vectors.items()}
+        unpartitioned = [chunk_id for chunk_id in chunk_ids if chunk_id not in metadatas]
+        if unpartitioned and _legacy_vectors_remain():
+            legacy = index.fetch(ids=unpartitioned, namespace=LEGACY_NAMESPACE)
+            metadatas.update((chunk_id, record.metadata) for chunk_id, record in legacy.vectors.items())
+        stored = blob_store.get_many(book_id, [m["text_ref"] for m in metadatas.values() if m.get("text_ref")])
+        for chunk_id, metadata in metadatas.items():
+            chunk = _chunk_from_metadata(chunk_id, metadata, include_text=False)
+            chunk["original_text"] = metadata.get("original_text") or stored.get(metadata.get("text_ref"))
+            chunks[chunk_id] = chunk
+    return chunks
+
+def _with_context(hits, radius, version):
+    """Copies of hits with "before" and "after" lists of up to `radius` neighbouring chunks
+
+    Hits need id, book_id, chapter_id and chunk_index; those without original_text
+    are loaded along with the neighbours. All windows come from one range query on
+    the chunk position index and are loaded with one batched fetch per book.
+    """
+    db = SessionLocal()
+    try:
+        chapters_by_book = {}
+        for hit in hits:
+            chapters_by_book.setdefault(hit["book_id"], set()).add(hit["chapter_id"])
+        for book_id, chapter_ids in chapters_by_book.items():
+            _index_chapter_positions(db, book_id, chapter_ids, version)
+        rows = crud.get_chunk_windows(db, [(hit["chapter_id"], hit["chunk_index"]) for hit in hits], radius)
+        positions = [(row.book_id, row.chapter_id, row.chunk_index, row.chunk_id) for row in rows]
+    finally:
+        db.close()
+    
+    # Neighbours are plain chunks, so windows of adjacent hits don't nest
+    chunks = {
+        hit["id"]: {field: hit[field] for field in CHUNK_FIELDS}
+        for hit in hits if hit.get("original_text") is not None
+    }
+    wanted = {}
+    for book_id, _, _, chunk_id in positions:
+        if chunk_id not in chunks:
+            wanted.setdefault(book_id, []).append(chunk_id)
+    for hit in hits:
+        if hit["id"] not in chunks and hit["id"] not in wanted.get(hit["book_id"], ()):
+            wanted.setdefault(hit["book_id"], []).append(hit["id"])
+    chunks.update(_fetch_chunks(version, wanted))
+    
+    windows = {}  # chapter_id -> [(chunk_index, chunk)] in reading order
+    for _, chapter_id, chunk_index, chunk_id in positions:
+        if chunk_id in chunks:
+            windows.setdefault(chapter_id, []).append((chunk_index, chunks[chunk_id]))
+    
+    results = []
+    for hit in hits:
+        if hit["id"] not in chunks:
+            continue
+        window = windows.get(hit["chapter_id"], [])
+        center = hit["chunk_index"]
+        results.append({
+            **hit,
+            **chunks[hit["id"]],
+            "before": [chunk for index, chunk in window if center - radius <= index < center],
+            "after": [chunk for index, chunk in window if center < index <= center + radius]
+        })
+    return results
+
+def add_context(hits, radius):
+    """Return hits (e.g. search results) with up to `radius` neighbouring chunks on each side"""
+    if radius <= 0 or not hits:
+        return hits
+    if radius > MAX_CONTEXT_RADIUS:
+        raise ValueError(f"Context radius can be at most {MAX_CONTEXT_RADIUS}")
+    return _with_context(hits, radius, registry.active())
+
+def get_chunk_context(chunk_ids, radius):
+    """Chunks by ID, each with up to `radius` neighbouring chunks on each side, in the order given"""
+    if radius < 0 or radius > MAX_CONTEXT_RADIUS:
+        raise ValueError(f"Context radius must be between 0 and {MAX_CONTEXT_RADIUS}")
+    db = SessionLocal()
+    try:
+        located = {row.chunk_id: row for row in crud.get_chunk_positions(db, list(chunk_ids))}
+    finally:
+        db.close()
+    
+    hits = []
+    for chunk_id in dict.fromkeys(chunk_ids):
+        row = located.get(chunk_id)
+        if row is not None:
+            hits.append({"id": chunk_id, "book_id": row.book_id, "chapter_id": row.chapter_id, "chunk_index": row.chunk_index})
+        else:
+            # Not in the position index yet (created before it); loading it records its chapter
+            chunk = get_chunk(chunk_id)
+            if chunk is not None:
+                hits.append(chunk)
+    if not hits:
+        return []
+    return _with_context(hits, radius, registry.active())
+
+def get_next_chunks(book_id, chapter_id, after_index, limit):
+    """Up to `limit` chunks of a chapter following `after_index`, with text, in reading order"""
+    version = registry.active()
+    db = SessionLocal()
+    try:
+        _index_chapter_positions(db, book_id, [chapter_id], version)
+        chunk_ids = [row.chunk_id for row in crud.get_next_chunk_positions(db, chapter_id, after_index, limit)]
+    finally:
+        db.close()
+    if not chunk_ids:
+        return []
+    chunks = _fetch_chunks(version, {book_id: chunk_ids})
+    return [chunks[chunk_id] for chunk_id in chunk_ids if chunk_id in chunks]
+
+# Bulk record access for snapshots
+def iter_catalog_records(batch_size=100):
+    """Yield pages of (id, metadata) pairs for the books and chapters in the catalog"""
+    seen = set()
+    for ids in index.list(namespace=CATALOG_NAMESPACE, limit=batch_size):
+        fetch_response = index.fetch(ids=list(ids), namespace=CATALOG_NAMESPACE)
+        seen.update(fetch_response.vectors)
+        yield [
+            (vector_id, record.metadata)
+            for vector_id, record in fetch_response.vectors.items()
+            if record.metadata.get("type") in ("book", "chapter")
+        ]
+    legacy = [
+        (match.id, match.metadata)
+        for match in _legacy_query({"type": {"$in": ["book", "chapter"]}}, top_k=10000)
+        if match.id not in seen
+    ]
+    if legacy:
+        yield legacy
+
+def iter_chunk_records(book_id, batch_size=100, version=None):
+    """Yield batches of (ids, embeddings, metadatas, texts) for the chunks of a book
+
+    Chunks not partitioned yet count as the active version's, as when they are moved.
+    """
+    active = registry.active()
+    version = version or active
+    namespace = version.namespace(book_id)
+    seen = set()
+    for ids in version.index.list(namespace=namespace, limit=batch_size):
+        ids, embeddings, metadatas, texts = fetch_chunk_records(book_id, list(ids), version)
+        seen.update(ids)
+        if ids:
+            yield ids, embeddings, metadatas, texts
+    if version.name != active.name:
+        return
+    legacy = [
+        match.id
+        for match in _legacy_query({"type": "chunk", "book_id": book_id}, top_k=10000)
+        if match.id not in seen
+    ]
+    for offset in range(0, len(legacy), batch_size):
+        fetch_response = index.fetch(ids=legacy[offset:offset + batch_size], namespace=LEGACY_NAMESPACE)
+        ids, embeddings, metadatas, texts = _chunk_records(book_id, list(fetch_response.vectors.values()), version)
+        if ids:
+            yield ids, embeddings, metadatas, texts
+
+def fetch_chunk_records(book_id, chunk_ids, version):
+    """(ids, embeddings, metadatas, texts) of the given chunks of a book that exist in a version"""
+    fetch_response = version.index.fetch(ids=list(chunk_ids), namespace=version.namespace(book_id))
+    return _chunk_records(book_id, list(fetch_response.vectors.values()), version)
+
+def _chunk_records(book_id, records, version):
+    if not records:
+        return [], None, [], []
+    metadatas = [record.metadata for record in records]
+    stored = blob_store.get_many(book_id, [m["text_ref"] for m in metadatas if m.get("text_ref")])
+    texts = [m.get("original_text") or stored.get(m.get("text_ref")) for m in metadatas]
+    embeddings = as_matrix([record.values for record in records], version.dimension)
+    return [record.id for record in records], embeddings, metadatas, texts
+
+def list_chunk_ids(book_id, version=None):
+    """IDs of every chunk of a book stored in a version (the active one by default)"""
+    version = version or registry.active()
+    return [chunk_id for ids in version.index.list(namespace=version.namespace(book_id)) for chunk_id in ids]
+
+def missing_chunk_ids(book_id, source, target):
+    """IDs of a book's chunks stored in the source version but not yet in the target version"""
+    target_ids = {
+        chunk_id
+        for ids in target.index.list(namespace=target.namespace(book_id))
+        for chunk_id in ids
+    }
+    return [
+        chunk_id
+        for ids in source.index.list(namespace=source.namespace(book_id))
+        for chunk_id in ids
+        if chunk_id not in target_ids
+    ]
+
+def load_catalog_records(ids, metadatas):
+    """Bulk-load books and chapters into the catalog"""
+    _upsert_vectors(ids, np.tile(PLACEHOLDER_VECTOR, (len(ids), 1)), metadatas, namespace=CATALOG_NAMESPACE)
+    catalog_cache.put_records(ids, metadatas)
+    
+    chapters_by_book = {}
+    for record_id, metadata in zip(ids, metadatas):
+        if metadata.get("type") == "chapter":
+            chapters_by_book.setdefault(metadata["book_id"], []).append((metadata["chapter_number"], record_id))
+    if chapters_by_book:
+        db = SessionLocal()
+        try:
+            for book_id, chapters in chapters_by_book.items():
+                crud.register_chapter_numbers(db, book_id, chapters)
+        finally:
+            db.close()
+
+def load_chunk_records(book_id, ids, embeddings, metadatas, texts, version=None):
+    """Bulk-load chunks of a book with their embeddings, keeping their IDs
+
+    `embeddings` must come from the model of `version` (the active version by default).
+    """
+    version = version or registry.active()
+    metadatas = [
+        {
+            "type": "chunk",
+            "book_id": book_id,
+            "chapter_id": metadata["chapter_id"],
+            "chunk_index": metadata["chunk_index"],
+            "text_ref": blob_store.put(book_id, text),
+            "text_length": len(text),
+            "content_hash": metadata.get("content_hash") or content_hash(text),
+            "embedding_version": version.name
+        }
+        for metadata, text in zip(metadatas, texts)
+    ]
+    _upsert_vectors(
+        ids, as_matrix(embeddings, version.dimension), metadatas,
+        namespace=version.namespace(book_id), target_index=version.index
+    )
+    db = SessionLocal()
+    try:
+        crud.register_chunk_positions(
+            db, book_id, [(m["chapter_id"], m["chunk_index"], chunk_id) for chunk_id, m in zip(ids, metadatas)]
+        )
+        crud.register_chunk_contents(db, book_id, [(chunk_id, m["content_hash"]) for chunk_id, m in zip(ids, metadatas)])
+    finally:
+        db.close()
+
+    # Chunks from before partitioning need their catalog reference to be located
+    legacy_ids = [chunk_id for chunk_id in ids if CHUNK_ID_SEPARATOR not in chunk_id]
+    if legacy_ids:
+        _upsert_vectors(
+            legacy_ids,
+            np.tile(PLACEHOLDER_VECTOR, (len(legacy_ids), 1)),
+            [{"type": "chunk_ref", "book_id": book_id} for _ in legacy_ids],
+            namespace=CATALOG_NAMESPACE
+        )
+
+# Partition operations
+def delete_book(book_id):
+    """Delete a book with its chapters, chunks and stored text"""
+    # Dropping the partition removes every chunk in one operation, in every stored version
+    for version in registry.versions():
+        try:
+            version.index.delete(delete_all=True, namespace=version.namespace(book_id))
+        except Overloaded:
+            raise
+        except Exception as e:
+            # Pinecone reports a namespace without vectors as not found
+            print(f"Error deleting chunks of book {book_id} ({version.name}): {e}")
+    
+    query_response = index.query(
+        vector=QUERY_VECTOR,
+        filter={"book_id": book_id},
+        top_k=10000,
+        namespace=CATALOG_NAMESPACE
+    )
+    catalog_ids = [book_id] + [match.id for match in query_response.matches]
+    index.delete(ids=catalog_ids, namespace=CATALOG_NAMESPACE)
+    catalog_cache.delete_book(book_id)
+    blob_store.drop(book_id)
+    db = SessionLocal()
+    try:
+        crud.release_chapter_numbers(db, book_id)
+        crud.release_chunk_positions(db, book_id)
+        crud.release_chunk_contents(db, book_id)
+    finally:
+        db.close()
+    _indexed_books.discard(book_id)
+    return len(catalog_ids) - 1
+
+def partition_legacy_vectors(limit=100):
+    """Move up to `limit` vectors from the shared default namespace into the partitioned layout
+
+    Chunks keep their IDs and get a reference in the catalog so they can still be
+    located. Returns the number of vectors moved; 0 once nothing is left.
+    """
+    ids = next(iter(index.list(namespace="", limit=limit)), [])
+    if not ids:
+        _legacy["remaining"] = False
+        return 0
+    fetch_response = index.fetch(ids=list(ids), namespace="")
+    records = list(fetch_response.vectors.values())
+    
+    catalog = [record for record in records if record.metadata.get("type") != "chunk"]
+    if catalog:
+        _upsert_vectors(
+            [record.id for record in catalog],
+            as_matrix([record.values for record in catalog]),
+            [record.metadata for record in catalog],
+            namespace=CATALOG_NAMESPACE
+        )
+        catalog_cache.put_records([record.id for record in catalog], [record.metadata for record in catalog])
+    
+    chunks_by_book = {}
+    for record in records:
+        if record.metadata.get("type") == "chunk":
+            chunks_by_book.setdefault(record.metadata.get("book_id"), []).append(record)
+    # Legacy vectors were made by the model of the active version when it was the first
+    version = registry.active()
+    for book_id, chunks in chunks_by_book.items():
+        _upsert_vectors(
+            [record.id for record in chunks],
+            as_matrix([record.values for record in chunks], version.dimension),
+            [{**record.metadata, "embedding_version": version.name} for record in chunks],
+            namespace=version.namespace(book_id),
+            target_index=version.index
+        )
+        _upsert_vectors(
+            [record.id for record in chunks],
+            np.tile(PLACEHOLDER_VECTOR, (len(chunks), 1)),
+            [{"type": "chunk_ref", "book_id": book_id} for _ in chunks],
+            namespace=CATALOG_NAMESPACE
+        )
+    
+    index.delete(ids=list(ids), namespace="")
+    db = SessionLocal()
+    try:
+        for book_id, chunks in chunks_by_book.items():
+            contents = [(record.id, record.metadata["content_hash"]) for record in chunks if record.metadata.get("content_hash")]
+            if contents:
+                crud.register_chunk_contents(db, book_id, contents)
+    finally:
+        db.close()
+    return len(ids)
+
+def iter_book_ids(batch_size=100):
+    """Yield the IDs of all books in the catalog"""
+    for page in iter_catalog_records(batch_size=batch_size):
+        for record_id, metadata in page:
+            if metadata.get("type") == "book":
+                yield record_id
+
+def drop_embedding_version(version, book_ids):
+    """Delete the chunk namespaces of a version for the given books"""
+    dropped = 0
+    for book_id in book_ids:
+        try:
+            version.index.delete(delete_all=True, namespace=version.namespace(book_id))
+            dropped += 1
+        except Overloaded:
+            raise
+        except Exception as e:
+            # Pinecone reports a namespace without vectors as not found
+            print(f"Error deleting chunks of book {book_id} ({version.name}): {e}")
+    return dropped
@@ -1,38 +1,63 @@
-import pinecone
 import os
+import threading
 from dotenv import load_dotenv
+from .concurrency import admission
+from .metrics import InstrumentedIndex
+from .vectors import VECTOR_DIM
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Pinecone client
-api_key = os.getenv("PINECONE_API_KEY")
-environment = os.getenv("PINECONE_ENVIRONMENT")
-
-if not api_key or not environment:
-    raise ValueError("Missing Pinecone API key or environment. Please set PINECONE_API_KEY and PINECONE_ENVIRONMENT in your .env file.")
-
 # Constants
 INDEX_NAME = "books-index"
 
-# Initialize connection with Pinecone
-pinecone_client = pinecone.Pinecone(
-    api_key=api_key,
-    region=environment
-)
+# Vector store backend: "pinecone" (default) or "memory" for an in-process index
+VECTOR_STORE = os.getenv("VECTOR_STORE", "pinecone")
+# Use Pinecone's gRPC transport (pip install "pinecone[grpc]") for binary upserts
+PINECONE_USE_GRPC = os.getenv("PINECONE_USE_GRPC", "").lower() in ("1", "true", "yes")
+
+def get_pinecone_client():
+    """Initialize the Pinecone client from environment variables"""
+    import pinecone
+
+    api_key = os.getenv("PINECONE_API_KEY")
+    environment = os.getenv("PINECONE_ENVIRONMENT")
+
+    if not api_key or not environment:
+        raise ValueError("Missing Pinecone API key or environment. Please set PINECONE_API_KEY and PINECONE_ENVIRONMENT in your .env file.")
+
+    # The gRPC client sends vectors as binary protobuf instead of JSON
+    if PINECONE_USE_GRPC:
+        from pinecone.grpc import PineconeGRPC
+        return PineconeGRPC(
+            api_key=api_key,
+            region=environment
+        )
+
+    # Initialize connection with Pinecone
+    return pinecone.Pinecone(
+        api_key=api_key,
+        region=environment
+    )
 
 # Get or create index
-def get_or_create_index():
+def get_or_create_index(name=INDEX_NAME, dimension=VECTOR_DIM):
     """Get the Pinecone index or create it if it doesn't exist"""
+    if VECTOR_STORE == "memory":
+        from .memory_index import InMemoryIndex
+        return InMemoryIndex(dimension=dimension)
+
+    pinecone_client = get_pinecone_client()
+
     # Check if index exists
     indexes = pinecone_client.list_indexes()
-    index_exists = any(idx.name == INDEX_NAME for idx in indexes.indexes)
-    
+    index_exists = any(idx.name == name for idx in indexes.indexes)
+
     if not index_exists:
         # Create index with text embedding capability
         pinecone_client.create_index(
-            name=INDEX_NAME,
-            dimension=768,  # Using OpenAI's embedding dimension
+            name=name,
+            dimension=dimension,
             metric="cosine",
             spec={
                 "serverless": {
@@ -41,10 +66,34 @@ def get_or_create_index():
                 }
             }
         )
-        print(f"Created new Pinecone index: {INDEX_NAME}")
-    
+        print(f"Created new Pinecone index: {name}")
+
     # Get index using the new API
-    return pinecone_client.Index(INDEX_NAME)
+    return pinecone_client.Index(name)
+
+# Get the index, instrumented with per-operation metrics and admission control
+index = InstrumentedIndex(get_or_create_index(), admission)
+
+# Embedding versions with another dimension need an index of their own
+_indexes = {VECTOR_DIM: index}
+_indexes_lock = threading.Lock()
+
+def get_index(dimension=VECTOR_DIM):
+    """Index holding vectors of the given dimension, created on first use"""
+    with _indexes_lock:
+        if dimension not in _indexes:
+            _indexes[dimension] = InstrumentedIndex(get_or_create_index(f"{INDEX_NAME}-{dimension}", dimension), admission)
+        return _indexes[dimension]
+
+def reconnect():
+    """Give each index a client of its own, e.g. in a worker forked from a process that used them
 
-# Get the index
-index = get_or_create_index()
+    HTTP connection pools and gRPC channels must not be shared across a fork. The
+    in-memory index has no connections and is left as it is.
+    """
+    if VECTOR_STORE == "memory":
+        return
+    with _indexes_lock:
+        for dimension, instrumented in _indexes.items():
+            name = INDEX_NAME if dimension == VECTOR_DIM else f"{INDEX_NAME}-{dimension}"
+            instrumented._index = get_pinecone_client().Index(name)
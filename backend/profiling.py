@@ -0,0 +1,277 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from dotenv import load_dotenv
+from fastapi.routing import APIRoute
+from .auth import is_admin_token
+
+# On-demand sampling profiler for individual requests.
+#
+# A single background thread samples stacks while at least one request is being
+# profiled. Each request only samples its own threads: the event loop thread that
+# received it, where samples count while the stack contains the code of its
+# endpoint or dependencies, and for sync endpoints the threadpool thread running the
+# endpoint, which registers itself while it does. Traces are written in the
+# folded-stack format accepted by flamegraph.pl, speedscope and inferno.
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# Automatically keep traces of requests slower than this many ms (0 disables)
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_SLOW_MAX_PER_MINUTE = int(os.getenv("PROFILE_SLOW_MAX_PER_MINUTE", "6"))
+# Requests profiled at once; further ones are served without a profile
+PROFILE_MAX_SESSIONS = int(os.getenv("PROFILE_MAX_SESSIONS", "4"))
+
+
+# Session of the request being handled; copied into the threadpool with the context
+current_session = contextvars.ContextVar("profile_session", default=None)
+
+
+class ProfileSession:
+    """Stack samples collected for one request"""
+
+    def __init__(self, scope, thread_id):
+        self.scope = scope
+        self.codes = None
+        self.loop_thread = thread_id
+        self.worker_threads = set()  # Threadpool threads currently running the endpoint
+        self.samples = Counter()
+
+    def resolve_codes(self):
+        # The router stores the matched route in the scope once routing is done
+        if self.codes is None and "route" in self.scope:
+            self.codes = route_codes(self.scope["route"])
+        return self.codes
+
+
+class StackSampler:
+    """Background thread sampling the stacks of requests being profiled"""
+
+    def __init__(self, interval, max_sessions=PROFILE_MAX_SESSIONS):
+        self.interval = interval
+        self.max_sessions = max_sessions
+        self._sessions = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start_session(self, scope):
+        """Start sampling the calling thread for a request; None if too many are profiled already"""
+        session = ProfileSession(scope, threading.get_ident())
+        with self._lock:
+            if len(self._sessions) >= self.max_sessions:
+                return None
+            self._sessions.add(session)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+        return session
+
+    def stop_session(self, session):
+        with self._lock:
+            self._sessions.discard(session)
+
+    def enter_worker(self, session):
+        with self._lock:
+            session.worker_threads.add(threading.get_ident())
+
+    def leave_worker(self, session):
+        with self._lock:
+            session.worker_threads.discard(threading.get_ident())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._sessions:
+                    self._thread = None
+                    return
+                sessions = [
+                    (session, set(session.worker_threads))
+                    for session in self._sessions if session.resolve_codes()
+                ]
+            if not sessions:
+                continue
+
+            frames = sys._current_frames()
+            for session, worker_threads in sessions:
+                # The event loop serves other requests too, so only stacks in this
+                # route's code count there; a worker thread runs nothing else
+                stack = _stack(frames.get(session.loop_thread))
+                if stack and not session.codes.isdisjoint(stack):
+                    session.samples[fold_stack(stack)] += 1
+                for thread_ident in worker_threads:
+                    stack = _stack(frames.get(thread_ident))
+                    if stack:
+                        session.samples[fold_stack(stack)] += 1
+
+
+def _stack(frame):
+    """Leaf-first list of the code objects of a frame and its callers"""
+    stack = []
+    while frame is not None:
+        stack.append(frame.f_code)
+        frame = frame.f_back
+    return stack
+
+
+class ProfiledRoute(APIRoute):
+    """Route whose sync endpoint registers its threadpool thread with the request's profile session
+
+    Used as the route_class of the routers.
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        if not asyncio.iscoroutinefunction(endpoint):
+            endpoint = _recording_thread(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+def _recording_thread(endpoint):
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        session = current_session.get()
+        if session is None:
+            return endpoint(*args, **kwargs)
+        sampler.enter_worker(session)
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            sampler.leave_worker(session)
+    return wrapper
+
+
+def fold_stack(stack):
+    """Render a leaf-first list of code objects as a root-first folded stack"""
+    return ";".join(
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        for code in reversed(stack)
+    )
+
+
+def route_codes(route):
+    """Code objects of the endpoint and dependencies serving a matched route"""
+    codes = set()
+    pending = [getattr(route, "dependant", None)]
+    while pending:
+        dependant = pending.pop()
+        if dependant is None:
+            continue
+        code = getattr(getattr(dependant.call, "__wrapped__", dependant.call), "__code__", None)
+        if code is not None:
+            codes.add(code)
+        pending.extend(dependant.dependencies)
+    if not codes and hasattr(getattr(route, "endpoint", None), "__code__"):
+        codes.add(route.endpoint.__code__)
+    return codes
+
+
+def write_profile(session, scope, duration):
+    """Write the samples of a session to PROFILE_DIR and return the file name"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path_slug = scope["path"].strip("/").replace("/", "_") or "root"
+    name = f"{time.strftime('%Y%m%dT%H%M%S')}-{scope['method']}-{path_slug}-{int(duration * 1000)}ms-{uuid.uuid4().hex[:8]}.folded"
+    with open(os.path.join(PROFILE_DIR, name), "w") as f:
+        for stack, count in session.samples.most_common():
+            f.write(f"{stack} {count}\n")
+    return name
+
+
+class SlowRequestBudget:
+    """Rate limit for automatically captured slow-request profiles"""
+
+    def __init__(self, max_per_minute):
+        self.max_per_minute = max_per_minute
+        self._timestamps = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._timestamps and now - self._timestamps[0] > 60:
+                self._timestamps.popleft()
+            if len(self._timestamps) >= self.max_per_minute:
+                return False
+            self._timestamps.append(now)
+            return True
+
+
+sampler = StackSampler(PROFILE_INTERVAL_MS / 1000.0)
+slow_request_budget = SlowRequestBudget(PROFILE_SLOW_MAX_PER_MINUTE)
+
+
+def profiling_requested(scope):
+    """Whether the request asks for a profile with a valid admin token"""
+    headers = dict(scope["headers"])
+    flagged = headers.get(b"x-profile") in (b"1", b"true") or b"profile=1" in scope.get("query_string", b"").split(b"&")
+    if not flagged:
+        return False
+    return is_admin_token(headers.get(b"x-admin-token", b"").decode("latin-1"))
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling admin-flagged requests and, optionally, slow ones
+
+    Flagged requests (``X-Profile: 1`` or ``?profile=1`` together with a valid
+    ``X-Admin-Token``) get the trace file name back in the ``X-Profile-File``
+    response header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        explicit = profiling_requested(scope)
+        if not explicit and not PROFILE_SLOW_MS:
+            await self.app(scope, receive, send)
+            return
+
+        session = sampler.start_session(scope)
+        if session is None:
+            if explicit:
+                logger.warning(
+                    f"Not profiling {scope['method']} {scope['path']}: {sampler.max_sessions} requests are profiled already"
+                )
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        stopped = False
+        token = current_session.set(session)
+
+        def finish():
+            nonlocal stopped
+            if not stopped:
+                sampler.stop_session(session)
+                stopped = True
+            return time.perf_counter() - start
+
+        async def send_wrapper(message):
+            if explicit and message["type"] == "http.response.start":
+                name = write_profile(session, scope, finish())
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-file", name.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_session.reset(token)
+            duration = finish()
+            if not explicit and duration * 1000 >= PROFILE_SLOW_MS and slow_request_budget.acquire():
+                name = write_profile(session, scope, duration)
+                logger.warning(f"Slow request {scope['method']} {scope['path']} took {duration * 1000:.0f}ms, profile saved to {name}")
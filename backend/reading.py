@@ -0,0 +1,123 @@
+import os
+from datetime import datetime
+from dotenv import load_dotenv
+from . import crud, pinecone_crud
+from .database import SessionLocal
+
+# Live reading sessions.
+#
+# A client opens one WebSocket per book. The server keeps a read-ahead window of
+# chunks pushed beyond the last acknowledged one, and the client acknowledges each
+# chunk it reaches with a tiny message. Acks are buffered and written to the
+# reading history in batches, keeping the last position per chapter, so a session
+# costs one authentication and one write per flush instead of a request per chunk.
+
+load_dotenv()
+
+# Chunks pushed ahead of the last acknowledged one
+READING_SESSION_READ_AHEAD = int(os.getenv("READING_SESSION_READ_AHEAD", "5"))
+# Buffered acks are written at least this often, or once this many are pending
+READING_SESSION_FLUSH_SECONDS = float(os.getenv("READING_SESSION_FLUSH_SECONDS", "15"))
+READING_SESSION_FLUSH_ACKS = int(os.getenv("READING_SESSION_FLUSH_ACKS", "50"))
+
+
+class ReadingSession:
+    """Read-ahead cursor and buffered progress of one reader in one book"""
+
+    def __init__(self, user_id, book_id, read_ahead=READING_SESSION_READ_AHEAD):
+        self.user_id = user_id
+        self.book_id = book_id
+        self.read_ahead = read_ahead
+        self.chapters = []  # Chapters in reading order
+        self.next_seq = 0
+        self.unacked = {}  # seq -> chunk pushed but not acknowledged yet
+        self.acked_seq = -1
+        self.pending = []  # (chapter_id, chunk_id, read_at) not written yet
+        self.finished = False
+        self._chapter = 0  # Position in self.chapters of the last chunk pushed
+        self._chunk_index = -1  # Its index in the chapter
+
+    def start(self, chunk_id=None):
+        """Position the cursor on a chunk, the reader's last position or the start of the book"""
+        self.chapters = pinecone_crud.get_chapters(book_id=self.book_id)
+        if chunk_id is None:
+            db = SessionLocal()
+            try:
+                last = crud.get_last_read(db, user_id=self.user_id, book_id=self.book_id)
+            finally:
+                db.close()
+            chunk_id = last.chunk_id if last else None
+        self.seek(chunk_id)
+
+    def seek(self, chunk_id=None):
+        """Continue from a chunk (the start of the book if None); chunks pushed so far are dropped"""
+        self._chapter, self._chunk_index = 0, -1
+        if chunk_id:
+            chunk = pinecone_crud.get_chunk(chunk_id)
+            if chunk is None or chunk["book_id"] != self.book_id:
+                raise ValueError(f"Chunk {chunk_id} not found in book {self.book_id}")
+            chapter_ids = [chapter["id"] for chapter in self.chapters]
+            if chunk["chapter_id"] in chapter_ids:
+                self._chapter = chapter_ids.index(chunk["chapter_id"])
+                self._chunk_index = chunk["chunk_index"] - 1
+        self.unacked.clear()
+        self.acked_seq = self.next_seq - 1
+        self.finished = False
+
+    def fill(self):
+        """Chunk messages topping the read-ahead window back up"""
+        wanted = self.read_ahead - len(self.unacked)
+        messages = []
+        while wanted > 0 and not self.finished:
+            if self._chapter >= len(self.chapters):
+                self.finished = True
+                break
+            chapter = self.chapters[self._chapter]
+            chunks = pinecone_crud.get_next_chunks(self.book_id, chapter["id"], self._chunk_index, wanted)
+            if not chunks:
+                # Chapter done; continue with the next one
+                self._chapter += 1
+                self._chunk_index = -1
+                continue
+            for chunk in chunks:
+                self.unacked[self.next_seq] = chunk
+                messages.append({
+                    "type": "chunk",
+                    "seq": self.next_seq,
+                    "id": chunk["id"],
+                    "chapter_id": chunk["chapter_id"],
+                    "chapter_number": chapter["chapter_number"],
+                    "chunk_index": chunk["chunk_index"],
+                    "text": chunk["original_text"]
+                })
+                self.next_seq += 1
+                self._chunk_index = chunk["chunk_index"]
+            wanted -= len(chunks)
+        return messages
+
+    def ack(self, seq):
+        """The reader reached chunk `seq`; earlier chunks count as read too"""
+        if seq <= self.acked_seq or seq >= self.next_seq:
+            return
+        now = datetime.utcnow()
+        for acked in range(self.acked_seq + 1, seq + 1):
+            chunk = self.unacked.pop(acked, None)
+            if chunk is not None:
+                self.pending.append((chunk["chapter_id"], chunk["id"], now))
+        self.acked_seq = seq
+
+    def flush(self):
+        """Write buffered acks as reading history, one event per chapter reached"""
+        if not self.pending:
+            return 0
+        latest = {}
+        for event in self.pending:
+            latest[event[0]] = event
+        events = sorted(latest.values(), key=lambda event: event[2])
+        db = SessionLocal()
+        try:
+            crud.create_reading_history_batch(db, self.user_id, self.book_id, events)
+        finally:
+            db.close()
+        self.pending = []
+        return len(events)
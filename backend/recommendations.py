@@ -0,0 +1,286 @@
+import math
+import os
+import pickle
+import tempfile
+import threading
+from collections import Counter, defaultdict
+from datetime import timedelta
+import numpy as np
+from dotenv import load_dotenv
+from . import crud
+from .database import SessionLocal
+
+# "Because you read X" recommendations.
+#
+# A background refresher folds new reads (taken from the per-book reading rollups,
+# so compacted history still counts) and favorites into co-reading counts,
+# recomputes the neighbour lists of the books they touch (co-reading similarity
+# blended with the similarity of book-level embedding vectors) and the lists of
+# the users affected. Requests only look up the precomputed list.
+#
+# Under the pre-fork server only the first worker refreshes; it publishes the served
+# lists to a file the master created before forking, and the other workers load
+# that file when it changes.
+
+load_dotenv()
+
+RECOMMENDATION_REFRESH_SECONDS = float(os.getenv("RECOMMENDATION_REFRESH_SECONDS", "300"))
+RECOMMENDATIONS_PER_USER = int(os.getenv("RECOMMENDATIONS_PER_USER", "20"))
+RECOMMENDATION_NEIGHBOURS = int(os.getenv("RECOMMENDATION_NEIGHBOURS", "20"))
+# Most recently read books a user's list is built from
+RECOMMENDATION_SEEDS = int(os.getenv("RECOMMENDATION_SEEDS", "5"))
+# Share of the score coming from embedding similarity; the rest is co-reading
+RECOMMENDATION_VECTOR_WEIGHT = float(os.getenv("RECOMMENDATION_VECTOR_WEIGHT", "0.3"))
+# Events are re-read from slightly before the last watermark to catch late commits;
+# folding is idempotent so the overlap is harmless
+REFRESH_OVERLAP = timedelta(seconds=60)
+
+
+class Recommender:
+    """Incrementally maintained co-reading statistics and precomputed recommendation lists"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._watermark = None
+        self._user_books = defaultdict(dict)  # user_id -> {book_id: last interaction}
+        self._readers = Counter()  # book_id -> number of users
+        self._co_counts = defaultdict(Counter)  # book_id -> {book_id: shared users}
+        self._seed_users = defaultdict(set)  # book_id -> users with it among their seeds
+        self._vectors = {}  # book_id -> normalized book vector, or None without chunks
+        self._vector_version = None  # Embedding version the vectors come from
+        self._titles = {}
+        self._neighbours = {}  # book_id -> ((book_id, score), ...)
+        # Served tables; replaced entry by entry, never mutated in place
+        self._table = {}  # user_id -> ((book_id, because_book_id, score), ...)
+        self._popular = ()
+        self._shared_path = None
+        self._shared_stamp = None  # Identity of the published file loaded last
+        # Set in the process that refreshes; others follow the published lists
+        self.refreshes_here = False
+
+    def share(self):
+        """Publish the served lists to a file so forked workers can serve them; call before forking"""
+        fd, self._shared_path = tempfile.mkstemp(prefix="recommendations-", suffix=".pickle")
+        os.close(fd)
+
+    def _publish(self):
+        """Write the served lists for workers that don't refresh themselves"""
+        state = {
+            "table": self._table,
+            "popular": self._popular,
+            "titles": self._titles,
+            "read": {user_id: tuple(books) for user_id, books in self._user_books.items()}
+        }
+        directory = os.path.dirname(self._shared_path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix="recommendations-", suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._shared_path)
+
+    def _follow(self):
+        """Load the lists published by the refreshing worker if they changed"""
+        try:
+            stat = os.stat(self._shared_path)
+        except FileNotFoundError:
+            return
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp == self._shared_stamp or not stat.st_size:
+            return
+        with open(self._shared_path, "rb") as f:
+            state = pickle.load(f)
+        self._titles = state["titles"]
+        self._user_books = defaultdict(dict, {user_id: dict.fromkeys(books) for user_id, books in state["read"].items()})
+        self._table = state["table"]
+        self._popular = state["popular"]
+        self._shared_stamp = stamp
+
+    def recommend(self, user_id, limit=RECOMMENDATIONS_PER_USER):
+        """Precomputed recommendations for a user, falling back to popular books they haven't read"""
+        if self._shared_path and not self.refreshes_here:
+            self._follow()
+        user_id = str(user_id)
+        entries = self._table.get(user_id)
+        if not entries:
+            read = self._user_books.get(user_id, {})
+            entries = [entry for entry in self._popular if entry[0] not in read]
+        return [
+            {
+                "book_id": book_id,
+                "title": self._titles.get(book_id),
+                "because_book_id": because,
+                "because_title": self._titles.get(because) if because else None,
+                "score": score
+            }
+            for book_id, because, score in entries[:limit]
+        ]
+
+    def refresh(self):
+        """Fold new interactions into the statistics and recompute affected lists
+
+        Changes are built aside and only take effect once every list is recomputed,
+        so a failure leaves the statistics as they were and the next refresh
+        re-reads the same events.
+        """
+        with self._lock:
+            db = SessionLocal()
+            try:
+                since = self._watermark - REFRESH_OVERLAP if self._watermark else None
+                events = crud.get_book_reads_since(db, since) + crud.get_favorites_since(db, since)
+            finally:
+                db.close()
+
+            watermark = self._watermark
+            user_books = {}  # user_id -> updated copy of the user's books
+            readers = self._readers.copy()
+            co_counts = {}  # book_id -> updated copy of its co-reading counts
+            touched_users = set()
+            touched_books = set()
+            for user_id, book_id, at in events:
+                user_id = str(user_id)
+                if watermark is None or at > watermark:
+                    watermark = at
+                if user_id not in user_books:
+                    user_books[user_id] = dict(self._user_books.get(user_id, {}))
+                books = user_books[user_id]
+                if book_id in books:
+                    books[book_id] = max(books[book_id], at)
+                    touched_users.add(user_id)
+                    continue
+                # First interaction of this user with this book
+                readers[book_id] += 1
+                touched_books.add(book_id)
+                for other in books:
+                    for first, second in ((book_id, other), (other, book_id)):
+                        if first not in co_counts:
+                            co_counts[first] = Counter(self._co_counts.get(first, {}))
+                        co_counts[first][second] += 1
+                    touched_books.add(other)
+                books[book_id] = at
+                touched_users.add(user_id)
+
+            # Vectors of different embedding versions can't be compared
+            from .embedding_versions import registry
+            version = registry.active().name
+            switched = version != self._vector_version
+            vectors = {} if switched else dict(self._vectors)
+            if switched:
+                # Every neighbour list holds similarities of the previous version
+                touched_books |= set(readers)
+                touched_users |= set(self._user_books) | set(user_books)
+
+            if not touched_users:
+                self._watermark = watermark
+                return {"events": len(events), "books": 0, "users": 0}
+
+            titles = self._load_books(touched_books, vectors)
+            neighbours = {
+                book_id: self._compute_neighbours(
+                    book_id, co_counts.get(book_id) or self._co_counts.get(book_id, {}), readers, vectors
+                )
+                for book_id in touched_books
+            }
+            for book_id in touched_books:
+                touched_users |= self._seed_users.get(book_id, set())
+            table = {}
+            seed_users = {}
+            for user_id in touched_users:
+                books = user_books.get(user_id) or self._user_books.get(user_id, {})
+                seeds, table[user_id] = self._compute_user(books, neighbours)
+                for book_id in seeds:
+                    seed_users.setdefault(book_id, set()).add(user_id)
+            popular = tuple((book_id, None, 0.0) for book_id, _ in readers.most_common())
+
+            # Everything was computed; make the changes visible
+            self._watermark = watermark
+            self._user_books.update(user_books)
+            self._readers = readers
+            self._co_counts.update(co_counts)
+            self._vectors = vectors
+            self._vector_version = version
+            self._titles.update(titles)
+            self._neighbours.update(neighbours)
+            for book_id, users in seed_users.items():
+                self._seed_users[book_id] |= users
+            self._table.update(table)
+            self._popular = popular
+            if self._shared_path:
+                self._publish()
+            return {"events": len(events), "books": len(touched_books), "users": len(touched_users)}
+
+    def _load_books(self, book_ids, vectors):
+        """Fetch book vectors missing from `vectors` into it; returns the titles of those books"""
+        from . import pinecone_crud
+
+        titles = {}
+        for book_id in book_ids:
+            if book_id in vectors:
+                continue
+            book = pinecone_crud.get_book(book_id)
+            titles[book_id] = book["title"] if book else None
+            # Raises on errors, so only books without chunks are kept as None
+            vectors[book_id] = pinecone_crud.get_book_vector(book_id)
+        return titles
+
+    def _compute_neighbours(self, book_id, co_counts, readers, vectors):
+        """Most similar books by blended co-reading and vector similarity"""
+        scores = {}
+        co_weight = 1.0 - RECOMMENDATION_VECTOR_WEIGHT
+        for other, count in co_counts.items():
+            scores[other] = co_weight * count / math.sqrt(readers[book_id] * readers[other])
+
+        vector = vectors.get(book_id)
+        others = [other for other, v in vectors.items() if v is not None and other != book_id]
+        if vector is not None and others:
+            similarities = np.stack([vectors[other] for other in others]) @ vector
+            for other, similarity in zip(others, similarities):
+                scores[other] = scores.get(other, 0.0) + RECOMMENDATION_VECTOR_WEIGHT * float(similarity)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return tuple((other, round(score, 4)) for other, score in ranked[:RECOMMENDATION_NEIGHBOURS])
+
+    def _compute_user(self, books, neighbours):
+        """Seeds and best unread neighbours of the user's most recently read books"""
+        seeds = sorted(books, key=books.get, reverse=True)[:RECOMMENDATION_SEEDS]
+        best = {}
+        for seed in seeds:
+            seed_neighbours = neighbours[seed] if seed in neighbours else self._neighbours.get(seed, ())
+            for other, score in seed_neighbours:
+                if other not in books and (other not in best or score > best[other][1]):
+                    best[other] = (seed, score)
+        ranked = sorted(best.items(), key=lambda item: item[1][1], reverse=True)
+        return seeds, tuple((other, seed, score) for other, (seed, score) in ranked[:RECOMMENDATIONS_PER_USER])
+
+
+class RecommendationRefresher:
+    """Background thread running Recommender.refresh periodically"""
+
+    def __init__(self, recommender, interval=RECOMMENDATION_REFRESH_SECONDS):
+        self.recommender = recommender
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.recommender.refreshes_here = True
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="recommendations", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.recommender.refresh()
+            except Exception as e:
+                print(f"Error refreshing recommendations: {e}")
+            self._stop.wait(self.interval)
+
+
+recommender = Recommender()
+refresher = RecommendationRefresher(recommender)
@@ -0,0 +1,12 @@
+import orjson
+from fastapi.responses import JSONResponse
+
+# Fast response path for large payloads built by the app itself. Returning one of
+# these from a route skips response_model validation and the default encoder.
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson"""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
@@ -4,11 +4,13 @@ from sqlalchemy.orm import Session
 from datetime import timedelta
 from .. import schemas, models, auth
 from ..database import get_db
+from ..profiling import ProfiledRoute
 import uuid
 
 router = APIRouter(
     prefix="/auth",
     tags=["authentication"],
+    route_class=ProfiledRoute
 )
 
 @router.post("/register", response_model=schemas.UserResponse)
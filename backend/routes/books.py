@@ -1,12 +1,15 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List
 from .. import schemas
 from .. import pinecone_crud
+from ..auth import require_admin
+from ..profiling import ProfiledRoute
 
 router = APIRouter(
     prefix="/books",
     tags=["books"],
-    responses={404: {"description": "Book not found"}}
+    responses={404: {"description": "Book not found"}},
+    route_class=ProfiledRoute
 )
 
 @router.post("/", response_model=schemas.BookResponse, status_code=status.HTTP_201_CREATED,
@@ -18,6 +21,8 @@ def create_book(book: schemas.BookCreate):
         return pinecone_crud.create_book(book.title)
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
                            detail=f"Error creating book: {str(e)}")
@@ -29,6 +34,8 @@ def get_books():
     """Get all books from Pinecone"""
     try:
         return pinecone_crud.get_books()
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
                            detail=f"Error retrieving books: {str(e)}")
@@ -45,6 +52,25 @@ def get_book(book_id: str):
         return db_book
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
                            detail=f"Error retrieving book: {str(e)}")
+
+@router.delete("/{book_id}",
+             dependencies=[Depends(require_admin)],
+             summary="Delete book",
+             description="Delete a book with all its chapters, chunks and stored text")
+def delete_book(book_id: str):
+    """Delete a book and drop its partition of the vector index"""
+    if pinecone_crud.get_book(book_id) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
+    try:
+        pinecone_crud.delete_book(book_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                           detail=f"Error deleting book: {str(e)}")
+    return {"status": "success", "message": "Book deleted"}
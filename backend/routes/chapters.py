@@ -1,12 +1,15 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Request, Response, status
 from typing import List, Optional
 from .. import schemas
 from .. import pinecone_crud
+from .. import http_cache
+from ..profiling import ProfiledRoute
 
 router = APIRouter(
     prefix="/chapters",
     tags=["chapters"],
-    responses={404: {"description": "Chapter not found"}}
+    responses={404: {"description": "Chapter not found"}},
+    route_class=ProfiledRoute
 )
 
 @router.post("/", response_model=schemas.ChapterResponse, status_code=status.HTTP_201_CREATED,
@@ -23,24 +26,55 @@ def create_chapter(chapter: schemas.ChapterCreate):
     except ValueError as e:
         # Convert ValueError to HTTP 400 Bad Request
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         # Handle any other exceptions
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
                            detail=f"Error creating chapter: {str(e)}")
 
+@router.post("/bulk", response_model=List[schemas.ChapterResponse], status_code=status.HTTP_201_CREATED,
+            summary="Create a table of contents",
+            description="Add all chapters of a book in one call; fails without creating any if a chapter number is taken")
+def create_chapters(toc: schemas.TableOfContentsCreate):
+    """Create all chapters of a book with one batched write"""
+    try:
+        return pinecone_crud.create_chapters(
+            book_id=toc.book_id,
+            chapters=[(entry.chapter_number, entry.title) for entry in toc.chapters]
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                           detail=f"Error creating chapters: {str(e)}")
+
 @router.get("/", response_model=List[schemas.ChapterResponse],
            summary="Get all chapters",
            description="Retrieve a list of all chapters")
-def get_chapters(book_id: Optional[str] = None):
+def get_chapters(request: Request, response: Response, book_id: Optional[str] = None):
     """Get all chapters, optionally filtered by book_id"""
-    return pinecone_crud.get_chapters(book_id=book_id)
+    chapters = pinecone_crud.get_chapters(book_id=book_id)
+    etag = http_cache.listing_etag(chapters, book_id)
+    if http_cache.etag_matches(request, etag):
+        return http_cache.not_modified(etag, http_cache.REVALIDATE)
+    http_cache.set_cache_headers(response, etag, http_cache.REVALIDATE)
+    return chapters
 
 @router.get("/{chapter_id}", response_model=schemas.ChapterResponse,
           summary="Get chapter by ID",
           description="Retrieve a specific chapter by its ID")
-def get_chapter(chapter_id: str):
+def get_chapter(chapter_id: str, request: Request, response: Response):
     """Get a specific chapter by ID"""
+    # Chapters are never edited, so a matching ETag is answered without a lookup
+    etag = http_cache.resource_etag("chapter", chapter_id)
+    if http_cache.etag_matches(request, etag):
+        return http_cache.not_modified(etag, http_cache.LONG_LIVED)
+
     db_chapter = pinecone_crud.get_chapter(chapter_id)
     if db_chapter is None:
         raise HTTPException(status_code=404, detail="Chapter not found")
-    return db_chapter
\ No newline at end of file
+    http_cache.set_cache_headers(response, etag, http_cache.LONG_LIVED)
+    return db_chapter
@@ -1,12 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
 from typing import List, Optional
+import os
+import re
 from .. import schemas
 from .. import pinecone_crud
+from .. import audio
+from .. import http_cache
+from ..responses import FastJSONResponse
+from ..profiling import ProfiledRoute
 
 router = APIRouter(
     prefix="/chunks",
     tags=["chunks"],
-    responses={404: {"description": "Chunk not found"}}
+    responses={404: {"description": "Chunk not found"}},
+    route_class=ProfiledRoute
 )
 
 @router.post("/", response_model=schemas.ChunkResponse, status_code=status.HTTP_201_CREATED,
@@ -37,7 +46,9 @@ def create_chunk(chunk: schemas.ChunkCreate):
         return pinecone_crud.create_chunk(
             book_id=chunk.book_id, 
             chapter_number=chunk.chapter_number, 
-            original_text=chunk.original_text
+            original_text=chunk.original_text,
+            chunk_index=chunk.chunk_index,
+            idempotency_key=chunk.idempotency_key
         )
     except HTTPException:
         # Re-raise HTTP exceptions (we already formatted them correctly)
@@ -51,25 +62,49 @@ def create_chunk(chunk: schemas.ChunkCreate):
 
 @router.get("/", response_model=List[schemas.ChunkResponse],
            summary="Get all chunks",
-           description="Retrieve a list of all chunks with filters by book ID and chapter number")
-def get_chunks(book_id: Optional[str] = None, chapter_number: Optional[int] = None):
+           description="Retrieve a list of all chunks with filters by book ID and chapter number; pass include_text=false to list only IDs and order")
+def get_chunks(request: Request, book_id: Optional[str] = None,
+               chapter_number: Optional[int] = None, include_text: bool = True):
     """Get all chunks, optionally filtered by book_id and chapter_number"""
     try:
-        return pinecone_crud.get_chunks_by_book_and_chapter(book_id=book_id, chapter_number=chapter_number)
+        chunks = pinecone_crud.get_chunks_by_book_and_chapter(
+            book_id=book_id,
+            chapter_number=chapter_number,
+            include_text=include_text
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
             detail=f"Error retrieving chunks: {str(e)}"
         )
 
+    # Chunk bodies are immutable, so IDs and positions identify the listing
+    etag = http_cache.listing_etag(chunks, book_id, chapter_number, include_text)
+    if http_cache.etag_matches(request, etag):
+        return http_cache.not_modified(etag, http_cache.REVALIDATE)
+
+    # The chunks were built by pinecone_crud, so skip response_model validation
+    return FastJSONResponse(
+        content=chunks,
+        headers={"ETag": etag, "Cache-Control": http_cache.REVALIDATE}
+    )
+
 @router.get("/{chunk_id}", response_model=schemas.ChunkResponse,
           summary="Get chunk by ID",
           description="Retrieve a specific chunk by its ID")
-def get_chunk(chunk_id: str):
+def get_chunk(chunk_id: str, request: Request, response: Response):
     """Get a specific chunk by ID"""
+    # Chunks are never edited, so a matching ETag is answered without a lookup
+    etag = http_cache.resource_etag("chunk", chunk_id)
+    if http_cache.etag_matches(request, etag):
+        return http_cache.not_modified(etag, http_cache.IMMUTABLE)
+
     chunk = pinecone_crud.get_chunk(chunk_id)
     if chunk is None:
         raise HTTPException(status_code=404, detail="Chunk not found")
+    http_cache.set_cache_headers(response, etag, http_cache.IMMUTABLE)
     return chunk
 
 @router.post("/search", response_model=schemas.SearchResult,
@@ -83,6 +118,108 @@ def search_chunks(search_query: schemas.SearchQuery):
             book_id=search_query.book_id,
             top_k=search_query.limit
         )
-        return {"chunks": results}
+        if search_query.context:
+            results = pinecone_crud.add_context(results, search_query.context)
+        return FastJSONResponse(content={"chunks": results})
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+
+@router.post("/context", response_model=schemas.ChunkContextResult,
+            summary="Get chunks in context",
+            description="Retrieve chunks together with their neighbouring chunks on either side within the chapter")
+def get_chunk_context(request: schemas.ChunkContextRequest):
+    """Get chunks with up to `radius` neighbouring chunks before and after each"""
+    try:
+        chunks = pinecone_crud.get_chunk_context(request.chunk_ids, request.radius)
+        return FastJSONResponse(content={"chunks": chunks})
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"Error retrieving chunk context: {str(e)}")
+
+def _iter_file_range(f, start, end, block_size=64 * 1024):
+    """Yield the bytes of an open file between start and end (inclusive), then close it"""
+    with f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = f.read(min(block_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+def _ranged_file_response(request: Request, f, media_type: str):
+    """Serve an open file honouring a single-range Range header"""
+    file_size = os.fstat(f.fileno()).st_size
+    headers = {"Accept-Ranges": "bytes"}
+    range_header = request.headers.get("range")
+
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip()) if range_header else None
+    if not match or match.groups() == ("", ""):
+        headers["Content-Length"] = str(file_size)
+        return StreamingResponse(_iter_file_range(f, 0, file_size - 1), media_type=media_type, headers=headers)
+
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), file_size - 1) if last else file_size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(0, file_size - int(last))
+        end = file_size - 1
+
+    if start >= file_size or start > end:
+        f.close()
+        headers["Content-Range"] = f"bytes */{file_size}"
+        return Response(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers=headers)
+
+    headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        _iter_file_range(f, start, end),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=media_type,
+        headers=headers
+    )
+
+@router.get("/{chunk_id}/audio",
+          summary="Stream chunk audio",
+          description="Stream the narrated audio of a chunk with HTTP Range support; upcoming chunks are pre-rendered in the background")
+def get_chunk_audio(chunk_id: str, request: Request, voice: str = audio.DEFAULT_VOICE):
+    """Serve pre-rendered chunk audio, rendering it on a cache miss"""
+    chunk = pinecone_crud.get_chunk(chunk_id)
+    if chunk is None:
+        raise HTTPException(status_code=404, detail="Chunk not found")
+
+    renderer = audio.get_renderer()
+    try:
+        # Open the file right away so a concurrent cache eviction cannot remove it
+        # mid-stream; retry once if it was evicted between rendering and opening
+        for attempt in range(2):
+            path = renderer.render(chunk["original_text"] or "", voice)
+            try:
+                audio_file = open(path, "rb")
+                break
+            except FileNotFoundError:
+                if attempt:
+                    raise
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"Error rendering audio: {str(e)}")
+
+    try:
+        response = _ranged_file_response(request, audio_file, renderer.engine.media_type)
+    except Exception:
+        audio_file.close()
+        raise
+    # Keep the listener ahead of the read position, once the response is on its way
+    response.background = BackgroundTask(renderer.prefetch_after, chunk, voice)
+    return response
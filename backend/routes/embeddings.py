@@ -0,0 +1,61 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.orm import Session
+from typing import List
+from .. import schemas, crud, jobs
+from ..auth import require_admin
+from ..database import get_db
+from ..embedding_versions import registry, namespace_suffix, VERSION_NAME_PATTERN
+from ..profiling import ProfiledRoute
+
+router = APIRouter(
+    prefix="/embeddings",
+    tags=["embeddings"],
+    dependencies=[Depends(require_admin)],
+    responses={404: {"description": "Embedding version not found"}},
+    route_class=ProfiledRoute
+)
+
+@router.get("/versions", response_model=List[schemas.EmbeddingVersionResponse],
+           summary="List embedding versions",
+           description="List embedding versions, oldest first; searches are served by the active one")
+def list_versions(db: Session = Depends(get_db)):
+    """List embedding versions"""
+    # Makes sure the initial version is registered
+    registry.active()
+    return crud.get_embedding_versions(db)
+
+@router.post("/versions", response_model=schemas.JobResponse, status_code=status.HTTP_202_ACCEPTED,
+            summary="Create an embedding version",
+            description="Queue a background job embedding every chunk with a new model next to the active version, "
+                        "switching searches to it once complete and then deleting the old vectors")
+def create_version(request: schemas.EmbeddingVersionCreate, db: Session = Depends(get_db)):
+    """Start building a new embedding version"""
+    if not VERSION_NAME_PATTERN.match(request.name):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Version names use up to 32 letters, digits, - and _")
+    if not 1 <= request.dimension <= 20000:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="dimension must be between 1 and 20000")
+    registry.active()
+    if crud.get_embedding_version(db, request.name):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Embedding version {request.name} already exists")
+    if crud.get_embedding_versions(db, statuses=["building"]):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Another embedding version is already being built")
+
+    crud.create_embedding_version(db, request.name, request.model, request.dimension, namespace_suffix(request.name))
+    # New chunks are written to the version from now on
+    registry.invalidate()
+    return jobs.submit_job(db, "reindex_embeddings", {"version": request.name})
+
+@router.delete("/versions/{name}", response_model=schemas.JobResponse, status_code=status.HTTP_202_ACCEPTED,
+              summary="Abandon an embedding version",
+              description="Stop building an embedding version and queue deletion of its vectors")
+def abandon_version(name: str, db: Session = Depends(get_db)):
+    """Abandon a version that is still being built"""
+    version = crud.get_embedding_version(db, name)
+    if version is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Embedding version not found")
+    if version.status != "building":
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only a version being built can be abandoned")
+
+    crud.set_embedding_version_status(db, name, "retired")
+    registry.invalidate()
+    return jobs.submit_job(db, "collect_embedding_versions", {})
@@ -0,0 +1,81 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.orm import Session
+from typing import List, Optional
+import uuid
+from .. import schemas, crud, jobs
+from .. import pinecone_crud
+from ..auth import require_admin
+from ..database import get_db
+from ..profiling import ProfiledRoute
+
+router = APIRouter(
+    prefix="/jobs",
+    tags=["jobs"],
+    responses={404: {"description": "Job not found"}},
+    route_class=ProfiledRoute
+)
+
+@router.post("/ingest", response_model=schemas.JobResponse, status_code=status.HTTP_202_ACCEPTED,
+            summary="Bulk ingest chunks",
+            description="Queue a background job creating and embedding chunks for a chapter")
+def ingest_chunks(request: schemas.IngestRequest, db: Session = Depends(get_db)):
+    """Queue bulk ingestion of chunk texts into a chapter"""
+    book = pinecone_crud.get_book(request.book_id)
+    if not book:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Book with ID {request.book_id} not found"
+        )
+    chapters = pinecone_crud.get_chapters(book_id=request.book_id)
+    if not any(c["chapter_number"] == request.chapter_number for c in chapters):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Chapter {request.chapter_number} not found in book '{book['title']}'"
+        )
+
+    return jobs.submit_job(db, "ingest_chapter", request.model_dump(), total=len(request.texts))
+
+@router.post("/reembed/{book_id}", response_model=schemas.JobResponse, status_code=status.HTTP_202_ACCEPTED,
+            dependencies=[Depends(require_admin)],
+            summary="Re-embed a book",
+            description="Queue a background job recomputing the embeddings of all chunks in a book")
+def reembed_book(book_id: str, db: Session = Depends(get_db)):
+    """Queue re-embedding of every chunk in a book"""
+    if not pinecone_crud.get_book(book_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
+    return jobs.submit_job(db, "reembed_book", {"book_id": book_id})
+
+@router.post("/partition-index", response_model=schemas.JobResponse, status_code=status.HTTP_202_ACCEPTED,
+            dependencies=[Depends(require_admin)],
+            summary="Partition the vector index",
+            description="Queue a background job moving vectors stored before partitioning into the catalog and per-book namespaces")
+def partition_index(db: Session = Depends(get_db)):
+    """Queue migration of the vector index to per-book namespaces"""
+    return jobs.submit_job(db, "partition_index", {})
+
+@router.post("/compact-history", response_model=schemas.JobResponse, status_code=status.HTTP_202_ACCEPTED,
+            dependencies=[Depends(require_admin)],
+            summary="Compact reading history",
+            description="Queue a background job folding reading history into the stats rollups and deleting raw events past retention")
+def compact_history(retention_days: int = jobs.READING_HISTORY_RETENTION_DAYS, db: Session = Depends(get_db)):
+    """Queue reading history compaction"""
+    if retention_days < 1:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="retention_days must be at least 1")
+    return jobs.submit_job(db, "compact_reading_history", {"retention_days": retention_days})
+
+@router.get("/", response_model=List[schemas.JobResponse],
+           summary="List jobs",
+           description="List background jobs, newest first, optionally filtered by status")
+def list_jobs(status: Optional[str] = None, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    """List background jobs"""
+    return crud.get_jobs(db, status=status, skip=skip, limit=limit)
+
+@router.get("/{job_id}", response_model=schemas.JobResponse,
+          summary="Get job status",
+          description="Get the status and progress of a background job")
+def get_job(job_id: uuid.UUID, db: Session = Depends(get_db)):
+    """Get a background job by ID"""
+    job = crud.get_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
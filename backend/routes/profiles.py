@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import FileResponse
+from typing import List
+import os
+from .. import profiling
+from ..auth import require_admin
+from ..profiling import ProfiledRoute
+
+router = APIRouter(
+    prefix="/profiles",
+    tags=["profiling"],
+    dependencies=[Depends(require_admin)],
+    responses={404: {"description": "Profile not found"}},
+    route_class=ProfiledRoute
+)
+
+@router.get("/", response_model=List[str],
+           summary="List request profiles",
+           description="List captured request profiles, newest first")
+def list_profiles():
+    """List folded-stack profile files in PROFILE_DIR"""
+    if not os.path.isdir(profiling.PROFILE_DIR):
+        return []
+    return sorted(
+        (name for name in os.listdir(profiling.PROFILE_DIR) if name.endswith(".folded")),
+        reverse=True
+    )
+
+@router.get("/{name}",
+          summary="Download a request profile",
+          description="Download a folded-stack profile, ready for flamegraph.pl or speedscope")
+def get_profile(name: str):
+    """Download a single profile file"""
+    if os.path.basename(name) != name or not name.endswith(".folded"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid profile name")
+    path = os.path.join(profiling.PROFILE_DIR, name)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain", filename=name)
@@ -0,0 +1,127 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+from starlette.concurrency import run_in_threadpool
+from datetime import datetime
+from typing import Optional
+import asyncio
+from .. import pinecone_crud
+from ..concurrency import Overloaded
+from ..auth import get_user_from_token
+from ..database import SessionLocal
+from ..reading import ReadingSession, READING_SESSION_FLUSH_SECONDS, READING_SESSION_FLUSH_ACKS
+from ..profiling import ProfiledRoute
+
+router = APIRouter(
+    prefix="/reading",
+    tags=["reading"],
+    route_class=ProfiledRoute
+)
+
+def _authenticate(token: Optional[str]):
+    """Active user for an access token, or None; records the login once per session"""
+    if not token:
+        return None
+    db = SessionLocal()
+    try:
+        user = get_user_from_token(db, token)
+        if user is None or not user.is_active:
+            return None
+        user.last_login = datetime.utcnow()
+        db.commit()
+        return user.id
+    finally:
+        db.close()
+
+async def _push(websocket: WebSocket, session: ReadingSession):
+    """Top up the client's read-ahead window"""
+    was_finished = session.finished
+    for message in await run_in_threadpool(session.fill):
+        await websocket.send_json(message)
+    if session.finished and not was_finished:
+        await websocket.send_json({"type": "end"})
+
+@router.websocket("/session")
+async def reading_session(websocket: WebSocket, book_id: str, chunk_id: Optional[str] = None, token: Optional[str] = None):
+    """Live reading session for one book
+
+    Authenticate with ?token= (or an Authorization: Bearer header). The server pushes
+    {"type": "chunk", "seq", ...} messages ahead of the reader, starting at chunk_id or
+    the last read position. The client sends {"ack": seq} when it reaches a chunk and
+    {"seek": chunk_id} to jump; progress is saved to the reading history in batches.
+    """
+    authorization = websocket.headers.get("authorization", "")
+    if not token and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    user_id = await run_in_threadpool(_authenticate, token)
+    if user_id is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Could not validate credentials")
+        return
+    try:
+        book = await run_in_threadpool(pinecone_crud.get_book, book_id)
+    except Overloaded:
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Server overloaded")
+        return
+    if book is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Book not found")
+        return
+
+    await websocket.accept()
+    session = ReadingSession(user_id, book_id)
+    try:
+        try:
+            await run_in_threadpool(session.start, chunk_id)
+        except ValueError as e:
+            await websocket.send_json({"type": "error", "detail": str(e)})
+            await run_in_threadpool(session.start)
+        await _push(websocket, session)
+
+        loop = asyncio.get_running_loop()
+        last_flush = loop.time()
+        while True:
+            timeout = max(0.0, READING_SESSION_FLUSH_SECONDS - (loop.time() - last_flush))
+            try:
+                message = await asyncio.wait_for(websocket.receive_json(), timeout)
+            except asyncio.TimeoutError:
+                message = None
+            except KeyError:
+                # A binary frame; messages are JSON text
+                await websocket.send_json({"type": "error", "detail": "Messages must be JSON text frames"})
+                await websocket.close(code=status.WS_1003_UNSUPPORTED_DATA)
+                return
+            except ValueError:
+                await websocket.send_json({"type": "error", "detail": "Messages must be JSON"})
+                continue
+
+            if isinstance(message, dict) and isinstance(message.get("ack"), int):
+                session.ack(message["ack"])
+                await _push(websocket, session)
+            elif isinstance(message, dict) and "seek" in message:
+                try:
+                    await run_in_threadpool(session.seek, message["seek"])
+                except ValueError as e:
+                    await websocket.send_json({"type": "error", "detail": str(e)})
+                    continue
+                await websocket.send_json({"type": "seeked", "next_seq": session.next_seq})
+                await _push(websocket, session)
+            elif message is not None:
+                await websocket.send_json({"type": "error", "detail": "Expected {\"ack\": seq} or {\"seek\": chunk_id}"})
+
+            if session.pending and (
+                len(session.pending) >= READING_SESSION_FLUSH_ACKS
+                or loop.time() - last_flush >= READING_SESSION_FLUSH_SECONDS
+            ):
+                await run_in_threadpool(session.flush)
+                last_flush = loop.time()
+            elif not session.pending:
+                last_flush = loop.time()
+    except WebSocketDisconnect:
+        pass
+    except Overloaded:
+        # Shed by admission control; the client can reconnect and resume from its last position
+        await websocket.send_json({"type": "error", "detail": "Server overloaded, try again later"})
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+    finally:
+        # Progress acknowledged before the connection closed is kept
+        try:
+            await run_in_threadpool(session.flush)
+        except Exception as e:
+            print(f"Error saving reading progress: {e}")
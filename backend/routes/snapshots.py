@@ -0,0 +1,108 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import List
+import os
+from .. import schemas, jobs, snapshot
+from ..auth import require_admin
+from ..database import get_db
+from ..profiling import ProfiledRoute
+
+router = APIRouter(
+    prefix="/snapshots",
+    tags=["snapshots"],
+    dependencies=[Depends(require_admin)],
+    responses={404: {"description": "Snapshot not found"}},
+    route_class=ProfiledRoute
+)
+
+def _snapshot_path(name: str):
+    try:
+        return snapshot.snapshot_path(name)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+def _snapshot_file(name: str, file: str):
+    if file not in snapshot.FILES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Snapshot files are {', '.join(snapshot.FILES)}")
+    return os.path.join(_snapshot_path(name), file)
+
+@router.get("/", response_model=List[schemas.SnapshotResponse],
+           summary="List snapshots",
+           description="List library snapshots in SNAPSHOT_DIR, newest first")
+def list_snapshots():
+    """List snapshot directories and their manifests"""
+    if not os.path.isdir(snapshot.SNAPSHOT_DIR):
+        return []
+    results = []
+    for name in sorted(os.listdir(snapshot.SNAPSHOT_DIR), reverse=True):
+        path = os.path.join(snapshot.SNAPSHOT_DIR, name)
+        if os.path.isdir(path):
+            manifest = snapshot.read_manifest(path)
+            results.append({"name": name, "complete": manifest is not None, "manifest": manifest})
+    return results
+
+@router.post("/export", response_model=schemas.JobResponse, status_code=status.HTTP_202_ACCEPTED,
+            summary="Export a snapshot",
+            description="Queue a background job writing books, chapters, chunk text and embeddings to Parquet files")
+def export_snapshot(request: schemas.SnapshotExportRequest, db: Session = Depends(get_db)):
+    """Queue a library export"""
+    name = request.name or datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    _snapshot_path(name)
+    return jobs.submit_job(db, "export_snapshot", {"name": name, "book_ids": request.book_ids})
+
+@router.post("/{name}/import", response_model=schemas.JobResponse, status_code=status.HTTP_202_ACCEPTED,
+            summary="Import a snapshot",
+            description="Queue a background job bulk-loading a snapshot with its stored embeddings, without re-embedding")
+def import_snapshot(name: str, request: schemas.SnapshotImportRequest, db: Session = Depends(get_db)):
+    """Queue a library import"""
+    manifest = snapshot.read_manifest(_snapshot_path(name))
+    if manifest is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot not found or incomplete")
+    return jobs.submit_job(db, "import_snapshot", {"name": name, "book_ids": request.book_ids}, total=manifest["chunks"])
+
+@router.get("/{name}/{file}",
+          summary="Download a snapshot file",
+          description="Download one of the Parquet files or the manifest of a snapshot")
+def download_snapshot_file(name: str, file: str):
+    """Stream a snapshot file"""
+    path = _snapshot_file(name, file)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot file not found")
+    media_type = "application/json" if file == snapshot.MANIFEST else "application/vnd.apache.parquet"
+    return FileResponse(path, media_type=media_type, filename=file)
+
+@router.put("/{name}/{file}", status_code=status.HTTP_201_CREATED,
+          summary="Upload a snapshot file",
+          description="Upload a snapshot file exported elsewhere, e.g. to clone a library; upload the manifest last")
+async def upload_snapshot_file(name: str, file: str, request: Request):
+    """Stream an uploaded snapshot file to disk"""
+    path = _snapshot_file(name, file)
+    too_large = HTTPException(
+        status_code=413,  # Content Too Large; the constant was renamed across Starlette versions
+        detail=f"Snapshot files are limited to {snapshot.SNAPSHOT_UPLOAD_MAX_BYTES} bytes"
+    )
+    if int(request.headers.get("content-length") or 0) > snapshot.SNAPSHOT_UPLOAD_MAX_BYTES:
+        raise too_large
+    # File operations run in the thread pool so a slow disk doesn't block the event loop
+    await run_in_threadpool(os.makedirs, os.path.dirname(path), exist_ok=True)
+    partial_path = path + ".part"
+    size = 0
+    f = await run_in_threadpool(open, partial_path, "wb")
+    try:
+        try:
+            async for block in request.stream():
+                size += len(block)
+                if size > snapshot.SNAPSHOT_UPLOAD_MAX_BYTES:
+                    raise too_large
+                await run_in_threadpool(f.write, block)
+        finally:
+            await run_in_threadpool(f.close)
+        await run_in_threadpool(os.replace, partial_path, path)
+    finally:
+        # Left behind only if the upload failed or was cut short
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return {"name": name, "file": file, "bytes": size}
@@ -1,14 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from typing import List
+from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 from .. import schemas, models, crud
 from ..database import get_db
 from ..auth import get_current_active_user
+from ..recommendations import recommender, RECOMMENDATIONS_PER_USER
+from ..profiling import ProfiledRoute
 
 router = APIRouter(
     prefix="/users",
     tags=["users"],
-    responses={404: {"description": "User data not found"}}
+    responses={404: {"description": "User data not found"}},
+    route_class=ProfiledRoute
 )
 
 # Reading history endpoints
@@ -54,6 +58,49 @@ def get_last_read(
     """Get the last read position for a specific book"""
     return crud.get_last_read(db, user_id=current_user.id, book_id=book_id)
 
+# Reading stats endpoints, served from the rollup tables
+@router.get("/stats/books",
+          response_model=List[schemas.ReadingBookStatResponse],
+          summary="Get reading stats per book",
+          description="Get the user's reading totals for every book they have read, most recent first")
+def get_book_stats(
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """Get reading totals per book for the current user"""
+    return crud.get_reading_book_stats(db, user_id=current_user.id)
+
+@router.get("/stats/books/{book_id}",
+          response_model=schemas.ReadingBookStatResponse,
+          summary="Get reading stats for a book",
+          description="Get the user's reading totals for a specific book")
+def get_book_stat(
+    book_id: str,
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """Get reading totals for a specific book"""
+    stat = crud.get_reading_book_stat(db, user_id=current_user.id, book_id=book_id)
+    if stat is None:
+        raise HTTPException(status_code=404, detail="No reading history for this book")
+    return stat
+
+@router.get("/stats/daily",
+          response_model=List[schemas.ReadingDayStatResponse],
+          summary="Get daily reading stats",
+          description="Get the user's reading totals per day over the last days, optionally for one book")
+def get_daily_stats(
+    days: int = 30,
+    book_id: str = None,
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """Get reading totals per day for the current user"""
+    if days < 1 or days > 366:
+        raise HTTPException(status_code=400, detail="days must be between 1 and 366")
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    return crud.get_reading_daily_stats(db, user_id=current_user.id, since=since, book_id=book_id)
+
 # Favorites endpoints
 @router.post("/favorites/{book_id}", 
            status_code=status.HTTP_201_CREATED,
@@ -90,3 +137,15 @@ def get_favorites(
 ):
     """Get the user's favorite books"""
     return crud.get_user_favorites(db, user_id=current_user.id)
+
+# Recommendation endpoints
+@router.get("/recommendations",
+          response_model=List[schemas.RecommendationResponse],
+          summary="Get recommendations",
+          description="Get \"because you read X\" book recommendations, precomputed from reading history and favorites")
+def get_recommendations(
+    limit: int = Query(10, ge=1, le=RECOMMENDATIONS_PER_USER),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Get book recommendations for the current user"""
+    return recommender.recommend(current_user.id, limit=limit)
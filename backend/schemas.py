@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field, EmailStr
 from typing import Optional, List, Dict, Any
-from datetime import datetime
+from datetime import date, datetime
 from uuid import UUID
 
 # User schemas
@@ -44,24 +44,126 @@ class ChapterCreate(BaseModel):
 class ChapterResponse(ChapterCreate):
     id: str = Field(..., description="The unique identifier for the chapter")
 
+class TableOfContentsEntry(BaseModel):
+    chapter_number: int = Field(..., description="Chapter number within the book")
+    title: str = Field(..., description="Title of the chapter")
+
+class TableOfContentsCreate(BaseModel):
+    book_id: str = Field(..., description="ID of the book the chapters belong to")
+    chapters: List[TableOfContentsEntry] = Field(..., description="Chapters of the book, in any order")
+
 # Chunk schemas
 class ChunkCreate(BaseModel):
     book_id: str = Field(..., description="ID of the book this chunk belongs to")
     chapter_number: int = Field(..., description="Chapter number within the book")
     original_text: str = Field(..., description="Original text content of the chunk")
+    chunk_index: Optional[int] = Field(None, description="Index the chunk is meant for; the same text already at this index is returned instead of stored again")
+    idempotency_key: Optional[str] = Field(None, description="Client-chosen key; a retry with the same key returns the chunk created the first time")
 
 class ChunkResponse(BaseModel):
     id: str = Field(..., description="The unique identifier for the chunk")
     book_id: str = Field(..., description="ID of the book this chunk belongs to")
     chapter_id: str = Field(..., description="ID of the chapter this chunk belongs to")
     chunk_index: int = Field(..., description="Index of this chunk within the chapter")
-    original_text: str = Field(..., description="Original text content of the chunk")
+    original_text: Optional[str] = Field(None, description="Original text content of the chunk, omitted when not requested")
+
+# Reading stats schemas
+class ReadingBookStatResponse(BaseModel):
+    book_id: str = Field(..., description="ID of the book")
+    events: int = Field(..., description="Number of reading events recorded")
+    chapters_read: int = Field(..., description="Number of distinct chapters read")
+    seconds_read: int = Field(..., description="Estimated reading time in seconds")
+    first_read_at: datetime = Field(..., description="When the user first read the book")
+    last_read_at: datetime = Field(..., description="When the user last read the book")
+    last_chapter_id: Optional[str] = Field(None, description="Chapter of the last reading position")
+    last_chunk_id: Optional[str] = Field(None, description="Chunk of the last reading position")
+    
+    class Config:
+        from_attributes = True
+
+class ReadingDayStatResponse(BaseModel):
+    day: date = Field(..., description="Calendar day (UTC)")
+    events: int = Field(..., description="Number of reading events that day")
+    chapters_started: int = Field(..., description="Chapters read for the first time that day")
+    seconds_read: int = Field(..., description="Estimated reading time in seconds")
+    
+    class Config:
+        from_attributes = True
+
+# Recommendation schemas
+class RecommendationResponse(BaseModel):
+    book_id: str = Field(..., description="ID of the recommended book")
+    title: Optional[str] = Field(None, description="Title of the recommended book")
+    because_book_id: Optional[str] = Field(None, description="Book read by the user this recommendation is based on; empty for popular books")
+    because_title: Optional[str] = Field(None, description="Title of the book this recommendation is based on")
+    score: float = Field(..., description="Similarity score")
 
 # Search schemas
 class SearchQuery(BaseModel):
     query: str = Field(..., description="Search query text")
     book_id: Optional[str] = Field(None, description="Optional book ID to limit search to")
     limit: int = Field(5, description="Maximum number of results to return")
+    context: int = Field(0, description="Neighbouring chunks to include before and after each result (up to 10)")
 
 class SearchResult(BaseModel):
-    chunks: List[Dict[str, Any]] = Field(..., description="List of matching chunks with scores")
\ No newline at end of file
+    chunks: List[Dict[str, Any]] = Field(..., description="List of matching chunks with scores, and their before/after context when requested")
+
+class ChunkContextRequest(BaseModel):
+    chunk_ids: List[str] = Field(..., description="IDs of the chunks to expand")
+    radius: int = Field(2, description="Neighbouring chunks to include on each side (up to 10)")
+
+class ChunkContextResult(BaseModel):
+    chunks: List[Dict[str, Any]] = Field(..., description="The requested chunks, each with before and after lists of neighbouring chunks")
+
+# Job schemas
+class IngestRequest(BaseModel):
+    book_id: str = Field(..., description="ID of the book the chunks belong to")
+    chapter_number: int = Field(..., description="Chapter number within the book")
+    texts: List[str] = Field(..., description="Chunk texts in reading order")
+
+class JobResponse(BaseModel):
+    id: UUID = Field(..., description="The unique identifier for the job")
+    job_type: str = Field(..., description="Kind of work the job performs")
+    status: str = Field(..., description="queued, running, completed or failed")
+    progress: int = Field(..., description="Number of items processed")
+    total: int = Field(..., description="Total number of items, when known")
+    result: Optional[Dict[str, Any]] = Field(None, description="Result summary of a completed job")
+    error: Optional[str] = Field(None, description="Error message of a failed job")
+    attempts: int = Field(..., description="Number of times the job was started")
+    created_at: datetime = Field(..., description="When the job was submitted")
+    started_at: Optional[datetime] = Field(None, description="When the job was last started")
+    finished_at: Optional[datetime] = Field(None, description="When the job finished")
+    
+    class Config:
+        from_attributes = True
+
+# Snapshot schemas
+class SnapshotExportRequest(BaseModel):
+    name: Optional[str] = Field(None, description="Snapshot name; defaults to a UTC timestamp")
+    book_ids: Optional[List[str]] = Field(None, description="Limit the snapshot to these books")
+
+class SnapshotImportRequest(BaseModel):
+    book_ids: Optional[List[str]] = Field(None, description="Only import these books from the snapshot")
+
+class SnapshotResponse(BaseModel):
+    name: str = Field(..., description="Snapshot name")
+    complete: bool = Field(..., description="Whether the snapshot has a manifest and can be imported")
+    manifest: Optional[Dict[str, Any]] = Field(None, description="Counts, vector dimension and embedding model of the snapshot")
+
+# Embedding version schemas
+class EmbeddingVersionCreate(BaseModel):
+    name: str = Field(..., description="Version name, e.g. v2 (letters, digits, - and _)")
+    model: str = Field(..., description="sentence-transformers model producing the embeddings")
+    dimension: int = Field(..., description="Dimension of the model's embeddings")
+
+class EmbeddingVersionResponse(BaseModel):
+    name: str = Field(..., description="Version name")
+    model: str = Field(..., description="Model producing the embeddings")
+    dimension: int = Field(..., description="Dimension of the embeddings")
+    status: str = Field(..., description="building, active, retired or deleted")
+    created_at: datetime = Field(..., description="When the version was created")
+    activated_at: Optional[datetime] = Field(None, description="When searches switched to the version")
+    retired_at: Optional[datetime] = Field(None, description="When the version stopped serving")
+    
+    class Config:
+        from_attributes = True
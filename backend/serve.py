@@ -0,0 +1,167 @@
+"""Production server: load the app once, then fork worker processes.
+
+The master imports the app, loads the embedding models and the catalog cache and
+freezes the garbage collector before forking, so workers share those pages
+copy-on-write instead of each loading its own copy. Workers accept connections
+on one listening socket; a worker that dies is replaced. Only the first worker
+runs background jobs, and /metrics aggregates all workers.
+
+Usage:
+    python -m backend.serve [--workers 4] [--host 0.0.0.0] [--port 8000]
+"""
+import argparse
+import gc
+import glob
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+import traceback
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "0")) or os.cpu_count() or 1
+# Pause before replacing a worker that exited, so a crash loop doesn't spin
+RESTART_DELAY_SECONDS = 1.0
+
+
+def prepare_metrics_dir():
+    """Directory where workers write their metrics; must be set before prometheus_client is imported"""
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        # Values left by a previous run would be added to this one's
+        os.makedirs(path, exist_ok=True)
+        for stale in glob.glob(os.path.join(path, "*.db")):
+            os.remove(stale)
+    else:
+        path = tempfile.mkdtemp(prefix="prometheus-")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+    return path
+
+
+def preload():
+    """Import the app and load everything workers only read"""
+    from .main import app
+    from . import audio, database, vectors
+    from .catalog_cache import catalog_cache
+    from .concurrency import admission
+    from .embedding_versions import registry
+    from .recommendations import recommender
+
+    # Models of the versions serving searches and being built
+    for version in registry.versions():
+        if version.status in ("active", "building") and version.model != vectors.PLACEHOLDER_MODEL:
+            vectors.get_model(version.model)
+    catalog_cache.enable()
+    # Workers share one vector store rate limit instead of each getting the full rate
+    admission.share()
+    # The first worker refreshes recommendations and publishes them to the others
+    recommender.share()
+    # Audio prefetches from every worker are rendered once, by the first worker
+    audio.get_renderer().share()
+    # Workers open their own database connections
+    database.engine.dispose()
+    # Objects loaded so far are never collected; collections would touch their
+    # headers and copy the shared pages into every worker
+    gc.collect()
+    gc.freeze()
+    return app
+
+
+def run_worker(app, sock, worker_id, workers, log_level):
+    """Serve requests from the shared socket until told to stop"""
+    import uvicorn
+    from . import pinecone_db
+
+    os.environ["SERVE_WORKER_ID"] = str(worker_id)
+    pinecone_db.reconnect()
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        # Split the cores between workers instead of every worker using all of them
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    config = uvicorn.Config(app, log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the API with pre-forked worker processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+
+    if not hasattr(os, "fork"):
+        parser.error("Pre-fork serving needs a POSIX system; use uvicorn directly")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.workers > 1 and os.getenv("VECTOR_STORE", "pinecone") == "memory":
+        # Each process would write to its own copy of the in-memory index
+        parser.error("The in-memory vector store cannot be shared by several workers; use --workers 1")
+
+    prepare_metrics_dir()
+    app = preload()
+    from prometheus_client import multiprocess
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    children = {}  # pid -> worker id
+    stopping = False
+
+    def spawn(worker_id):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                # Own process group: a Ctrl-C reaches the master only, which stops workers once
+                os.setpgid(0, 0)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                run_worker(app, sock, worker_id, args.workers, args.log_level)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = worker_id
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    for worker_id in range(args.workers):
+        spawn(worker_id)
+    print(f"Serving on {args.host}:{args.port} with {args.workers} workers (master pid {os.getpid()})")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker_id = children.pop(pid, None)
+        multiprocess.mark_process_dead(pid)
+        if worker_id is not None and not stopping:
+            print(f"Worker {worker_id} (pid {pid}) exited with status {status}; restarting")
+            time.sleep(RESTART_DELAY_SECONDS)
+            if not stopping:
+                spawn(worker_id)
+    sock.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""Library snapshots in Parquet, for backups, restores and warm starts.
+
+A snapshot is a directory holding books.parquet, chapters.parquet and
+chunks.parquet (text and float32 embeddings as a fixed-size list column), plus a
+manifest.json written last, so a snapshot without a manifest is incomplete.
+Chunks are streamed in record batches both ways; importing loads the stored
+embeddings directly into the vector store without re-embedding.
+
+Usage:
+    python -m backend.snapshot export data/snapshots/2024-06-01 [--book-id ID ...]
+    python -m backend.snapshot import data/snapshots/2024-06-01 [--book-id ID ...]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+from .vectors import PLACEHOLDER_MODEL
+
+load_dotenv()
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "data/snapshots")
+SNAPSHOT_BATCH_SIZE = int(os.getenv("SNAPSHOT_BATCH_SIZE", "500"))
+# Largest snapshot file accepted by the upload API
+SNAPSHOT_UPLOAD_MAX_BYTES = int(os.getenv("SNAPSHOT_UPLOAD_MAX_BYTES", str(10 * 1024 ** 3)))
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+FILES = ("books.parquet", "chapters.parquet", "chunks.parquet", MANIFEST)
+
+BOOKS_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("title", pa.string()),
+])
+CHAPTERS_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("book_id", pa.string()),
+    ("chapter_number", pa.int32()),
+    ("title", pa.string()),
+])
+
+
+def chunks_schema(dimension):
+    """Schema of chunks.parquet for embeddings of the given dimension"""
+    return pa.schema([
+        ("id", pa.string()),
+        ("book_id", pa.string()),
+        ("chapter_id", pa.string()),
+        ("chunk_index", pa.int32()),
+        ("content_hash", pa.string()),
+        ("text", pa.large_string()),
+        ("embedding", pa.list_(pa.float32(), dimension)),
+    ])
+
+
+class SnapshotInterrupted(Exception):
+    """Raised when an export or import is asked to stop midway"""
+
+
+def read_manifest(path):
+    """Manifest of a complete snapshot, or None"""
+    manifest_path = os.path.join(path, MANIFEST)
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def export_snapshot(path, book_ids=None, batch_size=SNAPSHOT_BATCH_SIZE, progress=None, should_stop=None):
+    """Write the library (or the given books) to a snapshot directory; returns the manifest"""
+    from . import pinecone_crud
+    from .embedding_versions import registry
+
+    # Embeddings of the version serving searches
+    version = registry.active()
+    schema = chunks_schema(version.dimension)
+    os.makedirs(path, exist_ok=True)
+    # Any previous manifest would describe files about to be overwritten
+    if os.path.exists(os.path.join(path, MANIFEST)):
+        os.remove(os.path.join(path, MANIFEST))
+
+    books, chapters = [], []
+    for page in pinecone_crud.iter_catalog_records(batch_size=batch_size):
+        for record_id, metadata in page:
+            book_id = record_id if metadata["type"] == "book" else metadata.get("book_id")
+            if book_ids and book_id not in book_ids:
+                continue
+            if metadata["type"] == "book":
+                books.append({"id": record_id, "title": metadata.get("title")})
+            else:
+                chapters.append({
+                    "id": record_id,
+                    "book_id": book_id,
+                    "chapter_number": metadata.get("chapter_number"),
+                    "title": metadata.get("title")
+                })
+    pq.write_table(pa.Table.from_pylist(books, schema=BOOKS_SCHEMA), os.path.join(path, "books.parquet"))
+    pq.write_table(pa.Table.from_pylist(chapters, schema=CHAPTERS_SCHEMA), os.path.join(path, "chapters.parquet"))
+
+    chunk_count = 0
+    with pq.ParquetWriter(os.path.join(path, "chunks.parquet"), schema, compression="zstd") as writer:
+        for book in books:
+            for ids, embeddings, metadatas, texts in pinecone_crud.iter_chunk_records(
+                book["id"], batch_size=batch_size, version=version
+            ):
+                if should_stop and should_stop():
+                    raise SnapshotInterrupted(f"Export to {path} interrupted")
+                writer.write_batch(pa.RecordBatch.from_arrays([
+                    pa.array(ids, pa.string()),
+                    pa.array([book["id"]] * len(ids), pa.string()),
+                    pa.array([m.get("chapter_id") for m in metadatas], pa.string()),
+                    pa.array([m.get("chunk_index") for m in metadatas], pa.int32()),
+                    pa.array([m.get("content_hash") for m in metadatas], pa.string()),
+                    pa.array([text or "" for text in texts], pa.large_string()),
+                    # Wraps the contiguous float32 buffer without copying row by row
+                    pa.FixedSizeListArray.from_arrays(pa.array(embeddings.ravel()), version.dimension),
+                ], schema=schema))
+                chunk_count += len(ids)
+                if progress:
+                    progress(chunk_count)
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "created_at": datetime.utcnow().isoformat(),
+        "vector_dim": version.dimension,
+        "embedding_model": version.model,
+        "embedding_version": version.name,
+        "books": len(books),
+        "chapters": len(chapters),
+        "chunks": chunk_count,
+    }
+    with open(os.path.join(path, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def import_snapshot(path, book_ids=None, batch_size=SNAPSHOT_BATCH_SIZE, start=0, progress=None, should_stop=None):
+    """Bulk-load a snapshot into the vector and blob stores, keeping all IDs
+
+    `start` skips chunk rows already imported, so an interrupted import can resume.
+    Returns the number of chunk rows processed.
+    """
+    from . import pinecone_crud
+    from .embedding_versions import registry
+
+    manifest = read_manifest(path)
+    if manifest is None:
+        raise ValueError(f"{path} is not a complete snapshot")
+    # Stored embeddings are only usable by the version of the same model
+    version = registry.active()
+    if manifest["vector_dim"] != version.dimension:
+        raise ValueError(f"Snapshot vectors have {manifest['vector_dim']} dimensions, the index uses {version.dimension}")
+    snapshot_model = manifest.get("embedding_model") or PLACEHOLDER_MODEL
+    if snapshot_model != version.model:
+        raise ValueError(f"Snapshot embeddings were made by {snapshot_model}, the active version uses {version.model}")
+
+    for name in ("books.parquet", "chapters.parquet"):
+        records = [
+            row for row in pq.read_table(os.path.join(path, name)).to_pylist()
+            if not book_ids or row.get("book_id", row["id"]) in book_ids
+        ]
+        kind = "book" if name == "books.parquet" else "chapter"
+        for offset in range(0, len(records), batch_size):
+            batch = records[offset:offset + batch_size]
+            pinecone_crud.load_catalog_records(
+                [row["id"] for row in batch],
+                [{"type": kind, **{k: v for k, v in row.items() if k != "id"}} for row in batch]
+            )
+
+    position = 0
+    chunks_file = pq.ParquetFile(os.path.join(path, "chunks.parquet"))
+    for batch in chunks_file.iter_batches(batch_size=batch_size):
+        if position + batch.num_rows <= start:
+            position += batch.num_rows
+            continue
+        if should_stop and should_stop():
+            raise SnapshotInterrupted(f"Import from {path} interrupted")
+        skip = max(0, start - position)
+        batch = batch.slice(skip)
+        position += skip
+
+        columns = {
+            name: batch.column(name).to_pylist()
+            for name in ("id", "book_id", "chapter_id", "chunk_index", "content_hash", "text")
+        }
+        # flatten() honours the slice offset; the float32 buffer becomes the matrix as is
+        embeddings = batch.column("embedding").flatten().to_numpy().reshape(-1, version.dimension)
+        batch_book_ids = np.asarray(columns["book_id"], dtype=object)
+        for book_id in dict.fromkeys(columns["book_id"]):
+            if book_ids and book_id not in book_ids:
+                continue
+            rows = np.flatnonzero(batch_book_ids == book_id)
+            pinecone_crud.load_chunk_records(
+                book_id,
+                [columns["id"][i] for i in rows],
+                embeddings[rows],
+                [
+                    {
+                        "chapter_id": columns["chapter_id"][i],
+                        "chunk_index": columns["chunk_index"][i],
+                        "content_hash": columns["content_hash"][i]
+                    }
+                    for i in rows
+                ],
+                [columns["text"][i] for i in rows],
+                version=version
+            )
+        position += batch.num_rows
+        if progress:
+            progress(position)
+    return position
+
+
+def snapshot_path(name):
+    """Directory of a named snapshot under SNAPSHOT_DIR"""
+    if not name or os.path.basename(name) != name or name.startswith("."):
+        raise ValueError(f"Invalid snapshot name: {name!r}")
+    return os.path.join(SNAPSHOT_DIR, name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or import a library snapshot")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="Snapshot directory")
+    parser.add_argument("--book-id", action="append", dest="book_ids", help="Limit to this book (repeatable)")
+    parser.add_argument("--batch-size", type=int, default=SNAPSHOT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+
+    def report(count):
+        print(f"\r{count} chunks", end="", flush=True)
+
+    if args.command == "export":
+        manifest = export_snapshot(args.path, args.book_ids, args.batch_size, progress=report)
+        print(f"\nExported {manifest['books']} books, {manifest['chapters']} chapters, "
+              f"{manifest['chunks']} chunks to {args.path} in {time.perf_counter() - start:.1f}s")
+    else:
+        count = import_snapshot(args.path, args.book_ids, args.batch_size, progress=report)
+        print(f"\nImported {count} chunks from {args.path} in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,23 @@
+import hashlib
 import numpy as np
+import re
+import unicodedata
 import uuid
+from typing import Optional
 
 def generate_id():
     """Generate a unique ID"""
     return str(uuid.uuid4())
 
-def generate_embedding(text: str) -> list:
+def normalize_text(text: str) -> str:
+    """Normalize text for content comparison: Unicode NFKC and collapsed whitespace"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+def content_hash(text: str) -> str:
+    """Hash of the normalized text, used to detect duplicate chunks"""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+def generate_embedding(text: str) -> np.ndarray:
     """
     Generate a vector embedding for a given text.
     
@@ -13,7 +25,24 @@ def generate_embedding(text: str) -> list:
         text: The text to embed
         
     Returns:
-        A list of floats representing the embedding vector
+        A float32 array representing the embedding vector
+    """
+    from .vectors import embed_texts
+    return embed_texts([text])[0]
+
+def generate_embeddings(texts: list, model: Optional[str] = None, dimension: Optional[int] = None) -> np.ndarray:
+    """
+    Generate embeddings for a batch of texts.
+    
+    Runs in the job process pool, so it must stay importable without the rest of the app.
+    
+    Args:
+        texts: The texts to embed
+        model: Embedding model; defaults to EMBEDDING_MODEL
+        dimension: Dimension of the model's vectors; defaults to 768
+        
+    Returns:
+        A (len(texts), dimension) float32 matrix of embeddings
     """
-    # TO DO: implement embedding generation using Pinecone
-    pass
+    from .vectors import embed_texts, EMBEDDING_MODEL, VECTOR_DIM
+    return embed_texts(texts, model=model or EMBEDDING_MODEL, dimension=dimension or VECTOR_DIM)
@@ -0,0 +1,84 @@
+import os
+import threading
+import numpy as np
+from dotenv import load_dotenv
+
+# Vector handling for the embedding pipeline.
+#
+# Embeddings stay contiguous float32 NumPy matrices of shape (n, dim) from
+# the model through batching and normalization; they are converted to Python
+# lists only at the vector store client boundary.
+
+load_dotenv()
+
+VECTOR_DIM = 768
+# Model name meaning "no model": every text gets the placeholder vector
+PLACEHOLDER_MODEL = "placeholder"
+# sentence-transformers model of the initial embedding version, e.g.
+# "sentence-transformers/all-mpnet-base-v2". Later versions are created through
+# the embedding version API, which records their model and dimension.
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL") or PLACEHOLDER_MODEL
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
+# Vector stores require at least one non-zero value, so records without a real
+# embedding (books, chapters, chunks while embeddings are disabled) use this one
+PLACEHOLDER_VECTOR = np.zeros(VECTOR_DIM, dtype=np.float32)
+PLACEHOLDER_VECTOR[0] = 1.0
+PLACEHOLDER_VECTOR.setflags(write=False)
+
+_models = {}
+_model_lock = threading.Lock()
+
+
+def get_model(name):
+    """Load a sentence-transformers model once per process"""
+    with _model_lock:
+        if name not in _models:
+            from sentence_transformers import SentenceTransformer
+            _models[name] = SentenceTransformer(name)
+        return _models[name]
+
+
+def as_matrix(values, dimension=VECTOR_DIM):
+    """View vectors (a single vector, a list of vectors or a matrix) as a contiguous float32 matrix"""
+    matrix = np.ascontiguousarray(np.asarray(values, dtype=np.float32))
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    if matrix.shape[1] != dimension:
+        raise ValueError(f"Expected {dimension}-dimensional vectors, got {matrix.shape[1]}")
+    return matrix
+
+
+def placeholder_matrix(count, dimension=VECTOR_DIM):
+    """Matrix of placeholder vectors"""
+    matrix = np.zeros((count, dimension), dtype=np.float32)
+    matrix[:, 0] = 1.0
+    return matrix
+
+
+def normalize_rows(matrix):
+    """L2-normalize the rows of a matrix in place; zero rows are left untouched"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def embed_texts(texts, model=EMBEDDING_MODEL, dimension=VECTOR_DIM):
+    """Embed texts into a normalized (len(texts), dimension) float32 matrix"""
+    if not texts:
+        return np.empty((0, dimension), dtype=np.float32)
+    if model == PLACEHOLDER_MODEL:
+        return placeholder_matrix(len(texts), dimension)
+
+    embeddings = get_model(model).encode(
+        list(texts),
+        batch_size=EMBEDDING_BATCH_SIZE,
+        convert_to_numpy=True,
+        show_progress_bar=False
+    )
+    return normalize_rows(as_matrix(embeddings, dimension))
+
+
+def to_wire(matrix):
+    """Convert a matrix to nested Python lists for clients that need them"""
+    return matrix.tolist()